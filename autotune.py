@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自动调优配置
+rmbg.py --autotune 在本机用合成图片运行简短的基准测试，选出最快的设备、线程数、推理引擎和预取张数，
+按主机保存到配置档案；之后的运行自动读取档案，命令行显式指定的参数优先。
+
+档案为JSON，按主机名分组，每台主机下按 模型|权重|输入尺寸 保存一组配置。
+CPU核数、PyTorch版本或GPU型号与调优时不同时档案视为过期，不再使用。
+"""
+
+import os
+import json
+import time
+import platform
+import statistics
+from typing import Callable, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+
+DEFAULT_PROFILE_FILE = "models/autotune_profile.json"
+TUNED_KEYS = ("device", "threads", "engine", "prefetch")
+PREFETCH_CANDIDATES = (1, 2, 4, 8)
+# 耗时相差不到这个比例时取资源占用较小的候选（更少的线程、更少的预取）
+TIE_TOLERANCE = 0.05
+
+
+def resolve_profile_path(path: Optional[str]) -> str:
+    """相对路径相对于项目根目录"""
+    path = path or DEFAULT_PROFILE_FILE
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+
+def host_name() -> str:
+    return platform.node() or "unknown-host"
+
+
+def host_signature() -> Dict:
+    """影响最佳配置的硬件和软件信息，任何一项变化都需要重新调优"""
+    return {
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+    }
+
+
+def profile_key(model_kind: str, weights: Optional[str], size: int) -> str:
+    weights_name = os.path.basename(weights) if weights else "-"
+    return f"{model_kind}|{weights_name}|{size}"
+
+
+def _read_profile_file(path: str) -> Dict:
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[警告] 自动调优档案读取失败，将忽略: {path} ({e})")
+        return {}
+
+
+def load_profile(path: Optional[str], key: str) -> Optional[Dict]:
+    """
+    读取本机对应 key 的调优结果
+
+    Returns:
+        配置字典（device/threads/engine/prefetch 等），没有可用的档案时返回None
+    """
+    path = resolve_profile_path(path)
+    host = _read_profile_file(path).get(host_name())
+    if not host or key not in host.get("configs", {}):
+        return None
+    if host.get("signature") != host_signature():
+        print(f"[警告] 本机硬件或PyTorch版本与自动调优时不同，忽略档案，请重新运行 --autotune")
+        return None
+    return host["configs"][key]
+
+
+def save_profile(path: Optional[str], key: str, entry: Dict) -> str:
+    """写入本机的调优结果，保留其他主机和其他模型的记录；先写临时文件再原子改名"""
+    path = resolve_profile_path(path)
+    profiles = _read_profile_file(path)
+    host = profiles.setdefault(host_name(), {})
+    if host.get("signature") != host_signature():
+        # 硬件变化后旧的结果都已过期
+        host["configs"] = {}
+    host["signature"] = host_signature()
+    host.setdefault("configs", {})[key] = entry
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def thread_candidates(cpu_count: Optional[int] = None) -> List[int]:
+    """1、2、4…直到核数，再加上核数本身和一半（超线程机器上物理核数常常更快）"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    candidates = {cpu_count, max(1, cpu_count // 2)}
+    threads = 1
+    while threads < cpu_count:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def write_synthetic_images(output_dir: str, count: int, size: int, seed: int = 0) -> List[str]:
+    """生成 size x size 的合成图片（噪声渐变背景 + 随机椭圆），返回文件路径"""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0.0, 1.0, size)[None, :, None]
+    paths = []
+    for index in range(count):
+        start, end = rng.integers(0, 256, size=(2, 3))
+        image = start * (1 - ramp) + end * ramp + rng.normal(0, 12, size=(size, size, 3))
+        image = np.clip(image, 0, 255).astype(np.uint8)
+        for _ in range(3):
+            center = tuple(int(c) for c in rng.integers(size // 5, size * 4 // 5, size=2))
+            axes = tuple(int(a) for a in rng.integers(size // 12, size // 4, size=2))
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            cv2.ellipse(image, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+        path = os.path.join(output_dir, f"autotune_{index:03d}.png")
+        Image.fromarray(image).save(path)
+        paths.append(path)
+    return paths
+
+
+def median_seconds(fn: Callable[[], None], runs: int, warmup: int = 1) -> float:
+    """预热后运行 runs 次，返回耗时中位数（秒）"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(max(1, runs)):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def choose_fastest(results: Sequence[Dict], cost_key: str = "seconds") -> Dict:
+    """
+    选出最快的候选；与最快者相差不到 TIE_TOLERANCE 的候选中取排在最前的
+    （调用方按资源占用从小到大排列候选）
+    """
+    best = min(result[cost_key] for result in results)
+    for result in results:
+        if result[cost_key] <= best * (1 + TIE_TOLERANCE):
+            return result
+    return results[0]
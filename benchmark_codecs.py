@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+输出编码基准测试
+对同一张图片的掩码和透明图，分别测试各输出编码（不同级别的PNG、无损WebP、npy）的编码耗时和文件大小，
+用于为 rmbg.py 的 --codec / --png-level 选择合适的参数
+"""
+
+import os
+import time
+import argparse
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from rmbg import load_config, get_config_value, load_rgb_array, write_image_array, OUTPUT_CODECS
+
+
+# (名称, 编码, PNG压缩级别, WebP method)
+BENCHMARK_CASES = [
+    ("png-0", "png", 0, None),
+    ("png-1", "png", 1, None),
+    ("png-3", "png", 3, None),
+    ("png-6 (默认)", "png", 6, None),
+    ("png-9", "png", 9, None),
+    ("webp无损-m0", "webp", None, 0),
+    ("webp无损-m4", "webp", None, 4),
+    ("npy", "npy", None, None),
+]
+
+
+def synthetic_mask(height: int, width: int) -> np.ndarray:
+    """没有真实掩码时生成带软边缘的圆形掩码"""
+    yy, xx = np.mgrid[0:height, 0:width]
+    radius = min(height, width) * 0.35
+    distance = np.hypot(yy - height / 2, xx - width / 2)
+    return np.clip((radius - distance) * 8 + 128, 0, 255).astype(np.uint8)
+
+
+def time_encode(array: np.ndarray, out_path: str, codec: str, level: Optional[int],
+                method: Optional[int], repeat: int) -> float:
+    """多次编码取最短耗时（秒）"""
+    kwargs = {}
+    if level is not None:
+        kwargs["compress_level"] = level
+    if method is not None:
+        kwargs["webp_method"] = method
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        write_image_array(array, out_path, codec, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(rgb: np.ndarray, mask: np.ndarray, repeat: int = 3) -> List[Dict]:
+    """
+    对掩码和透明图分别测试所有编码
+
+    Returns:
+        [{"codec", "target", "seconds", "bytes"}, ...]
+    """
+    rgba = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+    rgba[..., :3] = rgb
+    rgba[..., 3] = mask
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for target, array in (("mask", mask), ("rgba", rgba)):
+            for name, codec, level, method in BENCHMARK_CASES:
+                out_path = os.path.join(tmp_dir, f"{target}{OUTPUT_CODECS[codec]}")
+                seconds = time_encode(array, out_path, codec, level, method, repeat)
+                results.append({
+                    "codec": name,
+                    "target": target,
+                    "seconds": seconds,
+                    "bytes": os.path.getsize(out_path),
+                })
+    return results
+
+
+def print_results(results: List[Dict], shape) -> None:
+    """按目标分组打印，耗时和大小同时给出相对默认PNG的比例"""
+    print(f"\n图片尺寸: {shape[1]}x{shape[0]}")
+    for target in ("mask", "rgba"):
+        rows = [row for row in results if row["target"] == target]
+        baseline = next(row for row in rows if row["codec"].startswith("png-6"))
+        print(f"\n[{'掩码' if target == 'mask' else '透明图'}]")
+        print(f"{'编码':<16}{'耗时(ms)':>10}{'相对耗时':>10}{'大小(KB)':>12}{'相对大小':>10}")
+        for row in rows:
+            print(f"{row['codec']:<16}{row['seconds'] * 1000:>10.1f}"
+                  f"{row['seconds'] / baseline['seconds']:>9.2f}x"
+                  f"{row['bytes'] / 1024:>12.1f}"
+                  f"{row['bytes'] / baseline['bytes']:>9.2f}x")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='测试各输出编码的编码耗时和文件大小')
+    parser.add_argument('--image', default=None, help='测试图片，默认读取config.json的INPUT_PATH')
+    parser.add_argument('--mask', default=None, help='掩码图片，不提供时生成合成掩码')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('--repeat', type=int, default=3, help='每种编码重复次数（取最短耗时）')
+
+    args = parser.parse_args()
+
+    image_path = args.image or get_config_value(load_config(args.config), "图片去背景", "INPUT_PATH", "input/test.png")
+    if not os.path.exists(image_path):
+        print(f"错误: 图片不存在: {image_path}")
+        return
+
+    rgb = load_rgb_array(image_path)
+    if args.mask:
+        mask = np.asarray(Image.open(args.mask).convert('L').resize((rgb.shape[1], rgb.shape[0])))
+    else:
+        mask = synthetic_mask(*rgb.shape[:2])
+
+    print(f"测试图片: {image_path}，掩码: {args.mask or '合成'}")
+    print_results(run_benchmark(rgb, mask, args.repeat), rgb.shape)
+
+
+if __name__ == "__main__":
+    main()
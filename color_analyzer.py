@@ -8,24 +8,134 @@
 import json
 import os
 import re
+import hashlib
+import glob
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 import numpy as np
-from collections import Counter
 from typing import List, Tuple, Optional, Dict
 import argparse
 
+from intermediate import is_intermediate, load_intermediate
+
+
+# 像素数达到该值时使用2^24稠密表计数，否则使用排序计数
+COLOR_TABLE_MIN_PIXELS = 1 << 20
+
+# 选择区分颜色时每次向量化比较的候选颜色数
+COLOR_SELECT_CHUNK = 4096
+
+# 调色板模式默认抽样像素数和聚类颜色数
+DEFAULT_SAMPLE_SIZE = 20000
+DEFAULT_PALETTE_SIZE = 8
+
+# 分析结果磁盘缓存目录和最多保留的条目数（超出时删除最久未使用的条目）
+DEFAULT_CACHE_DIR = "output/color_cache"
+DEFAULT_CACHE_MAX_ENTRIES = 256
+
+# 目录级分析时直方图每个颜色通道保留的位数（5位即32^3个颜色桶）
+HISTOGRAM_BITS = 5
+
+# 目录级分析聚合结果的默认保存路径
+DEFAULT_AGGREGATE_FILE = "output/color_catalog.npz"
+
+# 分析算法版本，算法变化导致结果不同时递增，使旧缓存失效
+ANALYSIS_VERSION = 1
+
+
+def load_rgb_array(image_path: str) -> np.ndarray:
+    """
+    读取图片的RGB像素数组
+    
+    .npy中间结果（rmbg.py --codec npy 的输出）用内存映射打开，返回RGB通道的视图，不做整图拷贝；
+    其他格式用PIL解码并转换为RGB
+    
+    Args:
+        image_path: 图片路径
+        
+    Returns:
+        (H, W, 3) 的uint8数组
+    """
+    if is_intermediate(image_path):
+        array = load_intermediate(image_path)
+        if array.ndim == 2:
+            return np.repeat(array[:, :, None], 3, axis=2)
+        return array[:, :, :3]
+    with Image.open(image_path) as img:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        return np.asarray(img)
+
+
+def compute_color_histogram(image_path: str) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    计算单张图片的量化颜色直方图（模块级函数，供进程池调用）
+    
+    Args:
+        image_path: 图片路径
+        
+    Returns:
+        稀疏直方图 (bins, counts, sums)：非空颜色桶编号、桶内像素数、桶内像素RGB之和，
+        读取失败时返回None
+    """
+    try:
+        pixels = load_rgb_array(image_path).reshape(-1, 3).astype(np.int64)
+    except Exception as e:
+        print(f"分析图片 {image_path} 失败: {e}")
+        return None
+    
+    bits = HISTOGRAM_BITS
+    shift = 8 - bits
+    quantized = ((pixels[:, 0] >> shift) << (2 * bits)) | ((pixels[:, 1] >> shift) << bits) | (pixels[:, 2] >> shift)
+    size = 1 << (3 * bits)
+    
+    counts = np.bincount(quantized, minlength=size)
+    bins = np.flatnonzero(counts)
+    sums = np.stack([
+        np.bincount(quantized, weights=pixels[:, c], minlength=size)[bins] for c in range(3)
+    ], axis=1)
+    return bins.astype(np.int32), counts[bins].astype(np.int64), sums.astype(np.int64)
+
+
+def _image_signature(image_path: str) -> List[int]:
+    """文件大小和修改时间，用于判断目录聚合中的图片是否已变化"""
+    stat = os.stat(image_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
 
 class ColorAnalyzer:
     """颜色分析器"""
     
-    def __init__(self, config_file: str = "config.json"):
+    def __init__(self, config_file: str = "config.json", mode: str = "exact",
+                 sample_size: int = DEFAULT_SAMPLE_SIZE, palette_size: int = DEFAULT_PALETTE_SIZE,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 cache_max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+                 background_only: bool = False, mask_path: Optional[str] = None):
         """
         初始化颜色分析器
         
         Args:
             config_file: 配置文件路径
+            mode: 分析模式，exact=精确颜色计数，palette=Lab空间调色板聚类
+            sample_size: 调色板模式的抽样像素数
+            palette_size: 调色板模式的聚类颜色数
+            cache_dir: 分析结果磁盘缓存目录，None表示只使用内存缓存
+            cache_max_entries: 磁盘缓存最多保留的条目数
+            background_only: 是否只统计背景像素（使用rmbg.py生成的蒙版排除前景）
+            mask_path: 蒙版路径，不提供时从配置文件读取
         """
         self.config_file = config_file
+        self.mode = mode
+        self.sample_size = sample_size
+        self.palette_size = palette_size
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.background_only = background_only
+        self.mask_path = mask_path
+        # 内存缓存：文件状态 -> 内容哈希，蒙版文件状态 -> (背景掩码, 掩码哈希)，缓存key -> 分析结果
+        self._file_hashes = {}
+        self._mask_backgrounds = {}
+        self._memo = {}
         self.config = None
         self.load_config()
     
@@ -87,97 +197,550 @@ class ColorAnalyzer:
             return False
         
         # 常见的图片文件扩展名
-        image_extensions = {'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp'}
+        image_extensions = {'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp', '.npy'}
         _, ext = os.path.splitext(path.lower())
         return ext in image_extensions
     
-    def analyze_image_colors(self, image_path: str) -> Dict[str, str]:
+    def get_mask_path_from_config(self) -> Optional[str]:
+        """
+        从配置文件中获取rmbg.py输出的蒙版路径
+        
+        Returns:
+            蒙版路径，未找到时返回None
+        """
+        if not self.config:
+            return None
+        
+        mask_path = self.config.get('4图合并提取元素', {}).get('MASK_PATH', '')
+        if not mask_path:
+            output_path = self.config.get('图片去背景', {}).get('OUTPUT_PATH', '')
+            if output_path:
+                mask_path = os.path.join(output_path, 'mask.png')
+        return mask_path or None
+    
+    def _load_background(self, mask: Optional[np.ndarray]) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        准备背景像素掩码
+        
+        Args:
+            mask: 内存中的蒙版数组（前景为高值），None时按配置读取蒙版文件；
+                  蒙版文件同一进程内按 (路径, 修改时间, 大小) 记忆，多张图片共用时只解码和哈希一次
+            
+        Returns:
+            (background, mask_hash)：背景为True的布尔数组及其哈希（用于缓存key），
+            不使用蒙版时均为None
+        """
+        if mask is not None:
+            return self._background_from_mask(mask)
+        if not self.background_only:
+            return None, None
+        mask_path = self.mask_path or self.get_mask_path_from_config()
+        if not mask_path or not os.path.exists(mask_path):
+            print(f"警告：蒙版文件不存在: {mask_path}，将分析全部像素")
+            return None, None
+        
+        stat = os.stat(mask_path)
+        file_key = (os.path.abspath(mask_path), stat.st_mtime_ns, stat.st_size)
+        if file_key not in self._mask_backgrounds:
+            if is_intermediate(mask_path):
+                mask = load_intermediate(mask_path)
+            else:
+                with Image.open(mask_path) as mask_img:
+                    mask = np.asarray(mask_img.convert('L'))
+            self._mask_backgrounds[file_key] = self._background_from_mask(mask)
+        return self._mask_backgrounds[file_key]
+    
+    def _background_from_mask(self, mask: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """由蒙版数组得到背景掩码及其哈希，没有背景像素时均为None"""
+        mask = np.asarray(mask)
+        if mask.ndim == 3:
+            mask = mask[:, :, -1]
+        background = mask < 128
+        if not background.any():
+            print("警告：蒙版中没有背景像素，将分析全部像素")
+            return None, None
+        
+        digest = hashlib.blake2b(str(background.shape).encode(), digest_size=20)
+        digest.update(np.packbits(background).tobytes())
+        return background, digest.hexdigest()
+    
+    def _fit_background(self, background: np.ndarray, height: int, width: int) -> np.ndarray:
+        """
+        将背景掩码缩放到图片尺寸（最近邻）
+        
+        Args:
+            background: 背景布尔数组
+            height: 图片高度
+            width: 图片宽度
+            
+        Returns:
+            与图片同尺寸的背景布尔数组
+        """
+        if background.shape == (height, width):
+            return background
+        resized = Image.fromarray(background.astype(np.uint8) * 255).resize((width, height), Image.NEAREST)
+        return np.asarray(resized) > 0
+    
+    def analyze_image_colors(self, image_path: str, mask: Optional[np.ndarray] = None) -> Dict[str, str]:
         """
         分析图片的主要颜色，返回占比最大的3个颜色，按占比排序
         
         Args:
             image_path: 图片路径
+            mask: 可选的蒙版数组（如rmbg.py推理得到的掩码），提供时只统计背景像素；
+                  不提供且开启background_only时从蒙版文件读取
+            
+        Returns:
+            颜色字典，key为backgroundColor1/2/3，value为rgba格式色值
+        """
+        background, mask_hash = self._load_background(mask)
+        
+        cache_key = self._cache_key(image_path, mask_hash)
+        if cache_key is not None:
+            cached = self._load_cached_result(cache_key)
+            if cached is not None:
+                return dict(cached)
+        
+        if self.mode == "palette":
+            result = self.analyze_image_palette(image_path, background)
+        else:
+            result = self._analyze_exact_colors(image_path, background)
+        
+        if result and cache_key is not None:
+            self._store_cached_result(cache_key, result)
+        return result
+    
+    def _analyze_exact_colors(self, image_path: str, background: Optional[np.ndarray] = None) -> Dict[str, str]:
+        """
+        精确颜色计数模式：统计每种RGB颜色的像素数，返回占比最大的3个颜色
+        
+        Args:
+            image_path: 图片路径
+            background: 背景布尔数组，提供时只统计背景像素
             
         Returns:
             颜色字典，key为backgroundColor1/2/3，value为rgba格式色值
         """
         try:
-            # 打开图片
-            with Image.open(image_path) as img:
-                # 转换为RGB模式
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # 获取图片尺寸
-                width, height = img.size
-                
-                # 将图片转换为numpy数组
-                img_array = np.array(img)
-                
-                # 重塑为二维数组，每行代表一个像素的RGB值
+            # 读取RGB像素数组（.npy中间结果为内存映射）
+            img_array = load_rgb_array(image_path)
+            height, width = img_array.shape[:2]
+            
+            # 重塑为二维数组，每行代表一个像素的RGB值；有蒙版时只取背景像素
+            if background is not None:
+                pixels = img_array[self._fit_background(background, height, width)]
+            else:
                 pixels = img_array.reshape(-1, 3)
-                
-                # 统计颜色出现次数
-                color_counts = Counter(map(tuple, pixels))
-                
-                # 获取占比最大的颜色，但需要确保颜色有足够区分度
-                total_pixels = len(pixels)
-                all_colors = color_counts.most_common()
-                
-                # 选择有足够区分度的颜色
-                selected_colors = []
-                min_distance = 30  # 最小颜色距离阈值
-                
-                for color, count in all_colors:
-                    if len(selected_colors) >= 3:
-                        break
-                    
-                    # 检查与已选颜色的距离
-                    is_different = True
-                    for selected_color in selected_colors:
-                        distance = self._color_distance(color, selected_color)
-                        if distance < min_distance:
-                            is_different = False
-                            break
-                    
-                    if is_different:
-                        selected_colors.append(color)
-                
-                # 如果没找到足够的颜色，降低阈值
-                if len(selected_colors) < 3:
-                    min_distance = 15
-                    for color, count in all_colors:
-                        if len(selected_colors) >= 3:
-                            break
-                        
-                        is_different = True
-                        for selected_color in selected_colors:
-                            distance = self._color_distance(color, selected_color)
-                            if distance < min_distance:
-                                is_different = False
-                                break
-                        
-                        if is_different:
-                            selected_colors.append(color)
-                
-                # 构建结果字典
-                result = {}
-                for i, color in enumerate(selected_colors[:3]):
-                    r, g, b = color
-                    rgba_color = f"rgba({r}, {g}, {b}, 1.0)"
-                    
-                    if i == 0:
-                        result['backgroundColor1'] = rgba_color
-                    elif i == 1:
-                        result['backgroundColor2'] = rgba_color
-                    elif i == 2:
-                        result['backgroundColor3'] = rgba_color
-                
-                return result
-                
+            
+            # 统计颜色出现次数（按占比降序，占比相同时按首次出现顺序）
+            colors, counts = self._count_colors(pixels)
+            
+            # 选择有足够区分度的颜色，没找到足够的颜色时降低阈值
+            selected_colors = self._select_distinct_colors(colors, [], 30)
+            if len(selected_colors) < 3:
+                selected_colors = self._select_distinct_colors(colors, selected_colors, 15)
+            
+            # 构建结果字典
+            return self._colors_to_result(selected_colors)
+            
+        except Exception as e:
+            print(f"分析图片 {image_path} 失败: {e}")
+            return {}
+    
+    def _file_content_hash(self, image_path: str) -> Optional[str]:
+        """
+        计算文件内容哈希，同一进程内按 (路径, 修改时间, 大小) 记忆，不重复读取文件
+        
+        Args:
+            image_path: 图片路径
+            
+        Returns:
+            十六进制哈希值，文件不可读时返回None
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        
+        file_key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+        if file_key not in self._file_hashes:
+            digest = hashlib.blake2b(digest_size=20)
+            with open(image_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            self._file_hashes[file_key] = digest.hexdigest()
+        return self._file_hashes[file_key]
+    
+    def _cache_key(self, image_path: str, mask_hash: Optional[str] = None) -> Optional[str]:
+        """
+        由文件内容哈希和分析参数生成缓存key
+        
+        Args:
+            image_path: 图片路径
+            mask_hash: 背景掩码哈希，只统计背景像素时提供
+            
+        Returns:
+            缓存key，文件不可读时返回None
+        """
+        content_hash = self._file_content_hash(image_path)
+        if content_hash is None:
+            return None
+        
+        params = {'version': ANALYSIS_VERSION, 'mode': self.mode}
+        if self.mode == "palette":
+            params.update(sample_size=self.sample_size, palette_size=self.palette_size)
+        if mask_hash is not None:
+            params['mask'] = mask_hash
+        params_str = json.dumps(params, sort_keys=True)
+        return hashlib.blake2b(f"{content_hash}:{params_str}".encode(), digest_size=20).hexdigest()
+    
+    def _load_cached_result(self, cache_key: str) -> Optional[Dict[str, str]]:
+        """
+        依次查找内存缓存和磁盘缓存
+        
+        Args:
+            cache_key: 缓存key
+            
+        Returns:
+            缓存的分析结果，未命中时返回None
+        """
+        if cache_key in self._memo:
+            return self._memo[cache_key]
+        
+        if not self.cache_dir:
+            return None
+        
+        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            # 更新访问时间，淘汰时按最久未使用的顺序删除
+            os.utime(cache_file)
+        except (OSError, ValueError):
+            return None
+        
+        self._memo[cache_key] = result
+        return result
+    
+    def _store_cached_result(self, cache_key: str, result: Dict[str, str]) -> None:
+        """
+        写入内存缓存和磁盘缓存，磁盘条目超出上限时淘汰最久未使用的条目
+        
+        Args:
+            cache_key: 缓存key
+            result: 分析结果
+        """
+        self._memo[cache_key] = dict(result)
+        
+        if not self.cache_dir:
+            return
+        
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+            
+            entries = [
+                os.path.join(self.cache_dir, name)
+                for name in os.listdir(self.cache_dir) if name.endswith('.json')
+            ]
+            if len(entries) > self.cache_max_entries:
+                entries.sort(key=lambda path: os.stat(path).st_mtime_ns)
+                for path in entries[:len(entries) - self.cache_max_entries]:
+                    os.remove(path)
+        except OSError as e:
+            print(f"写入颜色分析缓存失败: {e}")
+    
+    def _colors_to_result(self, selected_colors: List[Tuple[int, int, int]]) -> Dict[str, str]:
+        """
+        将选中的颜色转换为结果字典
+        
+        Args:
+            selected_colors: 按占比排序的颜色列表
+            
+        Returns:
+            颜色字典，key为backgroundColor1/2/3，value为rgba格式色值
+        """
+        result = {}
+        for i, color in enumerate(selected_colors[:3]):
+            r, g, b = color
+            rgba_color = f"rgba({r}, {g}, {b}, 1.0)"
+            
+            if i == 0:
+                result['backgroundColor1'] = rgba_color
+            elif i == 1:
+                result['backgroundColor2'] = rgba_color
+            elif i == 2:
+                result['backgroundColor3'] = rgba_color
+        
+        return result
+    
+    def analyze_image_palette(self, image_path: str, background: Optional[np.ndarray] = None) -> Dict[str, str]:
+        """
+        调色板模式：在Lab感知颜色空间中对分层抽样的像素做聚类，返回占比最大的3个颜色
+        
+        Args:
+            image_path: 图片路径
+            background: 背景布尔数组，提供时只统计背景像素
+            
+        Returns:
+            颜色字典，key为backgroundColor1/2/3，value为rgba格式色值
+        """
+        palette = self.extract_palette(image_path, background)
+        if not palette:
+            return {}
+        
+        print(f"  抽样像素: {palette['sample_size']}，"
+              f"占比误差(95%): ±{palette['ratio_error'] * 100:.2f}%，"
+              f"平均量化误差 ΔE: {palette['mean_delta_e']:.2f}")
+        
+        colors = np.array([color for color, _ in palette['colors']], dtype=np.int64).reshape(-1, 3)
+        selected_colors = self._select_distinct_colors(colors, [], 30)
+        if len(selected_colors) < 3:
+            selected_colors = self._select_distinct_colors(colors, selected_colors, 15)
+        return self._colors_to_result(selected_colors)
+    
+    def extract_palette(self, image_path: str, background: Optional[np.ndarray] = None) -> Dict:
+        """
+        提取图片调色板：分层抽样 -> 转换到Lab -> 中位切分 -> k-means细化
+        
+        Args:
+            image_path: 图片路径
+            background: 背景布尔数组，提供时只保留落在背景上的抽样像素
+            
+        Returns:
+            调色板字典：
+            - colors: [((r, g, b), 占比), ...]，按占比降序
+            - sample_size: 实际抽样像素数
+            - ratio_error: 占比估计的95%误差上界（使用全部像素时为0）
+            - mean_delta_e: 抽样像素到所属聚类中心的平均Lab距离
+        """
+        try:
+            if is_intermediate(image_path):
+                # 内存映射的中间结果，分层抽样只读取被抽中的像素
+                img_array = load_rgb_array(image_path)
+            else:
+                with Image.open(image_path) as img:
+                    # 大尺寸JPEG直接按缩小尺寸解码，其余格式不受影响
+                    width, height = img.size
+                    scale = int((width * height / (self.sample_size * 16)) ** 0.5)
+                    if scale >= 2:
+                        img.draft('RGB', (width // scale, height // scale))
+                    if img.mode != 'RGB':
+                        img = img.convert('RGB')
+                    img_array = np.array(img)
         except Exception as e:
             print(f"分析图片 {image_path} 失败: {e}")
             return {}
+        
+        if background is not None:
+            background = self._fit_background(background, img_array.shape[0], img_array.shape[1])
+        pixels = self._stratified_sample(img_array, self.sample_size, background)
+        if len(pixels) == 0:
+            print(f"分析图片 {image_path} 失败: 没有可用的背景像素")
+            return {}
+        lab = self._rgb_to_lab(pixels)
+        labels, centers = self._median_cut(lab, self.palette_size)
+        
+        counts = np.bincount(labels, minlength=len(centers))
+        order = np.argsort(-counts, kind='stable')
+        colors = []
+        for idx in order:
+            if counts[idx] == 0:
+                continue
+            mean_rgb = pixels[labels == idx].mean(axis=0)
+            colors.append((tuple(int(v) for v in np.round(mean_rgb)), float(counts[idx]) / len(pixels)))
+        
+        total_pixels = int(background.sum()) if background is not None else img_array.shape[0] * img_array.shape[1]
+        ratio_error = 0.0 if len(pixels) >= total_pixels else 1.96 * (0.25 / len(pixels)) ** 0.5
+        delta_e = np.sqrt(((lab - centers[labels]) ** 2).sum(axis=1))
+        
+        return {
+            'colors': colors,
+            'sample_size': int(len(pixels)),
+            'ratio_error': ratio_error,
+            'mean_delta_e': float(delta_e.mean())
+        }
+    
+    def _stratified_sample(self, img_array: np.ndarray, sample_size: int,
+                           background: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        分层抽样：把图片划分为约sample_size个网格，每个网格随机取一个像素
+        
+        Args:
+            img_array: 形状为 (H, W, 3) 的图片数组
+            sample_size: 目标抽样数
+            background: 背景布尔数组，提供时丢弃落在前景上的抽样点
+            
+        Returns:
+            形状为 (N, 3) 的像素数组
+        """
+        height, width = img_array.shape[:2]
+        if background is not None:
+            background = self._fit_background(background, height, width)
+        if sample_size >= height * width:
+            if background is not None:
+                return img_array[background]
+            return img_array.reshape(-1, 3)
+        
+        grid_h = int(min(height, max(1, round((sample_size * height / width) ** 0.5))))
+        grid_w = int(min(width, max(1, sample_size // grid_h)))
+        
+        # 固定随机种子，保证同一图片的结果稳定
+        rng = np.random.default_rng(0)
+        row_start = (np.arange(grid_h) * height) // grid_h
+        row_end = ((np.arange(grid_h) + 1) * height) // grid_h
+        col_start = (np.arange(grid_w) * width) // grid_w
+        col_end = ((np.arange(grid_w) + 1) * width) // grid_w
+        
+        rows = row_start[:, None] + (rng.random((grid_h, grid_w)) * (row_end - row_start)[:, None]).astype(np.int64)
+        cols = col_start[None, :] + (rng.random((grid_h, grid_w)) * (col_end - col_start)[None, :]).astype(np.int64)
+        rows, cols = rows.ravel(), cols.ravel()
+        if background is not None:
+            keep = background[rows, cols]
+            rows, cols = rows[keep], cols[keep]
+        return img_array[rows, cols]
+    
+    def _rgb_to_lab(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        sRGB (D65) 转换到CIE Lab
+        
+        Args:
+            pixels: 形状为 (N, 3) 的RGB数组，范围0-255
+            
+        Returns:
+            形状为 (N, 3) 的Lab数组
+        """
+        rgb = pixels.astype(np.float64) / 255.0
+        linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+        xyz = linear @ np.array([
+            [0.4124564, 0.2126729, 0.0193339],
+            [0.3575761, 0.7151522, 0.1191920],
+            [0.1804375, 0.0721750, 0.9503041],
+        ])
+        xyz /= np.array([0.95047, 1.0, 1.08883])
+        
+        delta = 6.0 / 29.0
+        f = np.where(xyz > delta ** 3, np.cbrt(xyz), xyz / (3 * delta * delta) + 4.0 / 29.0)
+        return np.stack([
+            116.0 * f[:, 1] - 16.0,
+            500.0 * (f[:, 0] - f[:, 1]),
+            200.0 * (f[:, 1] - f[:, 2]),
+        ], axis=1)
+    
+    def _median_cut(self, lab: np.ndarray, n_colors: int, refine_iterations: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Lab空间中位切分聚类，再用几轮k-means细化
+        
+        Args:
+            lab: 形状为 (N, 3) 的Lab数组
+            n_colors: 聚类数上限
+            refine_iterations: k-means细化轮数
+            
+        Returns:
+            (labels, centers)：每个像素的聚类编号和聚类中心
+        """
+        boxes = [np.arange(len(lab))]
+        while len(boxes) < n_colors:
+            # 切分 (最大跨度 × 像素数) 最大的盒子
+            scores = [np.ptp(lab[box], axis=0).max() * len(box) if len(box) > 1 else 0.0 for box in boxes]
+            target = int(np.argmax(scores))
+            if scores[target] <= 0:
+                break
+            box = boxes.pop(target)
+            axis = int(np.argmax(np.ptp(lab[box], axis=0)))
+            ordered = box[np.argsort(lab[box, axis], kind='stable')]
+            middle = len(ordered) // 2
+            boxes.extend([ordered[:middle], ordered[middle:]])
+        
+        centers = np.array([lab[box].mean(axis=0) for box in boxes])
+        labels = np.zeros(len(lab), dtype=np.int64)
+        for box_idx, box in enumerate(boxes):
+            labels[box] = box_idx
+        
+        for _ in range(refine_iterations):
+            distances = ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            new_labels = distances.argmin(axis=1)
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            for c in range(len(centers)):
+                members = lab[labels == c]
+                if len(members):
+                    centers[c] = members.mean(axis=0)
+        
+        return labels, centers
+    
+    def _count_colors(self, pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        统计像素颜色出现次数，把RGB打包成24位整数后做向量化计数
+        
+        Args:
+            pixels: 形状为 (N, 3) 的uint8像素数组
+            
+        Returns:
+            (colors, counts)：colors形状为 (M, 3)，按出现次数降序排列，
+            次数相同时按首次出现的先后排列（与Counter.most_common一致）
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+        keys = (pixels[:, 0].astype(np.uint32) << 16) | (pixels[:, 1].astype(np.uint32) << 8) | pixels[:, 2]
+        
+        if len(keys) >= COLOR_TABLE_MIN_PIXELS:
+            # 大图：在2^24大小的稠密表上计数，避免排序
+            table_counts = np.bincount(keys, minlength=1 << 24)
+            first_index = np.full(1 << 24, len(keys), dtype=np.int64)
+            np.minimum.at(first_index, keys, np.arange(len(keys), dtype=np.int64))
+            unique_keys = np.flatnonzero(table_counts)
+            counts = table_counts[unique_keys]
+            first = first_index[unique_keys]
+        else:
+            unique_keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        
+        order = np.lexsort((first, -counts))
+        unique_keys = unique_keys[order]
+        colors = np.stack([(unique_keys >> 16) & 0xFF, (unique_keys >> 8) & 0xFF, unique_keys & 0xFF], axis=1)
+        return colors.astype(np.int64), counts[order]
+    
+    def _select_distinct_colors(self, colors: np.ndarray, selected: List[Tuple[int, int, int]],
+                                min_distance: float, max_colors: int = 3) -> List[Tuple[int, int, int]]:
+        """
+        按顺序贪心选择与已选颜色距离都不小于min_distance的颜色
+        
+        Args:
+            colors: 形状为 (M, 3) 的候选颜色，按优先级排列
+            selected: 已选颜色列表
+            min_distance: 最小颜色距离阈值
+            max_colors: 最多选择的颜色数
+            
+        Returns:
+            新的已选颜色列表
+        """
+        selected = list(selected)
+        # 只比较距离平方，整数平方和在float64下精确，结果与逐个计算_color_distance一致
+        threshold = float(min_distance) * float(min_distance)
+        
+        for start in range(0, len(colors), COLOR_SELECT_CHUNK):
+            if len(selected) >= max_colors:
+                break
+            block = colors[start:start + COLOR_SELECT_CHUNK].astype(np.float64)
+            min_dist_sq = np.full(len(block), np.inf)
+            for color in selected:
+                diff = block - np.asarray(color, dtype=np.float64)
+                min_dist_sq = np.minimum(min_dist_sq, (diff * diff).sum(axis=1))
+            
+            while len(selected) < max_colors:
+                candidates = np.flatnonzero(min_dist_sq >= threshold)
+                if len(candidates) == 0:
+                    break
+                color = tuple(int(v) for v in colors[start + candidates[0]])
+                selected.append(color)
+                diff = block - np.asarray(color, dtype=np.float64)
+                min_dist_sq = np.minimum(min_dist_sq, (diff * diff).sum(axis=1))
+        
+        return selected
     
     def _color_distance(self, color1: Tuple[int, int, int], color2: Tuple[int, int, int]) -> float:
         """
@@ -267,19 +830,122 @@ class ColorAnalyzer:
         
         return result
 
-    def save_colors_to_json(self, output_file: str = "output/merged_output/colors_output.json") -> bool:
+    def collect_catalog_images(self, pattern: str) -> List[str]:
+        """
+        收集目录或glob模式下的所有图片
+        
+        Args:
+            pattern: 目录路径或glob模式（支持**递归）
+            
+        Returns:
+            排序后的图片路径列表
+        """
+        if os.path.isdir(pattern):
+            paths = [
+                os.path.join(root, name)
+                for root, _, files in os.walk(pattern) for name in files
+            ]
+        else:
+            paths = glob.glob(pattern, recursive=True)
+        return sorted(path for path in paths if os.path.isfile(path) and self._is_image_file(path))
+    
+    def analyze_catalog(self, pattern: str, workers: Optional[int] = None,
+                        aggregate_file: Optional[str] = None, append: bool = False) -> Dict[str, str]:
+        """
+        目录级颜色分析：多进程计算每张图片的量化直方图，合并后得到全局主要颜色
+        
+        Args:
+            pattern: 目录路径或glob模式
+            workers: 进程数，默认为CPU核数
+            aggregate_file: 聚合直方图保存路径（.npz），None表示不保存
+            append: 是否在已保存的聚合结果上追加，已包含且未变化的图片不会重新读取
+            
+        Returns:
+            颜色字典，key为backgroundColor1/2/3，value为rgba格式色值
+        """
+        size = 1 << (3 * HISTOGRAM_BITS)
+        total_counts = np.zeros(size, dtype=np.int64)
+        total_sums = np.zeros((size, 3), dtype=np.int64)
+        signatures = {}
+        
+        if append and aggregate_file and os.path.exists(aggregate_file):
+            with np.load(aggregate_file) as data:
+                total_counts += data['counts']
+                total_sums += data['sums']
+                signatures = json.loads(str(data['images']))
+            print(f"已加载聚合结果: {aggregate_file}（{len(signatures)} 张图片）")
+        
+        image_paths = []
+        for path in self.collect_catalog_images(pattern):
+            key = os.path.abspath(path)
+            if key in signatures:
+                if signatures[key] != _image_signature(path):
+                    print(f"警告：{path} 在聚合后已修改，追加模式无法替换旧数据，已跳过（可去掉 --append 重建）")
+                continue
+            image_paths.append(path)
+        
+        print(f"需要分析 {len(image_paths)} 张图片，进程数: {workers or os.cpu_count()}")
+        
+        if image_paths:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                histograms = executor.map(compute_color_histogram, image_paths, chunksize=4)
+                for path, histogram in zip(image_paths, histograms):
+                    if histogram is None:
+                        continue
+                    bins, counts, sums = histogram
+                    total_counts[bins] += counts
+                    total_sums[bins] += sums
+                    signatures[os.path.abspath(path)] = _image_signature(path)
+                    print(f"  已分析: {path}")
+        
+        if aggregate_file:
+            os.makedirs(os.path.dirname(aggregate_file) or '.', exist_ok=True)
+            tmp_file = f"{aggregate_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, counts=total_counts, sums=total_sums, images=np.array(json.dumps(signatures)))
+            os.replace(tmp_file, aggregate_file)
+            print(f"聚合结果已保存到: {aggregate_file}（{len(signatures)} 张图片）")
+        
+        return self._histogram_to_result(total_counts, total_sums)
+    
+    def _histogram_to_result(self, counts: np.ndarray, sums: np.ndarray) -> Dict[str, str]:
+        """
+        从合并后的量化直方图中选出主要颜色
+        
+        Args:
+            counts: 每个颜色桶的像素数
+            sums: 每个颜色桶的RGB之和
+            
+        Returns:
+            颜色字典，key为backgroundColor1/2/3，value为rgba格式色值
         """
-        将颜色分析结果保存为JSON文件
+        bins = np.flatnonzero(counts)
+        if len(bins) == 0:
+            return {}
+        bins = bins[np.argsort(-counts[bins], kind='stable')]
+        # 颜色桶的代表色为桶内像素的平均颜色
+        colors = np.round(sums[bins] / counts[bins][:, None]).astype(np.int64)
+        
+        selected_colors = self._select_distinct_colors(colors, [], 30)
+        if len(selected_colors) < 3:
+            selected_colors = self._select_distinct_colors(colors, selected_colors, 15)
+        return self._colors_to_result(selected_colors)
+    
+    def save_colors_to_json(self, output_file: str = "output/merged_output/colors_output.json",
+                            colors: Optional[Dict[str, str]] = None) -> bool:
+        """
+        将颜色分析结果保存为JSON文件，不提供colors时使用综合主要颜色
         """
         try:
-            colors = self.get_dominant_colors_summary()
+            if colors is None:
+                colors = self.get_dominant_colors_summary()
             if not colors:
                 print("无颜色数据可保存")
                 return False
             
             # 确保输出目录存在
             output_dir = os.path.dirname(output_file)
-            if not os.path.exists(output_dir):
+            if output_dir and not os.path.exists(output_dir):
                 os.makedirs(output_dir)
                 print(f"创建输出目录: {output_dir}")
             
@@ -320,13 +986,45 @@ def main():
     parser.add_argument('--config', '-c', default='config.json', help='配置文件路径')
     parser.add_argument('--summary', '-s', action='store_true', help='显示综合主要颜色')
     parser.add_argument('--json', '-j', help='保存颜色结果为JSON文件')
+    parser.add_argument('--mode', '-m', default='exact', choices=['exact', 'palette'],
+                        help='分析模式：exact=精确颜色计数，palette=Lab空间抽样聚类（适合噪点/JPEG纹理和大图）')
+    parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE, help='调色板模式的抽样像素数')
+    parser.add_argument('--palette-size', type=int, default=DEFAULT_PALETTE_SIZE, help='调色板模式的聚类颜色数')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='分析结果磁盘缓存目录')
+    parser.add_argument('--no-cache', action='store_true', help='不使用磁盘缓存')
+    parser.add_argument('--background-only', '-b', action='store_true',
+                        help='只统计背景像素（使用rmbg.py生成的蒙版排除前景元素）')
+    parser.add_argument('--mask', default=None, help='蒙版路径，默认读取配置文件中的MASK_PATH')
+    parser.add_argument('--catalog', help='目录级分析：图片目录或glob模式（如 "textures/**/*.png"）')
+    parser.add_argument('--workers', type=int, default=None, help='目录级分析的进程数，默认为CPU核数')
+    parser.add_argument('--aggregate', default=DEFAULT_AGGREGATE_FILE, help='目录级分析聚合直方图的保存路径')
+    parser.add_argument('--append', action='store_true', help='在已保存的聚合结果上追加新图片')
     
     args = parser.parse_args()
     
     # 创建颜色分析器
-    analyzer = ColorAnalyzer(args.config)
+    analyzer = ColorAnalyzer(args.config, mode=args.mode, sample_size=args.sample_size,
+                             palette_size=args.palette_size,
+                             cache_dir=None if args.no_cache else args.cache_dir,
+                             background_only=args.background_only or bool(args.mask), mask_path=args.mask)
     
-    if args.json:
+    if args.catalog:
+        # 目录级分析，结果为所有图片合并后的全局主要颜色
+        print("=" * 50)
+        print("目录级颜色分析")
+        print("=" * 50)
+        
+        catalog_colors = analyzer.analyze_catalog(args.catalog, workers=args.workers,
+                                                  aggregate_file=args.aggregate, append=args.append)
+        if catalog_colors:
+            print(f"\n全局前3个主要颜色:")
+            for key, rgba_color in catalog_colors.items():
+                print(f"{key}: {rgba_color}")
+            if args.json:
+                analyzer.save_colors_to_json(args.json, colors=catalog_colors)
+        else:
+            print("未找到有效的颜色数据")
+    elif args.json:
         # 保存为JSON文件
         success = analyzer.save_colors_to_json(args.json)
         if not success:
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+学生模型蒸馏训练脚本
+用教师模型（官方RMBG-2.0或其他模型）在本地图片目录上生成的掩码训练轻量的StudentRMBG，
+训练结果可通过 rmbg.py --model demo --weights 加载，并输出 吞吐量-IoU 对比报告
+"""
+
+import os
+import json
+import time
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, DataLoader
+from PIL import Image
+
+import rmbg
+
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp'}
+DEFAULT_MASK_DIR = "output/teacher_masks"
+DEFAULT_OUTPUT = "models/student.pth"
+
+
+def list_images(image_dir: str) -> List[str]:
+    """递归列出目录下的所有图片"""
+    paths = []
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+def teacher_mask_path(image_path: str, image_dir: str, mask_dir: str) -> str:
+    """教师掩码路径：与图片相对路径相同，扩展名为.png"""
+    relative = os.path.splitext(os.path.relpath(image_path, image_dir))[0]
+    return os.path.join(mask_dir, relative + ".png")
+
+
+def prepare_teacher_masks(image_paths: List[str], image_dir: str, mask_dir: str,
+                          teacher: Optional[str], teacher_weights: Optional[str],
+                          device: torch.device, size: int) -> List[Tuple[str, str]]:
+    """
+    准备教师掩码：已有的掩码直接使用，缺少的用教师模型推理生成并保存
+
+    Returns:
+        [(图片路径, 掩码路径), ...]，没有掩码且未指定教师模型的图片会被跳过
+    """
+    missing = [path for path in image_paths if not os.path.exists(teacher_mask_path(path, image_dir, mask_dir))]
+    if missing and teacher:
+        print(f"[信息] 使用教师模型 {teacher} 生成 {len(missing)} 个掩码...")
+        if teacher == "official":
+            model = rmbg.load_official_model(device)
+            infer_fn = rmbg.infer_single_image_official
+        else:
+            model = rmbg.load_demo_model(teacher_weights, device)
+            infer_fn = rmbg.infer_single_image_demo
+        for path in missing:
+            out_path = teacher_mask_path(path, image_dir, mask_dir)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            rmbg.save_mask(infer_fn(model, path, device, size), out_path)
+        del model
+    elif missing:
+        print(f"[警告] {len(missing)} 张图片没有教师掩码且未指定 --teacher，已跳过")
+
+    pairs = []
+    for path in image_paths:
+        mask_path = teacher_mask_path(path, image_dir, mask_dir)
+        if os.path.exists(mask_path):
+            pairs.append((path, mask_path))
+    return pairs
+
+
+class DistillDataset(Dataset):
+    """图片与教师软掩码对，缩放到训练尺寸，训练时随机翻转"""
+
+    def __init__(self, pairs: List[Tuple[str, str]], size: int, augment: bool = False):
+        self.pairs = pairs
+        self.size = size
+        self.augment = augment
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def __getitem__(self, index: int):
+        image_path, mask_path = self.pairs[index]
+        image = rmbg.preprocess_image(Image.open(image_path), (self.size, self.size))[0]
+        mask = Image.open(mask_path).convert('L').resize((self.size, self.size), Image.BILINEAR)
+        mask = torch.from_numpy(np.asarray(mask, dtype=np.float32) / 255.0)[None]
+
+        if self.augment:
+            if torch.rand(1).item() < 0.5:
+                image, mask = image.flip(-1), mask.flip(-1)
+            if torch.rand(1).item() < 0.5:
+                image, mask = image.flip(-2), mask.flip(-2)
+        return image, mask
+
+
+def distill_loss(pred: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    """软标签BCE + 软IoU损失"""
+    bce = F.binary_cross_entropy(pred.clamp(1e-6, 1 - 1e-6), target)
+    intersection = (pred * target).sum(dim=(1, 2, 3))
+    union = (pred + target - pred * target).sum(dim=(1, 2, 3))
+    soft_iou = (intersection + 1.0) / (union + 1.0)
+    return bce + (1.0 - soft_iou).mean()
+
+
+def mask_iou(pred: np.ndarray, target: np.ndarray, threshold: int = 128) -> float:
+    """两个uint8掩码按阈值二值化后的IoU，两者都为空时为1"""
+    pred_fg = pred >= threshold
+    target_fg = target >= threshold
+    union = np.logical_or(pred_fg, target_fg).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(pred_fg, target_fg).sum() / union)
+
+
+def train_student(train_pairs: List[Tuple[str, str]], val_pairs: List[Tuple[str, str]],
+                  base_width: int, size: int, epochs: int, batch_size: int, lr: float,
+                  device: torch.device, num_workers: int = 0) -> Tuple[torch.nn.Module, float]:
+    """
+    蒸馏训练一个学生模型
+
+    Returns:
+        (验证集IoU最高的模型, 对应的验证IoU)
+    """
+    model = rmbg.StudentRMBG(base_width).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(1, epochs))
+    train_loader = DataLoader(DistillDataset(train_pairs, size, augment=True), batch_size=batch_size,
+                              shuffle=True, num_workers=num_workers, drop_last=len(train_pairs) > batch_size)
+
+    best_state, best_iou = None, -1.0
+    for epoch in range(epochs):
+        model.train()
+        total_loss, batches = 0.0, 0
+        start = time.perf_counter()
+        for images, masks in train_loader:
+            images, masks = images.to(device), masks.to(device)
+            loss = distill_loss(model(images), masks)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            batches += 1
+        scheduler.step()
+
+        val_iou = evaluate_at_size(model, val_pairs or train_pairs, size, device)
+        print(f"[宽度{base_width}] 第 {epoch + 1}/{epochs} 轮  损失 {total_loss / max(1, batches):.4f}  "
+              f"验证IoU {val_iou:.4f}  {time.perf_counter() - start:.1f}s")
+        if val_iou > best_iou:
+            best_iou = val_iou
+            best_state = {key: value.detach().clone() for key, value in model.state_dict().items()}
+
+    model.load_state_dict(best_state)
+    model.eval()
+    return model, best_iou
+
+
+def evaluate_at_size(model: torch.nn.Module, pairs: List[Tuple[str, str]], size: int,
+                     device: torch.device) -> float:
+    """在训练尺寸上计算平均IoU（训练过程中的快速验证）"""
+    model.eval()
+    ious = []
+    dataset = DistillDataset(pairs, size)
+    with torch.no_grad():
+        for index in range(len(dataset)):
+            image, mask = dataset[index]
+            pred = model(image[None].to(device))[0, 0].cpu().numpy()
+            ious.append(mask_iou((pred * 255).astype(np.uint8), (mask[0].numpy() * 255).astype(np.uint8)))
+    return float(np.mean(ious)) if ious else 0.0
+
+
+def benchmark_latency(model: torch.nn.Module, size: int, device: torch.device, runs: int = 5) -> float:
+    """合成输入上单张推理的平均耗时（秒），先预热一次"""
+    x = torch.randn(1, 3, size, size, device=device)
+    with torch.no_grad():
+        model(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(x)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+    return (time.perf_counter() - start) / runs
+
+
+def build_report(candidates: Dict[str, torch.nn.Module], val_pairs: List[Tuple[str, str]],
+                 size: int, device: torch.device, runs: int = 5) -> List[Dict]:
+    """
+    吞吐量-IoU报告：每个模型的参数量、单张耗时、每秒图片数，以及在原图尺寸上与教师掩码的平均IoU
+
+    Args:
+        candidates: 名称 -> 演示模型（BriaRMBG或StudentRMBG）
+    """
+    rows = []
+    for name, model in candidates.items():
+        model.eval()
+        latency = benchmark_latency(model, size, device, runs)
+        ious = []
+        for image_path, mask_path in val_pairs:
+            pred = rmbg.infer_single_image_demo(model, image_path, device, size)
+            target = np.asarray(Image.open(mask_path).convert('L'))
+            if target.shape != pred.shape:
+                target = np.asarray(Image.fromarray(target).resize(pred.shape[::-1], Image.BILINEAR))
+            ious.append(mask_iou(pred, target))
+        rows.append({
+            "model": name,
+            "params": int(sum(p.numel() for p in model.parameters())),
+            "latency_ms": round(latency * 1000, 2),
+            "images_per_second": round(1.0 / latency, 2),
+            "iou": round(float(np.mean(ious)), 4) if ious else None,
+        })
+
+    baseline = next((row for row in rows if row["model"] == "BriaRMBG"), None)
+    print(f"\n吞吐量-IoU报告（输入 {size}x{size}，设备 {device}，验证图片 {len(val_pairs)} 张）")
+    print(f"{'模型':<20}{'参数量':>10}{'耗时(ms)':>12}{'图片/秒':>10}{'IoU':>10}{'加速比':>10}")
+    for row in rows:
+        speedup = baseline["latency_ms"] / row["latency_ms"] if baseline else 1.0
+        row["speedup_vs_bria"] = round(speedup, 2) if baseline else None
+        iou = f"{row['iou']:.4f}" if row["iou"] is not None else "-"
+        print(f"{row['model']:<20}{row['params']:>10}{row['latency_ms']:>12.2f}"
+              f"{row['images_per_second']:>10.2f}{iou:>10}{speedup:>9.1f}x")
+    return rows
+
+
+def save_student(model: torch.nn.Module, output_path: str, size: int, val_iou: float) -> None:
+    """保存检查点，arch字段让 rmbg.load_demo_model 创建对应结构"""
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    torch.save({
+        "arch": "student",
+        "arch_args": {"base_width": model.base_width},
+        "state_dict": model.state_dict(),
+        "input_size": size,
+        "val_iou": val_iou,
+    }, output_path)
+    print(f"[信息] 学生模型已保存到: {output_path}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='用教师模型掩码蒸馏训练轻量学生模型，并输出吞吐量-IoU报告')
+    parser.add_argument('--images', required=True, help='训练图片目录（递归查找）')
+    parser.add_argument('--masks', default=DEFAULT_MASK_DIR, help='教师掩码目录，与图片相对路径相同的.png')
+    parser.add_argument('--teacher', default=None, choices=['official', 'demo'],
+                        help='缺少掩码时用于生成掩码的教师模型')
+    parser.add_argument('--teacher-weights', default=None, help='教师为demo模型时的权重文件')
+    parser.add_argument('--teacher-size', type=int, default=1024, help='教师模型的输入边长')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='学生模型保存路径')
+    parser.add_argument('--base-width', type=int, nargs='+', default=[16],
+                        help='学生模型基础通道数，给出多个值时分别训练并在报告中对比')
+    parser.add_argument('--size', type=int, default=320, help='训练和推理的输入边长')
+    parser.add_argument('--epochs', type=int, default=30, help='训练轮数')
+    parser.add_argument('--batch-size', type=int, default=8, help='批大小')
+    parser.add_argument('--lr', type=float, default=3e-3, help='学习率')
+    parser.add_argument('--val-split', type=float, default=0.1, help='验证集比例')
+    parser.add_argument('--num-workers', type=int, default=0, help='数据加载进程数')
+    parser.add_argument('--baseline-weights', default=None, help='报告中作为对照的BriaRMBG权重（不提供则为随机权重，仅比较速度）')
+    parser.add_argument('--report-only', action='store_true', help='不训练，只对 --output 中已有的学生模型输出报告')
+    parser.add_argument('--device', default='cpu', choices=['auto', 'cpu', 'cuda'], help='训练设备，报告始终在该设备上测速')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    device = rmbg.select_device(args.device)
+    image_paths = list_images(args.images)
+    if not image_paths:
+        print(f"错误: 未在 {args.images} 中找到图片")
+        return
+
+    pairs = prepare_teacher_masks(image_paths, args.images, args.masks, args.teacher,
+                                  args.teacher_weights, device, args.teacher_size)
+    if not pairs:
+        print("错误: 没有可用的教师掩码")
+        return
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(pairs))
+    val_count = int(round(len(pairs) * args.val_split)) if len(pairs) > 1 else 0
+    val_pairs = [pairs[i] for i in order[:val_count]]
+    train_pairs = [pairs[i] for i in order[val_count:]]
+    print(f"[信息] 训练 {len(train_pairs)} 张，验证 {len(val_pairs)} 张")
+
+    candidates = {"BriaRMBG": rmbg.load_demo_model(args.baseline_weights, device)}
+    outputs = {}
+    for width in args.base_width:
+        output_path = args.output
+        if len(args.base_width) > 1:
+            stem, ext = os.path.splitext(args.output)
+            output_path = f"{stem}_w{width}{ext}"
+        outputs[width] = output_path
+
+        if args.report_only:
+            candidates[f"Student(w={width})"] = rmbg.load_demo_model(output_path, device)
+            continue
+        model, val_iou = train_student(train_pairs, val_pairs, width, args.size, args.epochs,
+                                       args.batch_size, args.lr, device, args.num_workers)
+        save_student(model, output_path, args.size, val_iou)
+        candidates[f"Student(w={width})"] = model
+
+    rows = build_report(candidates, val_pairs or train_pairs, args.size, device)
+    report_path = os.path.splitext(args.output)[0] + "_report.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({"size": args.size, "device": str(device), "models": rows}, f, ensure_ascii=False, indent=2)
+    print(f"[信息] 报告已保存到: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+元素打包文件（.elpk）
+grid_split_elements.py --archive 把提取的元素写成一个二进制文件：文件头和偏移表之后依次拼接各元素的PNG编码，
+读取时内存映射整个文件，按偏移直接取第k个元素，不需要像 elements_output.json 那样先解析全部base64。
+
+文件结构（小端）:
+    文件头     32字节: 魔数 b"ELPK"、版本、标志（bit0=去重格式）、元素数、图片数、元数据长度、数据区偏移
+    元数据     JSON: channel_order、image_size
+    元素表     每个元素一条定长记录: bbox (x1, y1, x2, y2)、图片序号、变换、统计信息的偏移和长度
+    图片表     每张PNG一条定长记录: 偏移、长度
+    数据区     PNG编码和统计信息JSON依次拼接
+
+普通格式每个元素对应一张图片；去重格式中多个元素（实例）引用同一张图片（图案）并记录翻转/旋转变换。
+只需要bbox时，元素表直接映射为numpy数组，不读取任何图片数据。
+"""
+
+import os
+import io
+import json
+import base64
+import mmap
+import struct
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+ARCHIVE_EXTENSION = ".elpk"
+DEFAULT_ARCHIVE_NAME = "elements.elpk"
+ARCHIVE_MAGIC = b"ELPK"
+ARCHIVE_VERSION = 1
+FLAG_DEDUP = 1
+
+# 魔数, 版本, 标志, 元素数, 图片数, 元数据长度, 保留, 数据区偏移
+HEADER = struct.Struct("<4sHHIIIIQ")
+ELEMENT_DTYPE = np.dtype([
+    ("bbox", "<i4", (4,)),
+    ("blob", "<u4"),
+    ("transform", "u1"),
+    ("reserved", "u1", (3,)),
+    ("stats_offset", "<u8"),
+    ("stats_length", "<u8"),
+])
+BLOB_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u8")])
+
+# 变换编号，与grid_split_elements.py中的MOTIF_TRANSFORMS一致
+TRANSFORM_NAMES = ("identity", "rot90", "rot180", "rot270", "flip_h", "flip_v", "transpose", "transverse")
+
+
+def is_element_archive(path) -> bool:
+    """按扩展名判断是否为元素打包文件"""
+    return isinstance(path, str) and path.lower().endswith(ARCHIVE_EXTENSION)
+
+
+def _align8(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+def write_element_archive(path: str, blobs: Sequence[bytes], entries: Sequence[Dict],
+                          image_size: Optional[Tuple[int, int]] = None, channel_order: str = "RGBA",
+                          dedup: bool = False) -> str:
+    """
+    写入元素打包文件，先写临时文件再原子改名
+
+    Args:
+        path: 输出路径（.elpk）
+        blobs: 元素（去重格式为图案）的PNG编码
+        entries: 每个元素一项，含 bbox (x1, y1, x2, y2)、blob（图片序号）、
+                 可选的 transform（变换名）和 stats（统计信息字典）
+        image_size: 原图尺寸 (宽, 高)
+        channel_order: PNG的通道顺序
+        dedup: 是否为去重格式
+
+    Returns:
+        输出路径
+    """
+    meta = {"channel_order": channel_order}
+    if image_size:
+        meta["image_size"] = [int(v) for v in image_size]
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+
+    element_table = np.zeros(len(entries), dtype=ELEMENT_DTYPE)
+    blob_table = np.zeros(len(blobs), dtype=BLOB_DTYPE)
+    element_table_offset = _align8(HEADER.size + len(meta_bytes))
+    blob_table_offset = element_table_offset + element_table.nbytes
+    data_offset = _align8(blob_table_offset + blob_table.nbytes)
+
+    # 数据区：先放全部PNG，再放统计信息
+    offset = data_offset
+    for i, blob in enumerate(blobs):
+        blob_table[i] = (offset, len(blob))
+        offset += len(blob)
+    stats_chunks = []
+    for i, entry in enumerate(entries):
+        element_table[i]["bbox"] = [int(v) for v in entry["bbox"]]
+        element_table[i]["blob"] = int(entry["blob"])
+        element_table[i]["transform"] = TRANSFORM_NAMES.index(entry.get("transform", "identity"))
+        if entry.get("stats"):
+            chunk = json.dumps(entry["stats"], ensure_ascii=False).encode("utf-8")
+            element_table[i]["stats_offset"] = offset
+            element_table[i]["stats_length"] = len(chunk)
+            stats_chunks.append(chunk)
+            offset += len(chunk)
+
+    header = HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, FLAG_DEDUP if dedup else 0,
+                         len(entries), len(blobs), len(meta_bytes), 0, data_offset)
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(meta_bytes)
+            f.write(b"\0" * (element_table_offset - HEADER.size - len(meta_bytes)))
+            f.write(element_table.tobytes())
+            f.write(blob_table.tobytes())
+            f.write(b"\0" * (data_offset - blob_table_offset - blob_table.nbytes))
+            for blob in blobs:
+                f.write(blob)
+            for chunk in stats_chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+class ElementArchive:
+    """
+    元素打包文件的只读访问接口
+
+    打开时只解析32字节文件头和元数据，元素表和图片表是内存映射上的numpy视图；
+    读取第k个元素时才按偏移访问对应的PNG，未访问的数据不会从磁盘读取。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._file.close()
+            raise ValueError(f"不是有效的元素打包文件: {path}")
+        magic, version, flags, element_count, blob_count, meta_length, _, data_offset = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != ARCHIVE_MAGIC:
+            self.close()
+            raise ValueError(f"不是有效的元素打包文件: {path}")
+        if version > ARCHIVE_VERSION:
+            self.close()
+            raise ValueError(f"不支持的元素打包文件版本 {version}: {path}")
+
+        self.dedup = bool(flags & FLAG_DEDUP)
+        meta = json.loads(bytes(self._mmap[HEADER.size:HEADER.size + meta_length]).decode("utf-8"))
+        self.channel_order = meta.get("channel_order", "RGBA")
+        self.image_size = tuple(meta["image_size"]) if "image_size" in meta else None
+
+        element_table_offset = _align8(HEADER.size + meta_length)
+        self._elements = np.frombuffer(self._mmap, dtype=ELEMENT_DTYPE, count=element_count,
+                                       offset=element_table_offset)
+        self._blobs = np.frombuffer(self._mmap, dtype=BLOB_DTYPE, count=blob_count,
+                                    offset=element_table_offset + self._elements.nbytes)
+
+    def __len__(self) -> int:
+        return len(self._elements)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        """关闭文件；仍有 blob_view 返回的视图在使用时，映射保留到视图释放为止"""
+        self._elements = self._blobs = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    @property
+    def boxes(self) -> np.ndarray:
+        """所有元素的 (x1, y1, x2, y2)，形状 (N, 4)，为内存映射上的只读视图"""
+        return self._elements["bbox"]
+
+    @property
+    def blob_count(self) -> int:
+        """PNG数量（去重格式为唯一图案数）"""
+        return len(self._blobs)
+
+    def bbox(self, k: int) -> Tuple[int, int, int, int]:
+        return tuple(int(v) for v in self._elements[k]["bbox"])
+
+    def blob_index(self, k: int) -> int:
+        """第k个元素引用的图片序号（普通格式与k相同，去重格式为图案序号）"""
+        return int(self._elements[k]["blob"])
+
+    def transform(self, k: int) -> str:
+        return TRANSFORM_NAMES[int(self._elements[k]["transform"])]
+
+    def stats(self, k: int) -> Optional[Dict]:
+        """第k个元素的统计信息，没有时返回None"""
+        offset, length = int(self._elements[k]["stats_offset"]), int(self._elements[k]["stats_length"])
+        if not length:
+            return None
+        return json.loads(bytes(self._mmap[offset:offset + length]).decode("utf-8"))
+
+    def blob_view(self, blob: int) -> memoryview:
+        """第blob张PNG的零拷贝视图"""
+        offset, length = int(self._blobs[blob]["offset"]), int(self._blobs[blob]["length"])
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def read_blob(self, blob: int) -> bytes:
+        """第blob张PNG的编码"""
+        return bytes(self.blob_view(blob))
+
+    def decode(self, k: int, apply_transform: bool = True) -> np.ndarray:
+        """
+        解码第k个元素为RGBA数组
+
+        Args:
+            k: 元素序号
+            apply_transform: 去重格式中是否把图案按该实例的变换还原
+        """
+        image = Image.open(io.BytesIO(self.blob_view(self.blob_index(k))))
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        array = np.asarray(image)
+        if self.channel_order != 'RGBA':
+            array = array[:, :, [2, 1, 0, 3]]
+        if apply_transform:
+            array = apply_named_transform(array, self.transform(k))
+        return array
+
+    def element(self, k: int, with_stats: bool = True) -> Dict:
+        """第k个元素的元数据（不含图片），字段与elements_output.json一致；with_stats为False时不读取统计信息"""
+        x1, y1, x2, y2 = self.bbox(k)
+        info = {
+            "bbox": [f"{x1},{y1}", f"{x2},{y1}", f"{x2},{y2}", f"{x1},{y2}"],
+            "bbox_xyxy": [x1, y1, x2, y2],
+        }
+        if self.dedup:
+            info["motif"] = self.blob_index(k)
+            info["transform"] = self.transform(k)
+        stats = self.stats(k) if with_stats else None
+        if stats:
+            info["stats"] = stats
+        return info
+
+
+def _data_url_to_bytes(data_url: str) -> bytes:
+    if 'base64,' in data_url:
+        data_url = data_url.split('base64,')[1]
+    return base64.b64decode(data_url)
+
+
+def _entry_bbox(entry: Dict) -> List[int]:
+    if entry.get('bbox_xyxy'):
+        return [int(v) for v in entry['bbox_xyxy']]
+    x1, y1 = (int(v) for v in entry['bbox'][0].split(','))
+    x2, y2 = (int(v) for v in entry['bbox'][2].split(','))
+    return [x1, y1, x2, y2]
+
+
+def archive_from_elements_json(elements_data: Dict, path: str) -> str:
+    """
+    把elements_output.json的内容转换为打包文件，PNG直接取自base64，不重新编码
+
+    Args:
+        elements_data: 已加载的元素JSON（普通格式或去重格式）
+        path: 输出路径（.elpk）
+    """
+    channel_order = elements_data.get('channel_order', 'BGRA')
+    image_size = elements_data.get('image_size')
+    if 'instances' in elements_data:
+        blobs = [_data_url_to_bytes(motif['mask']) for motif in elements_data.get('motifs', [])]
+        entries = [
+            {
+                "bbox": _entry_bbox(instance),
+                "blob": instance['motif'],
+                "transform": instance.get('transform', 'identity'),
+                "stats": instance.get('stats'),
+            }
+            for instance in elements_data['instances']
+        ]
+        return write_element_archive(path, blobs, entries, image_size, channel_order, dedup=True)
+
+    masks = elements_data.get('masks', [])
+    blobs = [_data_url_to_bytes(entry.get('mask', '')) for entry in masks]
+    entries = [{"bbox": _entry_bbox(entry), "blob": i, "stats": entry.get('stats')} for i, entry in enumerate(masks)]
+    return write_element_archive(path, blobs, entries, image_size, channel_order)
+
+
+# 与grid_split_elements.py中MOTIF_TRANSFORMS相同的变换，作用于 (H, W, C) 数组
+_ARRAY_TRANSFORMS = {
+    'identity': lambda a: a,
+    'rot90': lambda a: np.rot90(a, 1),
+    'rot180': lambda a: np.rot90(a, 2),
+    'rot270': lambda a: np.rot90(a, 3),
+    'flip_h': lambda a: a[:, ::-1],
+    'flip_v': lambda a: a[::-1],
+    'transpose': lambda a: a.transpose(1, 0, 2),
+    'transverse': lambda a: a[::-1, ::-1].transpose(1, 0, 2),
+}
+
+
+def apply_named_transform(array: np.ndarray, transform: str) -> np.ndarray:
+    """对数组应用翻转/旋转变换，返回连续数组"""
+    return np.ascontiguousarray(_ARRAY_TRANSFORMS.get(transform, _ARRAY_TRANSFORMS['identity'])(array))
+
+
+def main():
+    """把elements_output.json打包，或查看打包文件内容、导出单个元素"""
+    parser = argparse.ArgumentParser(description="元素打包文件（.elpk）：打包elements_output.json或查看打包文件")
+    parser.add_argument("path", help="elements_output.json（打包）或 .elpk 文件（查看）")
+    parser.add_argument("--output", default=None, help=f"打包输出路径，默认为JSON同目录的{DEFAULT_ARCHIVE_NAME}")
+    parser.add_argument("--element", type=int, default=None, help="显示第k个元素的bbox和统计信息")
+    parser.add_argument("--extract", default=None, metavar="PNG", help="与 --element 一起使用，导出该元素为PNG")
+    args = parser.parse_args()
+
+    if not is_element_archive(args.path):
+        with open(args.path, 'r', encoding='utf-8') as f:
+            elements_data = json.load(f)
+        output = args.output or os.path.join(os.path.dirname(args.path), DEFAULT_ARCHIVE_NAME)
+        archive_from_elements_json(elements_data, output)
+        print(f"元素打包文件已保存到: {output}")
+        return
+
+    with ElementArchive(args.path) as archive:
+        print(f"元素数: {len(archive)}，图片数: {archive.blob_count}，"
+              f"格式: {'去重' if archive.dedup else '普通'}，原图尺寸: {archive.image_size}")
+        if args.element is None:
+            return
+        print(json.dumps(archive.element(args.element), ensure_ascii=False, indent=2))
+        if args.extract:
+            Image.fromarray(archive.decode(args.element), 'RGBA').save(args.extract)
+            print(f"已导出: {args.extract}")
+
+
+if __name__ == "__main__":
+    main()
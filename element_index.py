@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+元素空间索引
+为grid_split_elements.py提取的元素建立均匀网格索引，提供矩形相交、点命中、
+最近邻查询，供合并脚本和交互式编辑器快速定位元素
+"""
+
+import json
+import os
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from element_archive import ElementArchive, is_element_archive
+
+
+def bbox_points_to_xyxy(bbox: Sequence[str]) -> Tuple[int, int, int, int]:
+    """将 ["x1,y1", "x2,y1", "x2,y2", "x1,y2"] 格式的bbox转换为 (x1, y1, x2, y2)"""
+    x1, y1 = (int(v) for v in bbox[0].split(','))
+    x2, y2 = (int(v) for v in bbox[2].split(','))
+    return x1, y1, x2, y2
+
+
+def load_boxes_from_elements_json(elements_file: str) -> List[Tuple[int, int, int, int]]:
+    """从elements_output.json读取所有元素的数值bbox（兼容普通格式和去重格式）；
+    元素打包文件只读取元素表，不解析图片数据"""
+    if is_element_archive(elements_file):
+        with ElementArchive(elements_file) as archive:
+            return [tuple(box) for box in archive.boxes.tolist()]
+
+    with open(elements_file, 'r', encoding='utf-8') as f:
+        elements_data = json.load(f)
+
+    entries = elements_data.get('instances', elements_data.get('masks', []))
+    boxes = []
+    for entry in entries:
+        if 'bbox_xyxy' in entry:
+            boxes.append(tuple(entry['bbox_xyxy']))
+        else:
+            boxes.append(bbox_points_to_xyxy(entry['bbox']))
+    return boxes
+
+
+def choose_cell_size(boxes: np.ndarray) -> int:
+    """根据元素尺寸中位数选择网格大小，使每个元素只落在少数几个网格中"""
+    if len(boxes) == 0:
+        return 64
+    extents = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    return int(np.clip(np.median(extents), 8, 512))
+
+
+def build_spatial_index(boxes: Sequence[Sequence[int]], cell_size: Optional[int] = None) -> Dict:
+    """
+    建立均匀网格空间索引
+
+    Args:
+        boxes: 元素bbox列表，每项为 (x1, y1, x2, y2)，x2/y2不包含在元素内
+        cell_size: 网格边长，不提供时自动选择
+
+    Returns:
+        可直接保存为JSON的索引字典
+    """
+    box_array = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if cell_size is None:
+        cell_size = choose_cell_size(box_array)
+
+    cells: Dict[str, List[int]] = {}
+    for idx, (x1, y1, x2, y2) in enumerate(box_array.tolist()):
+        # 右/下边界不包含在内，空bbox也至少登记到一个网格
+        cx2 = max(x1, x2 - 1) // cell_size
+        cy2 = max(y1, y2 - 1) // cell_size
+        for cy in range(y1 // cell_size, cy2 + 1):
+            for cx in range(x1 // cell_size, cx2 + 1):
+                cells.setdefault(f"{cx},{cy}", []).append(idx)
+
+    return {
+        "cell_size": cell_size,
+        "boxes": box_array.tolist(),
+        "cells": cells
+    }
+
+
+def save_spatial_index(index: Dict, index_file: str) -> None:
+    """保存空间索引到JSON文件"""
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    print(f"空间索引已保存到: {index_file}")
+
+
+class ElementIndex:
+    """元素空间索引查询接口，首次查询时才加载索引文件"""
+
+    def __init__(self, index_file: str = "output/merged_output/elements_index.json"):
+        """
+        初始化索引
+
+        Args:
+            index_file: elements_index.json路径，也可以直接传入elements_output.json或元素打包文件，
+                        此时在加载时根据元素bbox现场建立索引
+        """
+        self.index_file = index_file
+        self._boxes = None
+        self._cells = None
+        self._cell_lists = None
+        self._box_list = None
+        self._cell_size = None
+        self._cell_bounds = None
+
+    @classmethod
+    def from_boxes(cls, boxes: Sequence[Sequence[int]], cell_size: Optional[int] = None) -> "ElementIndex":
+        """直接从bbox列表建立内存索引"""
+        index = cls(index_file="")
+        index._set_index(build_spatial_index(boxes, cell_size))
+        return index
+
+    def _set_index(self, index: Dict) -> None:
+        self._boxes = np.asarray(index["boxes"], dtype=np.int64).reshape(-1, 4)
+        self._cell_size = int(index["cell_size"])
+        self._cells = {
+            tuple(int(v) for v in key.split(',')): np.asarray(ids, dtype=np.int64)
+            for key, ids in index["cells"].items()
+        }
+        # 点查询走纯Python路径，避免小数组上的numpy调用开销
+        self._cell_lists = {key: ids.tolist() for key, ids in self._cells.items()}
+        self._box_list = [tuple(box) for box in self._boxes.tolist()]
+        # 已登记网格的范围 (最小cx, 最小cy, 最大cx, 最大cy)，最近邻搜索只遍历范围内的网格
+        keys = np.asarray(list(self._cells), dtype=np.int64).reshape(-1, 2)
+        self._cell_bounds = tuple(keys.min(axis=0).tolist() + keys.max(axis=0).tolist()) if len(keys) else None
+
+    def _ensure_loaded(self) -> None:
+        if self._boxes is not None:
+            return
+        if not os.path.exists(self.index_file):
+            raise FileNotFoundError(f"索引文件不存在: {self.index_file}")
+        if is_element_archive(self.index_file):
+            self._set_index(build_spatial_index(load_boxes_from_elements_json(self.index_file)))
+            return
+
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        if "cells" in data:
+            self._set_index(data)
+        else:
+            self._set_index(build_spatial_index(load_boxes_from_elements_json(self.index_file)))
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._boxes)
+
+    @property
+    def boxes(self) -> np.ndarray:
+        """所有元素的 (x1, y1, x2, y2) 数组，形状 (N, 4)"""
+        self._ensure_loaded()
+        return self._boxes
+
+    def _candidates(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        cs = self._cell_size
+        cx1, cy1 = x1 // cs, y1 // cs
+        cx2, cy2 = max(x1, x2 - 1) // cs, max(y1, y2 - 1) // cs
+        # 大矩形覆盖的网格比已登记网格还多时，直接扫描全部元素更快
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self._cells):
+            return np.arange(len(self._boxes), dtype=np.int64)
+        found = [
+            self._cells[(cx, cy)]
+            for cy in range(cy1, cy2 + 1)
+            for cx in range(cx1, cx2 + 1)
+            if (cx, cy) in self._cells
+        ]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        if len(found) == 1:
+            return found[0]
+        return np.unique(np.concatenate(found))
+
+    def query_rect(self, x1: int, y1: int, x2: int, y2: int) -> List[int]:
+        """返回与矩形 [x1, x2) x [y1, y2) 相交的元素索引（升序）"""
+        self._ensure_loaded()
+        ids = self._candidates(int(x1), int(y1), int(x2), int(y2))
+        if len(ids) == 0:
+            return []
+        b = self._boxes[ids]
+        hit = (b[:, 0] < x2) & (b[:, 2] > x1) & (b[:, 1] < y2) & (b[:, 3] > y1)
+        return ids[hit].tolist()
+
+    def query_point(self, x: int, y: int) -> List[int]:
+        """返回bbox包含点 (x, y) 的所有元素索引（升序）"""
+        self._ensure_loaded()
+        cs = self._cell_size
+        boxes = self._box_list
+        hits = []
+        for i in self._cell_lists.get((int(x) // cs, int(y) // cs), ()):
+            x1, y1, x2, y2 = boxes[i]
+            if x1 <= x < x2 and y1 <= y < y2:
+                hits.append(i)
+        return hits
+
+    def element_at(self, x: int, y: int) -> Optional[int]:
+        """返回点 (x, y) 处最上层的元素索引（合并时后贴的元素在上层），没有则返回None"""
+        hits = self.query_point(x, y)
+        return hits[-1] if hits else None
+
+    def _distances(self, ids: np.ndarray, x: float, y: float) -> np.ndarray:
+        b = self._boxes[ids]
+        dx = np.maximum(np.maximum(b[:, 0] - x, 0), x - b[:, 2])
+        dy = np.maximum(np.maximum(b[:, 1] - y, 0), y - b[:, 3])
+        return np.hypot(dx, dy)
+
+    @staticmethod
+    def _select_nearest(ids: np.ndarray, dist: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """从候选中取距离最小的k个，距离相同时索引小的在前"""
+        k = min(k, len(ids))
+        order = np.lexsort((ids, dist))[:k]
+        return [(int(ids[i]), float(dist[i])) for i in order]
+
+    def _ring_cells(self, qx: int, qy: int, r: int) -> List[Tuple[int, int]]:
+        """与网格 (qx, qy) 切比雪夫距离为r的一圈网格中，位于已登记范围内的部分"""
+        min_cx, min_cy, max_cx, max_cy = self._cell_bounds
+        if r == 0:
+            return [(qx, qy)]
+        x_lo, x_hi = max(qx - r, min_cx), min(qx + r, max_cx)
+        y_lo, y_hi = max(qy - r + 1, min_cy), min(qy + r - 1, max_cy)
+        cells = []
+        for cy in (qy - r, qy + r):
+            if min_cy <= cy <= max_cy:
+                cells.extend((cx, cy) for cx in range(x_lo, x_hi + 1))
+        for cx in (qx - r, qx + r):
+            if min_cx <= cx <= max_cx:
+                cells.extend((cx, cy) for cy in range(y_lo, y_hi + 1))
+        return cells
+
+    def nearest(self, x: float, y: float, k: int = 1) -> List[Tuple[int, float]]:
+        """
+        返回距离点 (x, y) 最近的k个元素
+
+        从点所在网格开始逐圈向外搜索；前r圈网格覆盖的正方形之外的元素，距离不小于点到正方形边界的距离，
+        已找到的第k近距离小于它时停止。一圈的网格数超过已登记网格数时改为扫描全部元素。
+
+        Returns:
+            [(元素索引, 点到bbox的距离), ...]，按距离升序，点在bbox内时距离为0
+        """
+        self._ensure_loaded()
+        n = len(self._boxes)
+        if n == 0 or k <= 0:
+            return []
+        k = min(k, n)
+        cs = self._cell_size
+        qx, qy = int(x // cs), int(y // cs)
+        min_cx, min_cy, max_cx, max_cy = self._cell_bounds
+        # 点在已登记范围之外时，跳过不含任何网格的内圈
+        r = max(min_cx - qx, qx - max_cx, min_cy - qy, qy - max_cy, 0)
+        r_last = max(qx - min_cx, max_cx - qx, qy - min_cy, max_cy - qy)
+
+        seen = set()
+        found_ids = []
+        found_dist = []
+        while r <= r_last:
+            ring = self._ring_cells(qx, qy, r)
+            if len(ring) > len(self._cells):
+                all_ids = np.arange(n, dtype=np.int64)
+                return self._select_nearest(all_ids, self._distances(all_ids, x, y), k)
+            new_ids = [i for cell in ring for i in self._cell_lists.get(cell, ()) if i not in seen]
+            if new_ids:
+                new_ids = np.unique(np.asarray(new_ids, dtype=np.int64))
+                seen.update(new_ids.tolist())
+                found_ids.append(new_ids)
+                found_dist.append(self._distances(new_ids, x, y))
+            if len(seen) >= k:
+                outside = min(x - (qx - r) * cs, (qx + r + 1) * cs - x, y - (qy - r) * cs, (qy + r + 1) * cs - y)
+                kth = np.partition(np.concatenate(found_dist), k - 1)[k - 1]
+                if kth < outside:
+                    break
+            r += 1
+        return self._select_nearest(np.concatenate(found_ids), np.concatenate(found_dist), k)
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='为提取的元素建立空间索引并执行查询')
+    parser.add_argument('--elements', default='output/merged_output/elements_output.json', help='元素JSON文件或元素打包文件（.elpk）路径')
+    parser.add_argument('--output', default=None, help='索引输出路径，默认与元素JSON同目录的elements_index.json')
+    parser.add_argument('--cell-size', type=int, default=None, help='网格边长，不提供则自动选择')
+    parser.add_argument('--point', nargs=2, type=int, metavar=('X', 'Y'), help='查询点处的元素')
+    parser.add_argument('--rect', nargs=4, type=int, metavar=('X1', 'Y1', 'X2', 'Y2'), help='查询与矩形相交的元素')
+    parser.add_argument('--nearest', nargs=3, type=int, metavar=('X', 'Y', 'K'), help='查询距离点最近的K个元素')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.elements):
+        print(f"错误: 元素文件不存在: {args.elements}")
+        return
+
+    index_file = args.output or os.path.join(os.path.dirname(args.elements), "elements_index.json")
+    index = build_spatial_index(load_boxes_from_elements_json(args.elements), args.cell_size)
+    save_spatial_index(index, index_file)
+    print(f"共索引 {len(index['boxes'])} 个元素，网格大小: {index['cell_size']}")
+
+    element_index = ElementIndex(index_file)
+    if args.point:
+        print(f"点 {tuple(args.point)} 处的元素: {element_index.query_point(*args.point)}")
+    if args.rect:
+        print(f"与矩形 {tuple(args.rect)} 相交的元素: {element_index.query_rect(*args.rect)}")
+    if args.nearest:
+        x, y, k = args.nearest
+        print(f"距离点 ({x}, {y}) 最近的 {k} 个元素: {element_index.nearest(x, y, k)}")
+
+
+if __name__ == "__main__":
+    main()
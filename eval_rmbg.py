@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+去背景速度-精度回归测试
+用本地图片和参考掩码逐个运行 rmbg.py 的推理配置（模型、权重、输入尺寸、设备），
+统计掩码IoU、边界F值、单张耗时和峰值内存，输出帕累托前沿，并与基线比较，超出容差时以非零状态退出。
+没有图片时可生成带真值掩码的合成数据集，配合演示模型在CPU上离线运行
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+import rmbg
+from distill_student import list_images, teacher_mask_path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_OUTPUT_DIR = "output/eval"
+DEFAULT_BASELINE = "output/eval/baseline.json"
+SYNTHETIC_DIR = "output/eval/synthetic"
+
+# 配置项及默认值，配置文件中的每一项只能包含这些键
+CONFIG_DEFAULTS = {
+    "name": None,
+    "model": "demo",
+    "weights": None,
+    "size": 1024,
+    "device": "cpu",
+}
+
+# 未提供配置文件时的默认配置：演示模型在不同输入尺寸下的表现
+DEFAULT_CONFIGS = [
+    {"name": "demo-256", "size": 256},
+    {"name": "demo-320", "size": 320},
+    {"name": "demo-512", "size": 512},
+    {"name": "demo-1024", "size": 1024},
+]
+DEFAULT_STUDENT_WEIGHTS = "models/student.pth"
+
+# 越小越好的指标，其余指标越大越好
+LOWER_IS_BETTER = {"latency_ms", "peak_mb"}
+
+
+def normalize_config(config: Dict) -> Dict:
+    """补全默认值并检查未知配置项"""
+    unknown = set(config) - set(CONFIG_DEFAULTS)
+    if unknown:
+        raise ValueError(f"未知的配置项: {', '.join(sorted(unknown))}，可选: {', '.join(CONFIG_DEFAULTS)}")
+    normalized = dict(CONFIG_DEFAULTS, **config)
+    if not normalized["name"]:
+        normalized["name"] = f"{normalized['model']}-{normalized['size']}"
+    return normalized
+
+
+def load_configs(config_file: Optional[str]) -> List[Dict]:
+    """读取配置列表（JSON数组），未提供时使用默认配置；存在学生模型时自动加入对比"""
+    if config_file:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            configs = json.load(f)
+    else:
+        configs = list(DEFAULT_CONFIGS)
+        if os.path.isfile(DEFAULT_STUDENT_WEIGHTS):
+            configs.append({"name": "student-320", "weights": DEFAULT_STUDENT_WEIGHTS, "size": 320})
+    configs = [normalize_config(config) for config in configs]
+    names = [config["name"] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError("配置名称不能重复")
+    return configs
+
+
+def generate_synthetic_dataset(output_dir: str, count: int = 8, size: Tuple[int, int] = (640, 480),
+                               seed: int = 0) -> Tuple[str, str]:
+    """
+    生成合成测试集：噪声渐变背景上的若干椭圆和多边形前景，真值掩码与图片同名
+
+    Returns:
+        (图片目录, 掩码目录)
+    """
+    image_dir = os.path.join(output_dir, "images")
+    mask_dir = os.path.join(output_dir, "masks")
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(mask_dir, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    for index in range(count):
+        start, end = rng.integers(0, 256, size=(2, 3))
+        ramp = (xx / max(1, width - 1))[..., None]
+        background = start * (1 - ramp) + end * ramp + rng.normal(0, 12, size=(height, width, 3))
+        image = np.clip(background, 0, 255).astype(np.uint8)
+
+        mask = np.zeros((height, width), dtype=np.uint8)
+        for _ in range(int(rng.integers(1, 4))):
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            shape = np.zeros_like(mask)
+            if rng.random() < 0.5:
+                center = (int(rng.integers(width // 5, width * 4 // 5)), int(rng.integers(height // 5, height * 4 // 5)))
+                axes = (int(rng.integers(width // 12, width // 4)), int(rng.integers(height // 12, height // 4)))
+                cv2.ellipse(shape, center, axes, float(rng.uniform(0, 180)), 0, 360, 255, -1)
+            else:
+                points = rng.integers((width // 8, height // 8), (width * 7 // 8, height * 7 // 8), size=(int(rng.integers(3, 7)), 2))
+                cv2.fillPoly(shape, [cv2.convexHull(points.astype(np.int32))], 255)
+            image[shape > 0] = color
+            mask |= shape
+
+        name = f"synthetic_{index:03d}.png"
+        Image.fromarray(image).save(os.path.join(image_dir, name))
+        Image.fromarray(mask).save(os.path.join(mask_dir, name))
+    return image_dir, mask_dir
+
+
+def collect_pairs(image_dir: str, mask_dir: str) -> List[Tuple[str, str]]:
+    """按相对路径匹配图片和参考掩码（掩码为同名.png），没有掩码的图片跳过"""
+    pairs = []
+    for image_path in list_images(image_dir):
+        mask_path = teacher_mask_path(image_path, image_dir, mask_dir)
+        if os.path.exists(mask_path):
+            pairs.append((image_path, mask_path))
+        else:
+            print(f"[警告] 缺少参考掩码，跳过: {image_path}")
+    return pairs
+
+
+def mask_iou(pred: np.ndarray, target: np.ndarray, threshold: int = 128) -> float:
+    """二值化后的IoU，两者都为空时为1"""
+    pred_fg = pred >= threshold
+    target_fg = target >= threshold
+    union = np.logical_or(pred_fg, target_fg).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(pred_fg, target_fg).sum() / union)
+
+
+def mask_boundary(binary: np.ndarray) -> np.ndarray:
+    """前景的一像素宽内边界"""
+    eroded = cv2.erode(binary, np.ones((3, 3), np.uint8), borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    return binary & ~eroded
+
+
+def boundary_f_score(pred: np.ndarray, target: np.ndarray, threshold: int = 128,
+                     tolerance: float = 0.008) -> float:
+    """
+    边界F值：预测边界与参考边界在容差半径（图像对角线的比例）内相互命中的精确率和召回率的调和平均
+
+    两者都没有边界时为1，只有一方有边界时为0
+    """
+    pred_edge = mask_boundary((pred >= threshold).astype(np.uint8))
+    target_edge = mask_boundary((target >= threshold).astype(np.uint8))
+    pred_count, target_count = int(pred_edge.sum()), int(target_edge.sum())
+    if pred_count == 0 and target_count == 0:
+        return 1.0
+    if pred_count == 0 or target_count == 0:
+        return 0.0
+
+    radius = max(1, int(round(tolerance * np.hypot(*pred.shape))))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    precision = (pred_edge & cv2.dilate(target_edge, kernel)).sum() / pred_count
+    recall = (target_edge & cv2.dilate(pred_edge, kernel)).sum() / target_count
+    if precision + recall == 0:
+        return 0.0
+    return float(2 * precision * recall / (precision + recall))
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def evaluate_config(config: Dict, pairs: List[Tuple[str, Optional[str]]], seed: int = 0,
+                    save_dir: Optional[str] = None, image_dir: Optional[str] = None) -> Dict:
+    """
+    在独立子进程中运行：加载模型，对每张图片推理一次并计时，计算各项指标
+
+    峰值内存为推理结束时的峰值常驻内存减去导入依赖之后的值，即加载模型和推理新增的部分；
+    掩码路径为None的图片只推理不计算精度；save_dir 不为空时把预测掩码按相对 image_dir 的路径保存为.png
+    """
+    torch.manual_seed(seed)
+    device = rmbg.select_device(config["device"])
+    base_mb = peak_rss_mb()
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+    if config["model"] == "official":
+        model = rmbg.load_official_model(device)
+        infer_fn = rmbg.infer_single_image_official
+    else:
+        model = rmbg.load_demo_model(config["weights"], device)
+        infer_fn = rmbg.infer_single_image_demo
+
+    # 预热一次，排除首次推理的初始化开销
+    if pairs:
+        infer_fn(model, Image.fromarray(rmbg.load_rgb_array(pairs[0][0])), device, config["size"])
+
+    ious, boundary_scores, latencies = [], [], []
+    for image_path, mask_path in pairs:
+        image = Image.fromarray(rmbg.load_rgb_array(image_path))
+        start = time.perf_counter()
+        pred = infer_fn(model, image, device, config["size"])
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        latencies.append(time.perf_counter() - start)
+
+        if save_dir:
+            out_path = teacher_mask_path(image_path, image_dir, save_dir)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            rmbg.save_mask(pred, out_path, "png")
+        if mask_path is None:
+            continue
+        target = np.asarray(Image.open(mask_path).convert('L'))
+        if target.shape != pred.shape:
+            target = np.asarray(Image.fromarray(target).resize(pred.shape[::-1], Image.BILINEAR))
+        ious.append(mask_iou(pred, target))
+        boundary_scores.append(boundary_f_score(pred, target))
+
+    if device.type == "cuda":
+        peak_mb = torch.cuda.max_memory_allocated(device) / (1024 * 1024)
+    else:
+        peak_mb = peak_rss_mb() - base_mb if base_mb is not None else None
+    return {
+        "name": config["name"],
+        "config": config,
+        "images": len(pairs),
+        "iou": round(float(np.mean(ious)), 4) if ious else None,
+        "boundary_f": round(float(np.mean(boundary_scores)), 4) if boundary_scores else None,
+        "latency_ms": round(float(np.median(latencies)) * 1000, 2) if latencies else None,
+        "peak_mb": round(peak_mb, 1) if peak_mb is not None else None,
+    }
+
+
+def run_isolated(config: Dict, pairs: List[Tuple[str, Optional[str]]], seed: int,
+                 save_dir: Optional[str] = None, image_dir: Optional[str] = None) -> Dict:
+    """每个配置使用新的spawn子进程，峰值内存互不影响"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(evaluate_config, config, pairs, seed, save_dir, image_dir).result()
+
+
+def pareto_front(results: List[Dict], accuracy_key: str = "iou") -> List[str]:
+    """耗时更低且精度更高的意义下，不被任何其他配置支配的配置名称"""
+    front = []
+    for row in results:
+        dominated = any(
+            other is not row
+            and other["latency_ms"] <= row["latency_ms"]
+            and other[accuracy_key] >= row[accuracy_key]
+            and (other["latency_ms"] < row["latency_ms"] or other[accuracy_key] > row[accuracy_key])
+            for other in results
+        )
+        if not dominated:
+            front.append(row["name"])
+    return front
+
+
+def has_trained_weights(configs: List[Dict]) -> bool:
+    """官方模型或提供了权重文件的配置才有意义的精度；演示模型未提供权重时为随机初始化"""
+    return any(config["model"] == "official" or config["weights"] for config in configs)
+
+
+def accuracy_is_degenerate(rows) -> bool:
+    """所有配置的IoU和边界F值都为0（或没有），这样的精度永远不会回归，不能作为基线"""
+    values = [row.get(key) for row in rows for key in ("iou", "boundary_f")]
+    return not any(value for value in values if value is not None)
+
+
+def masks_are_uniform(pairs: List[Tuple[str, Optional[str]]], threshold: int = 128) -> bool:
+    """参考掩码二值化后全为背景或全为前景（如随机初始化模型输出的参考掩码），此时任何预测的精度都没有区分度"""
+    for _, mask_path in pairs:
+        if mask_path is None:
+            continue
+        foreground = np.asarray(Image.open(mask_path).convert('L')) >= threshold
+        if foreground.any() and not foreground.all():
+            return False
+    return True
+
+
+def format_metric(value: Optional[float], width: int = 0) -> str:
+    return f"{value:>{width}.4f}" if value is not None else f"{'-':>{width}}"
+
+
+def check_regressions(results: List[Dict], baseline: Dict[str, Dict], tolerances: Dict[str, float]) -> List[str]:
+    """
+    与基线逐项比较
+
+    IoU和边界F值按绝对下降量判断，耗时和峰值内存按相对增长比例判断；基线中没有的配置不检查
+
+    Returns:
+        回归描述列表，为空表示全部通过
+    """
+    failures = []
+    for row in results:
+        reference = baseline.get(row["name"])
+        if not reference:
+            continue
+        for key, tolerance in tolerances.items():
+            current, previous = row.get(key), reference.get(key)
+            if current is None or previous is None:
+                continue
+            if key in LOWER_IS_BETTER:
+                regressed = previous > 0 and current > previous * (1 + tolerance)
+                change = f"{previous} -> {current}（+{(current / previous - 1) * 100:.1f}%，容差 {tolerance * 100:.0f}%）" if previous > 0 else ""
+            else:
+                regressed = current < previous - tolerance
+                change = f"{previous:.4f} -> {current:.4f}（容差 {tolerance}）"
+            if regressed:
+                failures.append(f"{row['name']} {key}: {change}")
+    return failures
+
+
+def print_results(results: List[Dict], front: List[str]) -> None:
+    """打印结果表格，帕累托前沿上的配置以*标记"""
+    print(f"\n{'配置':<20}{'IoU':>8}{'边界F':>8}{'耗时(ms)':>12}{'峰值内存(MB)':>14}  前沿")
+    for row in sorted(results, key=lambda r: r["latency_ms"]):
+        peak = f"{row['peak_mb']:.1f}" if row["peak_mb"] is not None else "-"
+        print(f"{row['name']:<20}{format_metric(row['iou'], 8)}{format_metric(row['boundary_f'], 8)}"
+              f"{row['latency_ms']:>12.2f}{peak:>14}  {'*' if row['name'] in front else ''}")
+    if front:
+        print(f"\n帕累托前沿（耗时-IoU）: {' -> '.join(front)}")
+    else:
+        print("\n精度无效，不计算帕累托前沿")
+
+
+def plot_pareto(results: List[Dict], front: List[str], output_path: str) -> bool:
+    """安装了matplotlib时保存耗时-IoU散点图，前沿连线"""
+    if not front:
+        return False
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("[信息] 未安装matplotlib，跳过绘图")
+        return False
+
+    fig, ax = plt.subplots(figsize=(7, 5))
+    for row in results:
+        ax.scatter(row["latency_ms"], row["iou"], color="tab:red" if row["name"] in front else "tab:gray")
+        ax.annotate(row["name"], (row["latency_ms"], row["iou"]), textcoords="offset points", xytext=(4, 4), fontsize=8)
+    front_rows = sorted((row for row in results if row["name"] in front), key=lambda r: r["latency_ms"])
+    ax.plot([r["latency_ms"] for r in front_rows], [r["iou"] for r in front_rows], color="tab:red", linewidth=1)
+    ax.set_xlabel("latency (ms / image)")
+    ax.set_ylabel("mask IoU")
+    ax.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(output_path, dpi=120)
+    plt.close(fig)
+    print(f"[信息] 帕累托图已保存到: {output_path}")
+    return True
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='去背景推理配置的速度-精度回归测试')
+    parser.add_argument('--images', default=None, help='测试图片目录（递归查找）')
+    parser.add_argument('--masks', default=None, help='参考掩码目录，与图片相对路径相同的.png')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='N',
+                        help='生成N张带真值掩码的合成图片作为测试集（未提供 --images 时默认8张）')
+    parser.add_argument('--configs', default=None, help='配置列表JSON文件，每项可含 name/model/weights/size/device')
+    parser.add_argument('--reference-config', default=None,
+                        help='以该配置的输出作为其他配置的参考掩码（衡量近似优化与完整推理的一致性）')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='结果输出目录')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线结果文件')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果覆盖基线，不做回归检查')
+    parser.add_argument('--iou-tolerance', type=float, default=0.01, help='IoU允许的绝对下降量')
+    parser.add_argument('--bf-tolerance', type=float, default=0.01, help='边界F值允许的绝对下降量')
+    parser.add_argument('--latency-tolerance', type=float, default=0.25, help='耗时允许的相对增长比例')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help='峰值内存允许的相对增长比例')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子（合成数据和未提供权重时的模型初始化）')
+
+    args = parser.parse_args()
+
+    if args.images:
+        image_dir, mask_dir = args.images, args.masks
+        if not mask_dir and not args.reference_config:
+            print("错误: 使用 --images 时需要提供 --masks 或 --reference-config")
+            sys.exit(2)
+    else:
+        count = args.synthetic or 8
+        image_dir, mask_dir = generate_synthetic_dataset(SYNTHETIC_DIR, count, seed=args.seed)
+        print(f"[信息] 已生成 {count} 张合成测试图片: {image_dir}")
+
+    configs = load_configs(args.configs)
+    os.makedirs(args.output_dir, exist_ok=True)
+    if not args.reference_config and not has_trained_weights(configs):
+        # 随机初始化的模型与真值掩码比较的精度没有意义，改为衡量各配置与最大输入尺寸的一致性
+        args.reference_config = max(configs, key=lambda config: config["size"])["name"]
+        print(f"[信息] 没有训练好的权重，以最大输入尺寸的配置 {args.reference_config} 的输出作为参考掩码")
+
+    results = []
+    if args.reference_config:
+        reference = next((c for c in configs if c["name"] == args.reference_config), None)
+        if reference is None:
+            print(f"错误: 配置中没有 {args.reference_config}")
+            sys.exit(2)
+        mask_dir = os.path.join(args.output_dir, "reference_masks")
+        print(f"[信息] 运行参考配置 {reference['name']}，输出作为参考掩码: {mask_dir}")
+        run_isolated(reference, [(path, None) for path in list_images(image_dir)], args.seed, mask_dir, image_dir)
+
+    pairs = collect_pairs(image_dir, mask_dir)
+    if not pairs:
+        print("错误: 没有可用的图片和参考掩码")
+        sys.exit(2)
+    uniform_reference = masks_are_uniform(pairs)
+
+    for config in configs:
+        print(f"[信息] 评估配置 {config['name']}（{config['model']}，输入 {config['size']}，{config['device']}）...")
+        row = run_isolated(config, pairs, args.seed)
+        results.append(row)
+        print(f"  IoU {format_metric(row['iou'])}  边界F {format_metric(row['boundary_f'])}  "
+              f"耗时 {row['latency_ms']:.2f}ms")
+
+    accuracy_valid = not uniform_reference and not accuracy_is_degenerate(results)
+    if not accuracy_valid:
+        # 全为0的精度永远不会回归，全为空的参考掩码上精度恒为1，都不能作为精度基线
+        reason = "参考掩码全为背景或全为前景" if uniform_reference else "所有配置的IoU和边界F值都为0"
+        print(f"[警告] {reason}，精度没有区分度（演示模型未提供权重时为随机初始化），"
+              f"不计入基线和帕累托前沿，只检查耗时和峰值内存")
+        for row in results:
+            row["iou"] = row["boundary_f"] = None
+    front = pareto_front(results) if accuracy_valid else []
+    print_results(results, front)
+    plot_pareto(results, front, os.path.join(args.output_dir, "pareto.png"))
+
+    results_path = os.path.join(args.output_dir, "eval_results.json")
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump({"images": len(pairs), "pareto_front": front, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"[信息] 结果已保存到: {results_path}")
+
+    current = {row["name"]: {key: row[key] for key in ("iou", "boundary_f", "latency_ms", "peak_mb")} for row in results}
+    if args.update_baseline or not os.path.exists(args.baseline):
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"[信息] 基线已写入: {args.baseline}")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if accuracy_valid and accuracy_is_degenerate(baseline.values()):
+        print(f"错误: 基线中没有有效的IoU和边界F值，无法检查精度回归，请用 --update-baseline 重新生成: {args.baseline}")
+        sys.exit(2)
+    tolerances = {
+        "iou": args.iou_tolerance,
+        "boundary_f": args.bf_tolerance,
+        "latency_ms": args.latency_tolerance,
+        "peak_mb": args.memory_tolerance,
+    }
+    failures = check_regressions(results, baseline, tolerances)
+    if failures:
+        print(f"\n[失败] {len(failures)} 项超出容差:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print(f"\n[通过] 所有配置均在基线容差范围内（基线: {args.baseline}）")
+
+
+if __name__ == "__main__":
+    main()
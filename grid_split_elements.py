@@ -3,10 +3,17 @@ import os
 import json
 import base64
 import io
+import hashlib
 import numpy as np
 import cv2
 from PIL import Image
 
+from element_archive import DEFAULT_ARCHIVE_NAME, archive_from_elements_json
+from element_index import bbox_points_to_xyxy, build_spatial_index, save_spatial_index
+from intermediate import is_intermediate, load_intermediate
+from memory_budget import MemoryGovernor, parse_memory_size, format_bytes
+from period_detect import detect_period, format_period
+
 
 def load_config(config_file="config.json"):
     """从config.json文件加载配置"""
@@ -59,35 +66,176 @@ def image_to_base64(image_array):
         return ""
 
 
-def generate_json_output(all_elements, output_file="elements_output.json"):
-    """生成包含mask和bbox的JSON输出"""
+# 元素JSON中base64图片的通道顺序（提取时统一转换，合并时无需再交换通道）
+ELEMENT_CHANNEL_ORDER = "RGBA"
+
+
+def element_to_base64(element_img):
+    """将cv2读取的BGRA元素转换为RGBA顺序后编码为base64 PNG"""
+    if element_img.ndim == 3 and element_img.shape[2] == 4:
+        element_img = cv2.cvtColor(element_img, cv2.COLOR_BGRA2RGBA)
+    return image_to_base64(element_img)
+
+
+# 去重时检测的8种翻转/旋转变换，作用于 (H, W, C) 数组
+MOTIF_TRANSFORMS = {
+    'identity': lambda a: a,
+    'rot90': lambda a: np.rot90(a, 1),
+    'rot180': lambda a: np.rot90(a, 2),
+    'rot270': lambda a: np.rot90(a, 3),
+    'flip_h': lambda a: a[:, ::-1],
+    'flip_v': lambda a: a[::-1],
+    'transpose': lambda a: a.transpose(1, 0, 2),
+    'transverse': lambda a: a[::-1, ::-1].transpose(1, 0, 2),
+}
+
+# 各变换的逆变换（只有90/270度旋转互逆，其余变换的逆是自身）
+MOTIF_TRANSFORM_INVERSE = {name: name for name in MOTIF_TRANSFORMS}
+MOTIF_TRANSFORM_INVERSE['rot90'] = 'rot270'
+MOTIF_TRANSFORM_INVERSE['rot270'] = 'rot90'
+
+
+def coords_to_bbox(coords):
+    """将(x1, y1, x2, y2)转换为bbox坐标点（顺时针顺序：左上、右上、右下、左下）"""
+    x1, y1, x2, y2 = coords
+    return [
+        f"{x1},{y1}",  # 左上
+        f"{x2},{y1}",  # 右上
+        f"{x2},{y2}",  # 右下
+        f"{x1},{y2}"   # 左下
+    ]
+
+
+def compute_element_hash(element_img, detect_transforms=True):
+    """计算元素的规范哈希
+    
+    透明像素的颜色先清零，避免背景残留影响比较；开启变换检测时对8种
+    翻转/旋转结果分别求哈希并取最小值，使同一图案的不同朝向得到相同哈希。
+    
+    返回 (哈希值, 规范化变换名)，规范化变换作用于元素即得到规范图案。
+    """
+    normalized = element_img
+    if element_img.ndim == 3 and element_img.shape[2] == 4:
+        normalized = element_img.copy()
+        normalized[element_img[:, :, 3] == 0, :3] = 0
+    
+    names = MOTIF_TRANSFORMS if detect_transforms else ['identity']
+    best_hash, best_name = None, 'identity'
+    for name in names:
+        variant = np.ascontiguousarray(MOTIF_TRANSFORMS[name](normalized))
+        digest = hashlib.blake2b(str(variant.shape).encode(), digest_size=16)
+        digest.update(variant.tobytes())
+        value = digest.hexdigest()
+        if best_hash is None or value < best_hash:
+            best_hash, best_name = value, name
+    return best_hash, best_name
+
+
+def dedup_elements(all_elements, detect_transforms=True):
+    """对元素去重，每个唯一图案只保留一份
+    
+    返回 (motifs, instances)：
+    - motifs: [(规范图案数组, 哈希值), ...]
+    - instances: [{'motif': 图案索引, 'coords': 坐标, 'size': 尺寸, 'stats': 统计信息, 'transform': 变换名}, ...]
+      其中transform作用于规范图案即得到该实例
+    """
+    motifs = []
+    instances = []
+    hash_index = {}
+    
+    for element_img, coords_info in all_elements:
+        element_hash, canonical_name = compute_element_hash(element_img, detect_transforms)
+        
+        motif_idx = hash_index.get(element_hash)
+        if motif_idx is None:
+            motif_idx = len(motifs)
+            hash_index[element_hash] = motif_idx
+            canonical = np.ascontiguousarray(MOTIF_TRANSFORMS[canonical_name](element_img))
+            motifs.append((canonical, element_hash))
+        
+        instances.append({
+            'motif': motif_idx,
+            'coords': coords_info['coords'],
+            'size': coords_info['size'],
+            'stats': coords_info.get('stats'),
+            'transform': MOTIF_TRANSFORM_INVERSE[canonical_name]
+        })
+    
+    return motifs, instances
+
+
+def generate_dedup_json_output(motifs, instances, output_file="elements_output.json", image_size=None):
+    """生成去重后的JSON输出：唯一图案只编码一次，实例按引用记录位置和变换"""
     try:
         result = {
+            "channel_order": ELEMENT_CHANNEL_ORDER,
+            "motifs": [],
+            "instances": []
+        }
+        if image_size:
+            result["image_size"] = [int(v) for v in image_size]
+        
+        for motif_img, motif_hash in motifs:
+            h, w = motif_img.shape[:2]
+            result["motifs"].append({
+                "mask": element_to_base64(motif_img),
+                "size": [w, h],
+                "hash": motif_hash
+            })
+        
+        for instance in instances:
+            instance_info = {
+                "motif": instance['motif'],
+                "bbox": coords_to_bbox(instance['coords']),
+                "bbox_xyxy": [int(v) for v in instance['coords']],
+                "transform": instance['transform']
+            }
+            if instance.get('stats'):
+                instance_info["stats"] = instance['stats']
+            result["instances"].append(instance_info)
+        
+        # 保存JSON文件
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        
+        print(f"JSON输出已保存到: {output_file}")
+        return result
+        
+    except Exception as e:
+        print(f"生成JSON输出失败: {e}")
+        return None
+
+
+def element_to_json_entry(element_img, coords_info):
+    """生成单个元素的JSON条目"""
+    # 转换图片为base64
+    mask_base64 = element_to_base64(element_img)
+    
+    # 获取bbox坐标
+    bbox = coords_to_bbox(coords_info['coords'])
+    
+    entry = {
+        "mask": mask_base64,
+        "bbox": bbox,
+        "bbox_xyxy": [int(v) for v in coords_info['coords']]
+    }
+    if 'stats' in coords_info:
+        entry["stats"] = coords_info['stats']
+    return entry
+
+
+def generate_json_output(all_elements, output_file="elements_output.json", image_size=None):
+    """生成包含mask和bbox的JSON输出，image_size为原图尺寸 (宽, 高)"""
+    try:
+        result = {
+            "channel_order": ELEMENT_CHANNEL_ORDER,
             "masks": []
         }
+        if image_size:
+            result["image_size"] = [int(v) for v in image_size]
         
         for element_img, coords_info in all_elements:
-            # 转换图片为base64
-            mask_base64 = image_to_base64(element_img)
-            
-            # 获取bbox坐标
-            coords = coords_info['coords']
-            x1, y1, x2, y2 = coords
-            
-            # 创建bbox坐标点（顺时针顺序：左上、右上、右下、左下）
-            bbox = [
-                f"{x1},{y1}",  # 左上
-                f"{x2},{y1}",  # 右上
-                f"{x2},{y2}",  # 右下
-                f"{x1},{y2}"   # 左下
-            ]
-            
-            mask_info = {
-                "mask": mask_base64,
-                "bbox": bbox
-            }
-            
-            result["masks"].append(mask_info)
+            result["masks"].append(element_to_json_entry(element_img, coords_info))
         
         # 保存JSON文件
         with open(output_file, 'w', encoding='utf-8') as f:
@@ -101,11 +249,45 @@ def generate_json_output(all_elements, output_file="elements_output.json"):
         return None
 
 
-def extract_elements_from_image(rgba_path, mask_path, min_area=100):
-    """从单张图片中提取独立元素"""
-    # 读取图片
-    rgba_img = cv2.imread(rgba_path, cv2.IMREAD_UNCHANGED)
-    mask_img = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+def save_element_index(coords_list, output_dir):
+    """为元素bbox建立空间索引并保存为elements_index.json"""
+    try:
+        index = build_spatial_index([[int(v) for v in coords] for coords in coords_list])
+        save_spatial_index(index, os.path.join(output_dir, "elements_index.json"))
+    except Exception as e:
+        print(f"生成空间索引失败: {e}")
+
+
+def save_element_archive(result, output_dir):
+    """把JSON输出同时写成元素打包文件elements.elpk，PNG直接复用JSON中的编码"""
+    if result is None:
+        return
+    try:
+        archive_path = archive_from_elements_json(result, os.path.join(output_dir, DEFAULT_ARCHIVE_NAME))
+        print(f"元素打包文件已保存到: {archive_path}")
+    except Exception as e:
+        print(f"生成元素打包文件失败: {e}")
+
+
+def open_element_sources(rgba_path, mask_path):
+    """打开透明图和蒙版，返回 (图像数组, 二值化蒙版, 通道顺序)
+    
+    图片文件用cv2读取，通道顺序为BGRA；.npy中间结果用内存映射打开，通道顺序为RGBA，
+    不做整图拷贝，提取时只在元素裁剪区域上转换通道。
+    """
+    if is_intermediate(rgba_path):
+        rgba_img = load_intermediate(rgba_path)
+        channel_order = "RGBA" if rgba_img.ndim == 3 and rgba_img.shape[2] == 4 else "RGB"
+    else:
+        rgba_img = cv2.imread(rgba_path, cv2.IMREAD_UNCHANGED)
+        channel_order = "BGRA"
+    
+    if is_intermediate(mask_path):
+        mask_img = load_intermediate(mask_path)
+        if mask_img.ndim == 3:
+            mask_img = mask_img[:, :, -1]
+    else:
+        mask_img = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
     
     if rgba_img is None or mask_img is None:
         raise ValueError("无法读取输入图片")
@@ -115,13 +297,130 @@ def extract_elements_from_image(rgba_path, mask_path, min_area=100):
         raise ValueError("透明图片和蒙版图片尺寸不一致")
     
     # 二值化mask
-    _, binary_mask = cv2.threshold(mask_img, 127, 255, cv2.THRESH_BINARY)
+    _, binary_mask = cv2.threshold(np.ascontiguousarray(mask_img), 127, 255, cv2.THRESH_BINARY)
+    return rgba_img, binary_mask, channel_order
+
+
+def crop_to_bgra(rgba_img, y1, y2, x1, x2, channel_order="BGRA"):
+    """裁剪区域并转换为BGRA顺序的独立数组"""
+    crop = rgba_img[y1:y2, x1:x2]
+    if channel_order == "RGBA":
+        return cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_RGBA2BGRA)
+    if channel_order == "RGB":
+        return cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_RGB2BGRA)
+    if crop.ndim == 3 and crop.shape[2] == 3:
+        return cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_BGR2BGRA)
+    return crop.copy()
+
+
+def build_element(rgba_img, labels, label_id, x, y, w, h, offset=(0, 0), channel_order="BGRA"):
+    """根据连通区域标签裁剪出单个元素（BGRA顺序）
+    
+    labels 可以是整图或局部区域的标签图，offset 为该区域左上角在整图中的坐标，
+    (x, y, w, h) 为元素在 labels 中的位置，channel_order 为 rgba_img 的通道顺序。
+    """
+    ox, oy = offset
+    
+    # 只在元素bbox范围内生成当前元素的mask
+    element_mask_crop = (labels[y:y+h, x:x+w] == label_id).astype(np.uint8) * 255
+    
+    # 提取元素区域，应用mask到alpha通道
+    element_rgba = crop_to_bgra(rgba_img, oy+y, oy+y+h, ox+x, ox+x+w, channel_order)
+    element_rgba[:, :, 3] = element_mask_crop
+    
+    # 坐标信息：直接使用图片中的坐标
+    coords_info = {
+        'coords': (ox + x, oy + y, ox + x + w, oy + y + h),  # 图片中的坐标
+        'size': (w, h)  # 元素尺寸
+    }
+    return element_rgba, coords_info
+
+
+# 主色统计时每个颜色通道保留的位数（5位即每通道32级），相近颜色归入同一颜色桶
+DOMINANT_COLOR_BITS = 5
+
+
+def compute_component_stats(rgba_img, labels, num_labels, stats, centroids, offset=(0, 0), channel_order="BGRA"):
+    """用带标签的归约一次性计算所有连通区域的统计信息
     
+    对前景像素按标签做 np.bincount 加权求和，得到面积、平均颜色；主色通过
+    (标签, 量化颜色) 组合键计数后取每个标签计数最多的颜色桶，颜色为桶内像素均值。
+    
+    返回列表，下标为标签（0为背景，值为None），颜色均为RGB顺序。
+    """
+    ox, oy = offset
+    label_h, label_w = labels.shape[:2]
+    region = rgba_img[oy:oy+label_h, ox:ox+label_w]
+    
+    foreground = labels > 0
+    fg_labels = labels[foreground]
+    # cv2读取的是BGR顺序，转换为RGB顺序的列；.npy中间结果本身为RGB顺序
+    if channel_order.startswith("RGB"):
+        pixels = region[foreground][:, :3].astype(np.int64)
+    else:
+        pixels = region[foreground][:, 2::-1].astype(np.int64)
+    
+    area = np.bincount(fg_labels, minlength=num_labels)
+    safe_area = np.maximum(area, 1)
+    mean_color = np.stack([
+        np.bincount(fg_labels, weights=pixels[:, c], minlength=num_labels) for c in range(3)
+    ], axis=1) / safe_area[:, None]
+    
+    # 主色：按 (标签, 量化颜色) 计数
+    bits = DOMINANT_COLOR_BITS
+    shift = 8 - bits
+    quantized = ((pixels[:, 0] >> shift) << (2 * bits)) | ((pixels[:, 1] >> shift) << bits) | (pixels[:, 2] >> shift)
+    keys = (fg_labels.astype(np.int64) << (3 * bits)) | quantized
+    unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    key_labels = unique_keys >> (3 * bits)
+    
+    # 每个标签内按计数降序排列，取第一个
+    order = np.lexsort((-counts, key_labels))
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = key_labels[order][1:] != key_labels[order][:-1]
+    best = order[is_first]
+    
+    dominant_color = np.zeros((num_labels, 3))
+    dominant_count = np.zeros(num_labels, dtype=np.int64)
+    for c in range(3):
+        bin_sums = np.bincount(inverse.ravel(), weights=pixels[:, c], minlength=len(unique_keys))
+        dominant_color[key_labels[best], c] = bin_sums[best] / counts[best]
+    dominant_count[key_labels[best]] = counts[best]
+    
+    mean_color = np.round(mean_color, 2).tolist()
+    dominant_color = np.round(dominant_color).astype(int).tolist()
+    
+    result = [None]
+    for i in range(1, num_labels):
+        w, h = int(stats[i, 2]), int(stats[i, 3])
+        cx, cy = float(centroids[i, 0]), float(centroids[i, 1])
+        # 由局部质心还原整数坐标和，再按整图坐标相除，与整图标记的质心逐位一致
+        n = int(stats[i, 4])
+        if ox:
+            cx = (round(cx * n) + int(ox) * n) / n
+        if oy:
+            cy = (round(cy * n) + int(oy) * n) / n
+        result.append({
+            "area": int(area[i]),
+            "centroid": [round(cx, 2), round(cy, 2)],
+            "mean_color": mean_color[i],
+            "alpha_coverage": round(int(area[i]) / max(w * h, 1), 4),
+            "dominant_color": dominant_color[i],
+            "dominant_ratio": round(int(dominant_count[i]) / int(safe_area[i]), 4)
+        })
+    return result
+
+
+def extract_elements_from_arrays(rgba_img, binary_mask, min_area=100, channel_order="BGRA"):
+    """从已读取的透明图和二值蒙版中提取独立元素，返回的元素图像均为BGRA顺序"""
     # 查找连通区域
     num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary_mask, connectivity=8)
     
+    # 一次性计算所有连通区域的统计信息
+    component_stats = compute_component_stats(rgba_img, labels, num_labels, stats, centroids,
+                                              channel_order=channel_order)
+    
     elements = []
-    img_h, img_w = rgba_img.shape[:2]
     
     for i in range(1, num_labels):  # 跳过背景(label=0)
         # 获取当前元素的统计信息
@@ -131,57 +430,552 @@ def extract_elements_from_image(rgba_path, mask_path, min_area=100):
         if area < min_area:
             continue
         
-        # 创建当前元素的mask
-        element_mask = (labels == i).astype(np.uint8) * 255
+        element_rgba, coords_info = build_element(rgba_img, labels, i, x, y, w, h, channel_order=channel_order)
+        coords_info['stats'] = component_stats[i]
+        elements.append((element_rgba, coords_info))
+    
+    return elements
+
+
+# --max-memory 的估算参数：每像素的二值蒙版及读取副本、连通区域标签图，以及主色统计中每个前景像素的临时数组
+MASK_BYTES_PER_PIXEL = 2
+LABEL_BYTES_PER_PIXEL = 4
+STATS_BYTES_PER_FOREGROUND_PIXEL = 64
+MIN_BAND_HEIGHT = 64
+
+
+def plan_extraction(governor, rgba_img, binary_mask):
+    """估算整图提取的工作集，超出预算时返回条带高度，否则返回None
+    
+    内存映射打开的.npy透明图不计入工作集；前景像素按在整图中均匀分布估算。
+    """
+    img_h, img_w = binary_mask.shape[:2]
+    decoded = 0 if isinstance(rgba_img, np.memmap) else rgba_img.nbytes
+    fixed = decoded + img_h * img_w * MASK_BYTES_PER_PIXEL
+    fg_fraction = cv2.countNonZero(binary_mask) / max(img_h * img_w, 1)
+    per_row = img_w * (LABEL_BYTES_PER_PIXEL + STATS_BYTES_PER_FOREGROUND_PIXEL * fg_fraction)
+    estimate = fixed + per_row * img_h
+    if governor.fits(estimate):
+        return None
+    
+    print(f"[内存预算] 整图提取估算工作集 {format_bytes(estimate)}，超出预算 {format_bytes(governor.budget)}")
+    if fixed >= governor.budget:
+        governor.adapt(f"透明图和蒙版本身已占用 {format_bytes(fixed)}，"
+                       f"建议用 rmbg.py --codec npy 输出中间结果以内存映射方式打开")
+        band_height = MIN_BAND_HEIGHT
+    else:
+        band_height = max(MIN_BAND_HEIGHT, int((governor.budget - fixed) / per_row))
+    band_height = min(band_height, img_h)
+    governor.adapt(f"改为按条带提取元素，条带高度 {band_height} 行")
+    return band_height
+
+
+def extract_elements_in_strips(rgba_img, binary_mask, band_height, min_area=100, channel_order="BGRA", governor=None):
+    """按水平条带提取元素，标签图和统计数组只与条带大小有关，结果与整图提取一致
+    
+    每个条带多取上下各1像素的外围：接触上方外围的连通区域属于之前的条带，
+    接触下方外围的不完整，下一个条带从其中最靠上的区域顶部开始。元素比整个条带还高时条带高度加倍。
+    OpenCV的8连通标记按2x2块逐行扫描分配标签，最后按区域所在的第一个块排序，与整图提取的顺序相同。
+    """
+    img_h = binary_mask.shape[0]
+    found = []
+    y0, done_until = 0, 0
+    while y0 < img_h:
+        y1 = min(y0 + band_height, img_h)
+        py1, py2 = max(y0 - 1, 0), min(y1 + 1, img_h)
+        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary_mask[py1:py2], connectivity=8)
+        component_stats = compute_component_stats(rgba_img, labels, num_labels, stats, centroids, offset=(0, py1),
+                                                  channel_order=channel_order)
+        
+        band_elements = []
+        next_y0 = y1
+        for i in range(1, num_labels):
+            x, y, w, h, area = stats[i]
+            top, bottom = py1 + y, py1 + y + h
+            if top < y0:
+                continue
+            if bottom > y1:
+                next_y0 = min(next_y0, top)
+                continue
+            # 完整落在上一个条带内的区域已经提取过
+            if bottom <= done_until or area < min_area:
+                continue
+            element_rgba, coords_info = build_element(rgba_img, labels, i, x, y, w, h, offset=(0, py1),
+                                                      channel_order=channel_order)
+            coords_info['stats'] = component_stats[i]
+            block_row = top // 2
+            block_rows = labels[max(2 * block_row - py1, 0):2 * block_row + 2 - py1, x:x+w] == i
+            first_x = x + int(np.argmax(block_rows.any(axis=0)))
+            band_elements.append(((block_row, first_x // 2), element_rgba, coords_info))
         
-        # 提取元素区域
-        element_rgba = rgba_img[y:y+h, x:x+w].copy()
-        element_mask_crop = element_mask[y:y+h, x:x+w]
+        if y1 < img_h and next_y0 <= y0:
+            band_height *= 2
+            message = f"第 {y0} 行开始的元素高于条带，条带高度加倍为 {band_height} 行"
+            if governor:
+                governor.adapt(message)
+            else:
+                print(message)
+            continue
         
-        # 应用mask到alpha通道
-        if element_rgba.shape[2] == 4:
-            element_rgba[:, :, 3] = element_mask_crop
+        found.extend(band_elements)
+        done_until = y1
+        y0 = next_y0 if y1 < img_h else img_h
+    
+    found.sort(key=lambda item: item[0])
+    return [(element_rgba, coords_info) for _, element_rgba, coords_info in found]
+
+
+def label_periodic_block(block_mask):
+    """在一个周期上做8连通标记，左右、上下边缘首尾相接（环面）
+    
+    越过周期边缘相连的标签用带偏移的并查集合并，偏移为展开到平面时该标签相对区域根标签平移的周期数。
+    返回 (标签图, stats, 区域列表)，区域为 [(标签, (水平偏移, 垂直偏移)), ...]；
+    有区域绕环面一整圈（平铺后无限延伸）时返回None。
+    """
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(block_mask, connectivity=8)
+    py, px = labels.shape
+    parent = list(range(num_labels))
+    offset = [(0, 0)] * num_labels
+    
+    def find(a):
+        dx, dy = 0, 0
+        path = []
+        while parent[a] != a:
+            path.append(a)
+            dx, dy = dx + offset[a][0], dy + offset[a][1]
+            a = parent[a]
+        # 路径压缩：各节点直接指向根，偏移改为相对根
+        rx, ry = dx, dy
+        for node in path:
+            node_offset = offset[node]
+            parent[node], offset[node] = a, (rx, ry)
+            rx, ry = rx - node_offset[0], ry - node_offset[1]
+        return a, (dx, dy)
+    
+    # 右边缘与左边缘、下边缘与上边缘相邻的像素对（含对角），b 展开后平移 (sx, sy) 个周期
+    edges = []
+    ys, xs = np.arange(py), np.arange(px)
+    for d in (-1, 0, 1):
+        yy = ys + d
+        edges.append(np.stack([labels[ys, px - 1], labels[yy % py, 0], np.ones(py, int), yy // py], axis=1))
+        xx = xs + d
+        edges.append(np.stack([labels[py - 1, xs], labels[0, xx % px], xx // px, np.ones(px, int)], axis=1))
+    edges = np.concatenate(edges)
+    edges = np.unique(edges[(edges[:, 0] > 0) & (edges[:, 1] > 0)], axis=0)
+    
+    for a, b, sx, sy in edges.tolist():
+        ra, (ax, ay) = find(a)
+        rb, (bx, by) = find(b)
+        if ra == rb:
+            if (bx - ax, by - ay) != (sx, sy):
+                return None
+            continue
+        parent[rb] = ra
+        offset[rb] = (ax + sx - bx, ay + sy - by)
+    
+    groups = {}
+    for label in range(1, num_labels):
+        root, label_offset = find(label)
+        groups.setdefault(root, []).append((label, label_offset))
+    return labels, stats, list(groups.values())
+
+
+def _component_pieces(rgba_img, piece_mask, channel_order):
+    """对局部蒙版标记连通区域，返回 [(元素图像, 局部坐标, 统计信息, 原始质心, 面积, 元素蒙版)]"""
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(piece_mask, connectivity=8)
+    component_stats = compute_component_stats(rgba_img, labels, num_labels, stats, centroids,
+                                              channel_order=channel_order)
+    pieces = []
+    for i in range(1, num_labels):
+        x, y, w, h, area = stats[i]
+        element_rgba, coords_info = build_element(rgba_img, labels, i, x, y, w, h, channel_order=channel_order)
+        pieces.append((element_rgba, coords_info['coords'], component_stats[i], centroids[i], int(area),
+                       labels[y:y+h, x:x+w] == i))
+    return pieces
+
+
+def _placed_stats(piece_stats, centroid, area, ox, oy):
+    """把局部统计信息平移到整图坐标，质心由局部坐标和还原，与整图标记的结果逐位一致"""
+    placed = dict(piece_stats)
+    cx = (round(float(centroid[0]) * area) + int(ox) * area) / area
+    cy = (round(float(centroid[1]) * area) + int(oy) * area) / area
+    placed["centroid"] = [round(cx, 2), round(cy, 2)]
+    return placed
+
+
+def extract_elements_periodic(rgba_img, binary_mask, min_area=100, channel_order="BGRA"):
+    """检测重复周期，只在一个周期上提取元素，再平铺到整图
+    
+    一个周期按环面标记（越过周期边缘的元素保持完整），每个元素在各个周期位置复制一份；
+    越过整图边缘的副本裁剪后重新划分连通区域和统计，与整图提取的结果一致。
+    元素图像取自第一个周期，蒙版和透明图在误差范围内按周期重复时才使用，否则返回None。
+    """
+    result = detect_period(rgba_img)
+    print(f"周期检测: {format_period(result)}")
+    (px, py), (kx, ky) = result["period"], result["repeats"]
+    if kx * ky == 1:
+        return None
+    img_h, img_w = binary_mask.shape[:2]
+    block_mask = np.ascontiguousarray(binary_mask[:py, :px])
+    if not (binary_mask.reshape(ky, py, kx, px) == block_mask[None, :, None, :]).all():
+        print("蒙版不是严格按周期重复，按整图提取")
+        return None
+    labeled = label_periodic_block(block_mask)
+    if labeled is None:
+        print("存在绕整个周期相连的区域，按整图提取")
+        return None
+    labels, stats, groups = labeled
+    block_rgba = rgba_img[:py, :px]
+    
+    found = []
+    for group in groups:
+        # 展开到平面，左上角移到第一个周期内
+        boxes = [(stats[label, 0] + sx * px, stats[label, 1] + sy * py, stats[label, 2], stats[label, 3], label, sx, sy)
+                 for label, (sx, sy) in group]
+        gx1 = min(b[0] for b in boxes)
+        gy1 = min(b[1] for b in boxes)
+        gw = max(b[0] + b[2] for b in boxes) - gx1
+        gh = max(b[1] + b[3] for b in boxes) - gy1
+        canon_mask = np.zeros((gh, gw), dtype=np.uint8)
+        for x, y, w, h, label, _, _ in boxes:
+            bx, by = x % px, y % py
+            tx, ty = x - gx1, y - gy1
+            canon_mask[ty:ty+h, tx:tx+w][labels[by:by+h, bx:bx+w] == label] = 255
+        # bbox内的像素（包括蒙版外）按周期取自第一个周期，与整图裁剪一致
+        canon_rgba = block_rgba[np.ix_(np.arange(gy1, gy1 + gh) % py, np.arange(gx1, gx1 + gw) % px)]
+        gx1, gy1 = gx1 % px, gy1 % py
+        canon = _component_pieces(canon_rgba, canon_mask, channel_order)[0]
+        
+        for j in range(-(gh // py) - 1, ky + 1):
+            for i in range(-(gw // px) - 1, kx + 1):
+                ox, oy = gx1 + i * px, gy1 + j * py
+                cx1, cy1 = max(ox, 0), max(oy, 0)
+                cx2, cy2 = min(ox + gw, img_w), min(oy + gh, img_h)
+                if cx1 >= cx2 or cy1 >= cy2:
+                    continue
+                if (cx1, cy1, cx2, cy2) == (ox, oy, ox + gw, oy + gh):
+                    pieces, base = [canon], (ox, oy)
+                else:
+                    # 越过整图边缘的副本裁剪后可能断开成多个区域
+                    sx1, sy1 = cx1 - ox, cy1 - oy
+                    pieces = _component_pieces(
+                        np.ascontiguousarray(canon_rgba[sy1:cy2 - oy, sx1:cx2 - ox]),
+                        np.ascontiguousarray(canon_mask[sy1:cy2 - oy, sx1:cx2 - ox]), channel_order)
+                    base = (cx1, cy1)
+                for element_rgba, (x1, y1, x2, y2), piece_stats, centroid, area, piece_mask in pieces:
+                    if area < min_area:
+                        continue
+                    left, top = base[0] + x1, base[1] + y1
+                    coords_info = {
+                        'coords': (left, top, base[0] + x2, base[1] + y2),
+                        'size': (x2 - x1, y2 - y1),
+                        'stats': _placed_stats(piece_stats, centroid, area, base[0], base[1])
+                    }
+                    # 与整图提取相同的顺序：OpenCV按2x2块逐行扫描分配标签
+                    block_row = top // 2
+                    block_rows = piece_mask[max(2 * block_row - top, 0):2 * block_row + 2 - top]
+                    first_x = left + int(np.argmax(block_rows.any(axis=0)))
+                    found.append(((block_row, first_x // 2), element_rgba, coords_info))
+    
+    found.sort(key=lambda item: item[0])
+    print(f"按周期 {px}x{py} 提取，{len(groups)} 个区域平铺 {kx}x{ky} 次")
+    return [(element_rgba, coords_info) for _, element_rgba, coords_info in found]
+
+
+def extract_elements_from_image(rgba_path, mask_path, min_area=100):
+    """从单张图片中提取独立元素，rgba_path/mask_path 为.npy中间结果时用内存映射打开"""
+    rgba_img, binary_mask, channel_order = open_element_sources(rgba_path, mask_path)
+    return extract_elements_from_arrays(rgba_img, binary_mask, min_area, channel_order)
+
+
+# 增量模式状态目录（位于输出目录下），保存上一次运行的二值蒙版和参数
+INCREMENTAL_STATE_DIR = ".incremental"
+
+# 元素提取写入输出目录的文件和目录；重新提取时只清空这些，同目录下其他阶段的输出（如colors_output.json）保留
+EXTRACT_OUTPUTS = ("elements", "elements_output.json", "elements_index.json", DEFAULT_ARCHIVE_NAME,
+                   INCREMENTAL_STATE_DIR)
+
+
+def compute_rgb_digest(rgba_img, channel_order="BGRA"):
+    """计算图片颜色通道的哈希（统一按BGR顺序），用于判断透明图本身是否变化"""
+    digest = hashlib.blake2b(str(rgba_img.shape).encode(), digest_size=16)
+    # 按条带更新哈希，不生成整图颜色通道的拷贝
+    for y in range(0, rgba_img.shape[0], 256):
+        band = rgba_img[y:y+256]
+        if channel_order.startswith("RGB"):
+            digest.update(np.ascontiguousarray(band[:, :, 2::-1]).tobytes())
         else:
-            # 如果不是RGBA，转换为RGBA
-            element_rgba = cv2.cvtColor(element_rgba, cv2.COLOR_RGB2RGBA)
-            element_rgba[:, :, 3] = element_mask_crop
-        
-        # 坐标信息：直接使用图片中的坐标
-        coords_info = {
-            'coords': (x, y, x + w, y + h),  # 图片中的坐标
-            'size': (w, h)  # 元素尺寸
+            digest.update(np.ascontiguousarray(band[:, :, :3]).tobytes())
+    return digest.hexdigest()
+
+
+def save_incremental_state(output_dir, rgba_img, binary_mask, min_area, dedup, channel_order="BGRA"):
+    """保存本次运行的蒙版和参数，供下一次增量运行比较"""
+    try:
+        state_dir = os.path.join(output_dir, INCREMENTAL_STATE_DIR)
+        os.makedirs(state_dir, exist_ok=True)
+        cv2.imwrite(os.path.join(state_dir, "mask.png"), binary_mask)
+        state = {
+            "rgb_digest": compute_rgb_digest(rgba_img, channel_order),
+            "min_area": int(min_area),
+            "dedup": bool(dedup)
         }
+        with open(os.path.join(state_dir, "state.json"), 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+    except Exception as e:
+        print(f"保存增量状态失败: {e}")
+
+
+def find_dirty_region(prev_mask, new_mask):
+    """找出需要重新标记的区域
+    
+    从两次蒙版的差异bbox开始，若新旧蒙版中经过差异像素的连通区域延伸到区域外，
+    则扩大区域，直到这些连通区域都完整落在区域内。区域外的元素保证未变化。
+    
+    返回 (x1, y1, x2, y2)，蒙版无变化时返回None。
+    """
+    diff = prev_mask != new_mask
+    rows = np.flatnonzero(diff.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(diff.any(axis=0))
+    
+    img_h, img_w = new_mask.shape[:2]
+    x1, y1, x2, y2 = int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+    
+    while True:
+        # 在区域外围多取1像素，接触外围的连通区域可能延伸到区域外
+        px1, py1 = max(x1 - 1, 0), max(y1 - 1, 0)
+        px2, py2 = min(x2 + 1, img_w), min(y2 + 1, img_h)
+        ring = np.ones((py2 - py1, px2 - px1), dtype=bool)
+        ring[y1-py1:y2-py1, x1-px1:x2-px1] = False
+        dirty = diff[py1:py2, px1:px2]
+        
+        escaping = []
+        for mask in (prev_mask, new_mask):
+            _, labels, stats, _ = cv2.connectedComponentsWithStats(mask[py1:py2, px1:px2], connectivity=8)
+            dirty_labels = np.unique(labels[dirty])
+            ring_labels = np.unique(labels[ring])
+            for label_id in np.intersect1d(dirty_labels[dirty_labels > 0], ring_labels):
+                x, y, w, h, _ = stats[label_id]
+                escaping.append((px1 + x, py1 + y, px1 + x + w, py1 + y + h))
+        
+        if not escaping:
+            return x1, y1, x2, y2
         
+        # 按当前尺寸成倍扩大区域，避免长条形元素导致多次小步扩张
+        grow_x, grow_y = x2 - x1, y2 - y1
+        x1 = max(min([x1] + [b[0] for b in escaping]) - grow_x, 0)
+        y1 = max(min([y1] + [b[1] for b in escaping]) - grow_y, 0)
+        x2 = min(max([x2] + [b[2] for b in escaping]) + grow_x, img_w)
+        y2 = min(max([y2] + [b[3] for b in escaping]) + grow_y, img_h)
+
+
+def extract_elements_in_region(rgba_img, binary_mask, region, min_area=100, channel_order="BGRA"):
+    """只提取完整落在 region 内的连通区域"""
+    x1, y1, x2, y2 = region
+    img_h, img_w = binary_mask.shape[:2]
+    px1, py1 = max(x1 - 1, 0), max(y1 - 1, 0)
+    px2, py2 = min(x2 + 1, img_w), min(y2 + 1, img_h)
+    
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(binary_mask[py1:py2, px1:px2], connectivity=8)
+    component_stats = compute_component_stats(rgba_img, labels, num_labels, stats, centroids, offset=(px1, py1),
+                                              channel_order=channel_order)
+    
+    elements = []
+    for i in range(1, num_labels):
+        x, y, w, h, area = stats[i]
+        # 接触外围1像素的连通区域不完整，属于区域外未变化的元素
+        if px1 + x < x1 or py1 + y < y1 or px1 + x + w > x2 or py1 + y + h > y2:
+            continue
+        if area < min_area:
+            continue
+        element_rgba, coords_info = build_element(rgba_img, labels, i, x, y, w, h, offset=(px1, py1),
+                                                  channel_order=channel_order)
+        coords_info['stats'] = component_stats[i]
         elements.append((element_rgba, coords_info))
     
     return elements
 
 
-def process_single_image(rgba_path, mask_path, output_dir, min_area=100):
-    """处理单张图片，提取元素"""
-    # 清空输出目录（如果存在）
-    if os.path.exists(output_dir):
-        import shutil
-        shutil.rmtree(output_dir)
-        print(f"已清空输出目录: {output_dir}")
+def process_single_image_incremental(rgba_path, mask_path, output_dir, min_area=100, max_memory=None, archive=False):
+    """增量处理：只重新提取蒙版改动区域内的元素，其余元素文件和JSON条目直接复用
+    
+    无法增量处理时（没有上次状态、参数或透明图变化等）自动退回完整处理。
+    输出目录中已有元素打包文件时同步更新，避免与JSON不一致。
+    """
+    state_dir = os.path.join(output_dir, INCREMENTAL_STATE_DIR)
+    state_file = os.path.join(state_dir, "state.json")
+    json_output_file = os.path.join(output_dir, "elements_output.json")
+    elements_dir = os.path.join(output_dir, "elements")
+    archive = archive or os.path.exists(os.path.join(output_dir, DEFAULT_ARCHIVE_NAME))
+    
+    def fallback(reason):
+        print(f"无法增量处理（{reason}），执行完整处理")
+        process_single_image(rgba_path, mask_path, output_dir, min_area, max_memory=max_memory, archive=archive)
+    
+    if not os.path.exists(state_file) or not os.path.exists(json_output_file):
+        return fallback("未找到上一次运行的状态")
+    
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        with open(json_output_file, 'r', encoding='utf-8') as f:
+            old_output = json.load(f)
+        old_entries = old_output.get('masks')
+    except Exception as e:
+        return fallback(f"读取上一次运行结果失败: {e}")
+    
+    prev_mask = cv2.imread(os.path.join(state_dir, "mask.png"), cv2.IMREAD_GRAYSCALE)
+    rgba_img, binary_mask, channel_order = open_element_sources(rgba_path, mask_path)
+    
+    if state.get('dedup') or old_entries is None:
+        return fallback("上一次为去重输出")
+    if old_output.get('channel_order') != ELEMENT_CHANNEL_ORDER:
+        return fallback("上一次输出为旧的通道顺序格式")
+    if state.get('min_area') != int(min_area):
+        return fallback("最小面积阈值已变化")
+    if prev_mask is None or prev_mask.shape != binary_mask.shape:
+        return fallback("蒙版尺寸已变化")
+    if state.get('rgb_digest') != compute_rgb_digest(rgba_img, channel_order):
+        return fallback("透明图内容已变化")
+    
+    region = find_dirty_region(prev_mask, binary_mask)
+    if region is None:
+        print("蒙版没有变化，复用上一次的全部输出")
+        return
+    
+    rx1, ry1, rx2, ry2 = region
+    print(f"蒙版改动区域: ({rx1},{ry1})-({rx2},{ry2})")
+    
+    # 完整落在改动区域内的旧元素需要重新生成，其余直接复用
+    kept = []
+    removed = 0
+    for old_idx, entry in enumerate(old_entries):
+        coords = entry.get('bbox_xyxy') or bbox_points_to_xyxy(entry['bbox'])
+        x1, y1, x2, y2 = coords
+        if x1 >= rx1 and y1 >= ry1 and x2 <= rx2 and y2 <= ry2:
+            removed += 1
+            old_file = os.path.join(elements_dir, f"element_{old_idx:03d}.png")
+            if os.path.exists(old_file):
+                os.remove(old_file)
+        else:
+            kept.append((old_idx, entry, tuple(coords)))
+    
+    new_elements = extract_elements_in_region(rgba_img, binary_mask, region, min_area, channel_order)
+    
+    # 复用的元素按原顺序重新编号，先改为临时文件名避免与目标文件名冲突
+    os.makedirs(elements_dir, exist_ok=True)
+    for old_idx, _, _ in kept:
+        old_file = os.path.join(elements_dir, f"element_{old_idx:03d}.png")
+        if os.path.exists(old_file):
+            os.replace(old_file, old_file + ".tmp")
+    for new_idx, (old_idx, _, _) in enumerate(kept):
+        tmp_file = os.path.join(elements_dir, f"element_{old_idx:03d}.png.tmp")
+        if os.path.exists(tmp_file):
+            os.replace(tmp_file, os.path.join(elements_dir, f"element_{new_idx:03d}.png"))
+    
+    entries = [entry for _, entry, _ in kept]
+    for offset, (element_img, coords_info) in enumerate(new_elements):
+        filename = f"element_{len(kept) + offset:03d}.png"
+        cv2.imwrite(os.path.join(elements_dir, filename), element_img)
+        entries.append(element_to_json_entry(element_img, coords_info))
+        print(f"保存元素: {filename}")
+    
+    print(f"\n增量处理完成！复用 {len(kept)} 个元素，移除 {removed} 个，重新生成 {len(new_elements)} 个")
+    
+    result = None
+    try:
+        with open(json_output_file, 'w', encoding='utf-8') as f:
+            result = {
+                "channel_order": ELEMENT_CHANNEL_ORDER,
+                "image_size": [int(rgba_img.shape[1]), int(rgba_img.shape[0])],
+                "masks": entries
+            }
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"JSON输出已保存到: {json_output_file}")
+    except Exception as e:
+        print(f"生成JSON输出失败: {e}")
+    if archive:
+        save_element_archive(result, output_dir)
+    
+    coords_list = [coords for _, _, coords in kept]
+    coords_list += [coords_info['coords'] for _, coords_info in new_elements]
+    save_element_index(coords_list, output_dir)
+    save_incremental_state(output_dir, rgba_img, binary_mask, min_area, False, channel_order)
+
+
+def clear_extract_outputs(output_dir):
+    """删除输出目录中上一次元素提取生成的文件（见 EXTRACT_OUTPUTS），不影响目录中的其他文件"""
+    import shutil
+    removed = False
+    for name in EXTRACT_OUTPUTS:
+        path = os.path.join(output_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            continue
+        removed = True
+    if removed:
+        print(f"已清空上一次的元素输出: {output_dir}")
+
+
+def process_single_image(rgba_path, mask_path, output_dir, min_area=100, dedup=False, max_memory=None, archive=False,
+                         detect_repeats=False):
+    """处理单张图片，提取元素；max_memory（字节）不为空时，估算工作集超出预算则按条带提取；
+    archive为True时另存元素打包文件elements.elpk；detect_repeats为True时检测重复周期，只在一个周期上提取"""
+    # 清空上一次提取的输出（如果存在）
+    clear_extract_outputs(output_dir)
     
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
     
     # 从图片中提取元素
     print("正在从图片中提取元素...")
-    all_elements = extract_elements_from_image(rgba_path, mask_path, min_area)
+    rgba_img, binary_mask, channel_order = open_element_sources(rgba_path, mask_path)
+    all_elements = None
+    if detect_repeats:
+        all_elements = extract_elements_periodic(rgba_img, binary_mask, min_area, channel_order)
+    if all_elements is None:
+        band_height = None
+        governor = None
+        if max_memory:
+            governor = MemoryGovernor(max_memory, "提取")
+            band_height = plan_extraction(governor, rgba_img, binary_mask)
+        if band_height:
+            all_elements = extract_elements_in_strips(rgba_img, binary_mask, band_height, min_area, channel_order,
+                                                      governor)
+        else:
+            all_elements = extract_elements_from_arrays(rgba_img, binary_mask, min_area, channel_order)
     
     # 获取图片尺寸
-    rgba_img = cv2.imread(rgba_path, cv2.IMREAD_UNCHANGED)
-    if rgba_img is not None:
-        img_h, img_w = rgba_img.shape[:2]
-    else:
-        img_w, img_h = 0, 0
+    img_h, img_w = rgba_img.shape[:2]
     
     # 保存提取的元素
     elements_dir = os.path.join(output_dir, "elements")
     os.makedirs(elements_dir, exist_ok=True)
+    json_output_file = os.path.join(output_dir, "elements_output.json")
+    
+    if dedup:
+        # 去重模式：每个唯一图案只保存一次
+        motifs, instances = dedup_elements(all_elements)
+        for idx, (motif_img, _) in enumerate(motifs):
+            filename = f"motif_{idx:03d}.png"
+            cv2.imwrite(os.path.join(elements_dir, filename), motif_img)
+            print(f"保存图案: {filename}")
+        
+        print(f"\n处理完成！共提取 {len(instances)} 个元素，去重后 {len(motifs)} 个唯一图案")
+        print(f"元素保存在: {elements_dir}")
+        print(f"原图尺寸: {img_w}x{img_h} (宽x高)")
+        
+        result = generate_dedup_json_output(motifs, instances, json_output_file, (img_w, img_h))
+        if archive:
+            save_element_archive(result, output_dir)
+        save_element_index([instance['coords'] for instance in instances], output_dir)
+        save_incremental_state(output_dir, rgba_img, binary_mask, min_area, dedup, channel_order)
+        return
     
     for idx, (element_img, coords_info) in enumerate(all_elements):
         # 使用简单的自然数排序命名
@@ -195,8 +989,11 @@ def process_single_image(rgba_path, mask_path, output_dir, min_area=100):
     print(f"原图尺寸: {img_w}x{img_h} (宽x高)")
     
     # 生成JSON输出
-    json_output_file = os.path.join(output_dir, "elements_output.json")
-    generate_json_output(all_elements, json_output_file)
+    result = generate_json_output(all_elements, json_output_file, (img_w, img_h))
+    if archive:
+        save_element_archive(result, output_dir)
+    save_element_index([coords_info['coords'] for _, coords_info in all_elements], output_dir)
+    save_incremental_state(output_dir, rgba_img, binary_mask, min_area, dedup, channel_order)
 
 
 def main():
@@ -208,6 +1005,13 @@ def main():
     parser.add_argument("--output", default=None, help="输出目录")
     parser.add_argument("--min-area", type=int, default=None, help="最小元素面积阈值")
     parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--dedup", action="store_true", help="对重复图案去重，每个唯一图案只保存一次")
+    parser.add_argument("--incremental", action="store_true", help="增量模式：只重新提取蒙版改动区域内的元素")
+    parser.add_argument("--max-memory", default=None, help="内存预算（如 2G、512M），估算超出时按条带提取元素")
+    parser.add_argument("--archive", action="store_true",
+                        help="另存元素打包文件elements.elpk，合并脚本可按偏移直接读取单个元素")
+    parser.add_argument("--detect-period", action="store_true",
+                        help="检测四方连续图片的重复周期，只在一个周期上提取元素，再平铺到整图")
     
     args = parser.parse_args()
     
@@ -237,11 +1041,25 @@ def main():
     output_dir = args.output or get_config_value(config, '4图合并提取元素', 'OUTPUT_DIR', 'merged_output')
     min_area = args.min_area or int(get_config_value(config, '4图合并提取元素', 'MIN_AREA', '100'))
     
+    dedup = args.dedup or bool(get_config_value(config, '4图合并提取元素', 'DEDUP', False))
+    incremental = args.incremental or bool(get_config_value(config, '4图合并提取元素', 'INCREMENTAL', False))
+    archive = args.archive or bool(get_config_value(config, '4图合并提取元素', 'ARCHIVE', False))
+    detect_repeats = args.detect_period or bool(get_config_value(config, '4图合并提取元素', 'DETECT_PERIOD', False))
+    
     print(f"输出目录: {output_dir}")
     print(f"最小面积阈值: {min_area}")
+    print(f"重复图案去重: {'开启' if dedup else '关闭'}")
+    max_memory = parse_memory_size(args.max_memory)
+    if max_memory:
+        print(f"内存预算: {format_bytes(max_memory)}")
     
     # 处理单张图片
-    process_single_image(rgba_path, mask_path, output_dir, min_area)
+    if incremental and not dedup:
+        process_single_image_incremental(rgba_path, mask_path, output_dir, min_area, max_memory, archive)
+    else:
+        if incremental:
+            print("增量模式不支持去重输出，执行完整处理")
+        process_single_image(rgba_path, mask_path, output_dir, min_area, dedup, max_memory, archive, detect_repeats)
 
 
 if __name__ == "__main__":
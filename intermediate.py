@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阶段间中间结果
+去背景输出的掩码和透明图可以保存为未压缩的.npy，下游的元素提取和颜色分析用内存映射直接打开，
+省去PNG的压缩和解压；该格式只用于中间结果，最终输出仍使用PNG等图片格式
+"""
+
+import os
+
+import numpy as np
+
+
+INTERMEDIATE_EXTENSION = ".npy"
+
+
+def is_intermediate(path: str) -> bool:
+    """按扩展名判断是否为.npy中间结果"""
+    return isinstance(path, str) and path.lower().endswith(INTERMEDIATE_EXTENSION)
+
+
+def save_intermediate(array: np.ndarray, path: str) -> None:
+    """
+    保存中间结果：先写入同目录的临时文件再原子改名，
+    下游进程不会读到写了一半的文件
+
+    Args:
+        array: 图像数组（掩码为HxW，透明图为HxWx4，RGBA顺序）
+        path: 输出路径（.npy）
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_intermediate(path: str, mmap: bool = True) -> np.ndarray:
+    """
+    打开中间结果
+
+    Args:
+        path: .npy路径
+        mmap: 为True时只读内存映射，只有实际访问的部分才会从磁盘读取
+
+    Returns:
+        图像数组（内存映射时为只读的np.memmap）
+    """
+    return np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
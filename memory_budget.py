@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存预算
+rmbg.py 和 grid_split_elements.py 的 --max-memory 参数：处理每张图片前先估算工作集，
+超出预算时按顺序降低预取张数、改用条带模式、降低模型输入尺寸或缩小图片，每一次调整都会打印出来。
+
+预算只包含推理和提取本身的工作集，不含Python解释器和PyTorch等库的基础内存占用
+"""
+
+import re
+from typing import List, Optional
+
+
+_SIZE_UNITS = {"": 1 << 20, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_memory_size(text) -> Optional[int]:
+    """
+    解析内存大小，如 "512M"、"2G"、"1.5GB"；不带单位的数字按MB计
+
+    Returns:
+        字节数，text 为空时返回None
+    """
+    if text is None or text == "":
+        return None
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)(?:I?B)?\s*", str(text).upper())
+    if not match:
+        raise ValueError(f"无法解析的内存大小: {text}（示例: 512M、2G）")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def format_bytes(size: float) -> str:
+    """字节数转为便于阅读的MB/GB"""
+    if size >= 1 << 30:
+        return f"{size / (1 << 30):.2f}GB"
+    return f"{size / (1 << 20):.0f}MB"
+
+
+class MemoryGovernor:
+    """记录预算和已做出的调整"""
+
+    def __init__(self, budget: int, name: str = ""):
+        self.budget = budget
+        self.name = name
+        self.adaptations: List[str] = []
+
+    def fits(self, estimate: float) -> bool:
+        return estimate <= self.budget
+
+    def format(self, message: str) -> str:
+        return f"[内存预算{'/' + self.name if self.name else ''}] {message}"
+
+    def adapt(self, message: str, echo: bool = True) -> str:
+        """记录一次调整，echo为True时立即打印；返回带前缀的日志行"""
+        self.adaptations.append(message)
+        line = self.format(message)
+        if echo:
+            print(line)
+        return line
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """
 更好的合并结果脚本
-强制修复BGR到RGB通道问题
+元素JSON为RGBA通道顺序，兼容旧版BGR顺序的元素数据
 """
 
 import json
@@ -11,65 +11,210 @@ import io
 import numpy as np
 from PIL import Image
 import os
+import sys
+import argparse
+import time
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
+from element_archive import DEFAULT_ARCHIVE_NAME, ElementArchive, is_element_archive
+from png_stream import write_png_rows
+from tile_pyramid import DEFAULT_TILE_SIZE, TILE_LAYOUTS, write_tile_pyramid
 
-def load_colors_from_json(colors_file="output/merged_output/colors_output.json"):
-    """从colors_output.json加载背景颜色"""
+
+DEFAULT_COLORS_FILE = "output/merged_output/colors_output.json"
+DEFAULT_ELEMENTS_FILE = "output/merged_output/elements_output.json"
+DEFAULT_OUTPUT_FILE = "output/merged_final_better.png"
+
+
+def load_colors_from_json(colors_file=DEFAULT_COLORS_FILE, strict=False):
+    """从colors_output.json加载背景颜色；strict为True时读取失败或缺少backgroundColor1直接抛出异常"""
     try:
         with open(colors_file, 'r', encoding='utf-8') as f:
             colors_data = json.load(f)
         
         # 获取backgroundColor1的颜色值
+        if strict and 'backgroundColor1' not in colors_data:
+            raise ValueError(f"颜色文件中没有backgroundColor1: {colors_file}")
         bg1 = colors_data.get('backgroundColor1', [0, 0, 0, 1.0])
         return bg1
     except Exception as e:
+        if strict:
+            raise
         print(f"加载颜色文件失败: {e}")
         return [0, 0, 0, 1.0]
 
 
-def load_elements_from_json(elements_file="output/merged_output/elements_output.json"):
+def load_elements_from_json(elements_file=DEFAULT_ELEMENTS_FILE, strict=False):
     """从elements_output.json加载元素信息"""
+    return load_elements_and_size(elements_file, strict)[0]
+
+
+def load_elements_and_size(elements_file=DEFAULT_ELEMENTS_FILE, strict=False):
+    """从elements_output.json或元素打包文件加载元素信息和原图尺寸 (宽, 高)，旧版JSON没有尺寸时返回None
+    
+    strict为True时读取失败直接抛出异常，否则打印错误并返回空列表。
+    """
+    if is_element_archive(elements_file):
+        return load_elements_from_archive(elements_file, strict)
     try:
         with open(elements_file, 'r', encoding='utf-8') as f:
             elements_data = json.load(f)
         
-        return elements_data.get('masks', [])
+        # 旧版元素JSON没有channel_order字段，图片为BGR顺序
+        channel_order = elements_data.get('channel_order', 'BGRA')
+        image_size = tuple(elements_data['image_size']) if 'image_size' in elements_data else None
+        
+        # 去重格式：唯一图案只存一份，实例通过索引引用图案
+        if 'instances' in elements_data:
+            motifs = elements_data.get('motifs', [])
+            return [
+                {
+                    'mask': motifs[instance['motif']]['mask'],
+                    'bbox': instance['bbox'],
+                    'bbox_xyxy': instance.get('bbox_xyxy'),
+                    'motif': instance['motif'],
+                    'transform': instance.get('transform', 'identity'),
+                    'channel_order': channel_order
+                }
+                for instance in elements_data['instances']
+            ], image_size
+        
+        elements = elements_data.get('masks', [])
+        for element_info in elements:
+            element_info['channel_order'] = channel_order
+        return elements, image_size
     except Exception as e:
+        if strict:
+            raise
         print(f"加载元素文件失败: {e}")
-        return []
+        return [], None
 
 
-def base64_to_image_fixed(base64_str):
-    """强制修复BGR到RGB通道问题"""
+def load_elements_from_archive(elements_file, strict=False):
+    """从元素打包文件加载元素信息：只读取元素表，mask为内存映射上PNG的视图，解码时才读取图片数据"""
     try:
-        # 移除data:image/png;base64,前缀
-        if 'base64,' in base64_str:
-            base64_str = base64_str.split('base64,')[1]
-        
-        # 解码base64
-        image_data = base64.b64decode(base64_str)
+        archive = ElementArchive(elements_file)
+        elements = []
+        for k in range(len(archive)):
+            element_info = archive.element(k, with_stats=False)
+            element_info['mask'] = archive.blob_view(archive.blob_index(k))
+            element_info['channel_order'] = archive.channel_order
+            elements.append(element_info)
+        return elements, archive.image_size
+    except Exception as e:
+        if strict:
+            raise
+        print(f"加载元素文件失败: {e}")
+        return [], None
+
+
+def require_elements(elements, elements_file):
+    """严格模式下元素列表为空视为输入错误"""
+    if not elements:
+        raise ValueError(f"元素文件中没有元素: {elements_file}")
+
+
+# 去重图案的翻转/旋转变换，与grid_split_elements.py中的MOTIF_TRANSFORMS一致
+MOTIF_TRANSPOSE_METHODS = {
+    'rot90': Image.Transpose.ROTATE_90,
+    'rot180': Image.Transpose.ROTATE_180,
+    'rot270': Image.Transpose.ROTATE_270,
+    'flip_h': Image.Transpose.FLIP_LEFT_RIGHT,
+    'flip_v': Image.Transpose.FLIP_TOP_BOTTOM,
+    'transpose': Image.Transpose.TRANSPOSE,
+    'transverse': Image.Transpose.TRANSVERSE,
+}
+
+
+def apply_motif_transform(image, transform):
+    """对图案应用翻转/旋转变换，identity或未知变换时原样返回"""
+    method = MOTIF_TRANSPOSE_METHODS.get(transform)
+    if method is None:
+        return image
+    return image.transpose(method)
+
+
+def decode_element_array(base64_str, channel_order='RGBA', transform='identity'):
+    """将base64元素图片（或打包文件中的PNG字节）解码为RGBA数组，只有旧版BGR顺序的数据才交换通道"""
+    try:
+        if isinstance(base64_str, (bytes, memoryview)):
+            image_data = base64_str
+        else:
+            if 'base64,' in base64_str:
+                base64_str = base64_str.split('base64,')[1]
+            image_data = base64.b64decode(base64_str)
         
-        # 转换为PIL Image
         image = Image.open(io.BytesIO(image_data))
-        
-        # 确保图片是RGBA模式
         if image.mode != 'RGBA':
             image = image.convert('RGBA')
+        image = apply_motif_transform(image, transform)
         
-        # 强制修复：交换R和B通道
-        img_array = np.array(image)
-        if img_array.size > 0 and len(img_array.shape) == 3:
-            # 交换R和B通道
-            img_array[:, :, [0, 2]] = img_array[:, :, [2, 0]]
-            # 重新创建PIL图片
-            image = Image.fromarray(img_array, 'RGBA')
-        
-        return image
+        img_array = np.asarray(image)
+        if channel_order != 'RGBA':
+            img_array = img_array[:, :, [2, 1, 0, 3]]
+        return img_array
     except Exception as e:
         print(f"转换base64失败: {e}")
         return None
 
 
+def alpha_blend_into(canvas, element, x, y):
+    """将RGBA元素按alpha混合到画布(x, y)处，原地修改画布
+    
+    所有通道（包括alpha）按 src*a + dst*(255-a) 混合，取整方式与PIL的paste一致。
+    """
+    h, w = element.shape[:2]
+    region = canvas[y:y+h, x:x+w]
+    alpha = element[:, :, 3:4].astype(np.uint16)
+    blended = element.astype(np.uint16) * alpha + region.astype(np.uint16) * (255 - alpha) + 128
+    region[...] = (blended + (blended >> 8)) >> 8
+
+
+def alpha_blend_clipped(canvas, element, x, y):
+    """将元素混合到画布(x, y)处，超出画布的部分被裁掉"""
+    canvas_h, canvas_w = canvas.shape[:2]
+    h, w = element.shape[:2]
+    cx1, cy1 = max(x, 0), max(y, 0)
+    cx2, cy2 = min(x + w, canvas_w), min(y + h, canvas_h)
+    if cx1 >= cx2 or cy1 >= cy2:
+        return
+    alpha_blend_into(canvas, element[cy1-y:cy2-y, cx1-x:cx2-x], cx1, cy1)
+
+
+def alpha_blend_wrapped(canvas, element, x, y):
+    """四方连续模式：按画布尺寸取模，越过右/下边缘的部分从左/上边缘继续贴入"""
+    canvas_h, canvas_w = canvas.shape[:2]
+    h, w = element.shape[:2]
+    start_x, start_y = x % canvas_w, y % canvas_h
+    
+    pos_y = start_y
+    while pos_y + h > 0:
+        pos_x = start_x
+        while pos_x + w > 0:
+            alpha_blend_clipped(canvas, element, pos_x, pos_y)
+            pos_x -= canvas_w
+        pos_y -= canvas_h
+
+
+def tiled_view(canvas, rows, cols):
+    """返回画布重复 rows x cols 次的零拷贝视图，形状为 (rows, H, cols, W, 4)"""
+    return np.broadcast_to(canvas[None, :, None], (rows,) + canvas.shape[:1] + (cols,) + canvas.shape[1:])
+
+
+def save_tiled_preview(canvas, rows, cols, output_path):
+    """保存四方连续平铺预览，通过零拷贝视图逐行编码，不生成 rows x cols 倍大小的图片"""
+    height, width = canvas.shape[:2]
+    view = tiled_view(canvas, rows, cols)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    write_png_rows(
+        output_path, width * cols, height * rows,
+        (view[i, y].reshape(width * cols, 4) for i in range(rows) for y in range(height))
+    )
+    print(f"平铺预览已保存到: {output_path} ({rows}x{cols})")
+    return output_path
+
+
 def parse_bbox_coordinates(bbox):
     """解析bbox坐标，返回左上角和右下角坐标"""
     try:
@@ -87,28 +232,72 @@ def parse_bbox_coordinates(bbox):
         return 0, 0, 0, 0
 
 
-def create_merged_image(width=1536, height=1536):
-    """创建合并后的图片"""
-    print("开始创建合并图片（强制修复版本）...")
+def get_element_bbox(element_info):
+    """获取元素bbox (x1, y1, x2, y2)，优先使用数值bbox"""
+    if element_info.get('bbox_xyxy'):
+        return tuple(element_info['bbox_xyxy'])
+    return parse_bbox_coordinates(element_info.get('bbox', []))
+
+
+def create_merged_image(width=1536, height=1536, workers=None, seamless=False, preview=None,
+                        colors_file=DEFAULT_COLORS_FILE, elements_file=DEFAULT_ELEMENTS_FILE,
+                        output_path=DEFAULT_OUTPUT_FILE, tiles_dir=None, tile_layout="dzi",
+                        tile_size=DEFAULT_TILE_SIZE, strict=False):
+    """创建合并后的图片
+    
+    元素在线程池中解码，直接alpha混合到预分配的画布数组上。
+    seamless为True时画布尺寸取原图尺寸，元素越过边缘的部分从对边继续贴入；
+    preview为 (行数, 列数) 时额外保存平铺预览；
+    tiles_dir不为空时直接从画布生成多分辨率瓦片金字塔（有平铺预览时对平铺结果生成）；
+    strict为True时输入文件读取失败、没有元素或元素解码失败都抛出异常（批量模式使用）。
+    """
+    print("开始创建合并图片...")
     
     # 1. 加载背景颜色
-    bg_color = load_colors_from_json()
+    bg_color = load_colors_from_json(colors_file, strict)
     print(f"背景颜色: {bg_color}")
     
+    # 加载元素信息
+    elements, image_size = load_elements_and_size(elements_file, strict)
+    if strict:
+        require_elements(elements, elements_file)
+    print(f"加载到 {len(elements)} 个元素")
+    
+    if seamless:
+        if image_size:
+            width, height = image_size
+            print(f"四方连续模式：使用原图尺寸 {width}x{height}")
+        else:
+            print(f"警告：元素文件中没有原图尺寸，四方连续模式使用 {width}x{height}")
+    
     # 2. 创建背景图片
     # 将alpha值从0.0-1.0转换为0-255
     r, g, b, a = bg_color
     alpha = int(a * 255) if isinstance(a, float) else a
     
-    # 创建RGBA图片
-    background = Image.new('RGBA', (width, height), (r, g, b, alpha))
+    # 预分配RGBA画布数组
+    canvas = np.empty((height, width, 4), dtype=np.uint8)
+    canvas[:] = (r, g, b, alpha)
     print(f"创建背景图片: {width}x{height}, 颜色: RGBA({r},{g},{b},{alpha})")
     
-    # 3. 加载元素信息
-    elements = load_elements_from_json()
-    print(f"加载到 {len(elements)} 个元素")
+    # 4. 在线程池中解码元素，同一图案（相同变换）只解码一次
+    decode_jobs = {}
+    element_keys = []
+    for i, element_info in enumerate(elements):
+        mask_base64 = element_info.get('mask', '')
+        if 'motif' in element_info:
+            key = ('motif', element_info['motif'], element_info.get('transform', 'identity'))
+        else:
+            key = ('element', i)
+        element_keys.append(key)
+        if mask_base64 and key not in decode_jobs:
+            decode_jobs[key] = (mask_base64, element_info.get('channel_order', 'BGRA'),
+                                element_info.get('transform', 'identity'))
     
-    # 4. 将元素贴到背景上
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        decoded = dict(zip(decode_jobs, executor.map(lambda job: decode_element_array(*job), decode_jobs.values())))
+    
+    # 5. 将元素直接混合到画布数组上
     for i, element_info in enumerate(elements):
         try:
             # 获取mask和bbox
@@ -119,76 +308,404 @@ def create_merged_image(width=1536, height=1536):
                 print(f"元素 {i} 缺少必要信息，跳过")
                 continue
             
-            # 转换base64为图片（强制修复版本）
-            element_img = base64_to_image_fixed(mask_base64)
-            if element_img is None:
+            element_array = decoded.get(element_keys[i])
+            if element_array is None:
+                if strict:
+                    raise ValueError(f"元素 {i} 解码失败")
                 print(f"元素 {i} base64转换失败，跳过")
                 continue
             
-            # 解析坐标
-            x1, y1, x2, y2 = parse_bbox_coordinates(bbox)
+            # 解析坐标，优先使用数值bbox
+            x1, y1, x2, y2 = get_element_bbox(element_info)
             
-            # 确保坐标在图片范围内
-            if x1 < 0 or y1 < 0 or x2 > width or y2 > height:
+            # 确保坐标在图片范围内（四方连续模式下越界部分会绕回对边）
+            if not seamless and (x1 < 0 or y1 < 0 or x2 > width or y2 > height):
                 print(f"元素 {i} 坐标超出范围，跳过: ({x1},{y1})-({x2},{y2})")
                 continue
             
-            # 调整元素图片大小以匹配bbox
             element_width = x2 - x1
             element_height = y2 - y1
             
             if element_width > 0 and element_height > 0:
-                # 调整元素图片大小
-                element_img_resized = element_img.resize((element_width, element_height), Image.Resampling.LANCZOS)
+                # 只有尺寸与bbox不一致时才缩放
+                if element_array.shape[1] != element_width or element_array.shape[0] != element_height:
+                    element_array = np.asarray(Image.fromarray(element_array, 'RGBA').resize(
+                        (element_width, element_height), Image.Resampling.LANCZOS))
                 
-                # 将元素贴到背景上，使用alpha通道作为mask
-                background.paste(element_img_resized, (x1, y1), element_img_resized)
+                if seamless:
+                    alpha_blend_wrapped(canvas, element_array, x1, y1)
+                else:
+                    alpha_blend_into(canvas, element_array, x1, y1)
                 print(f"贴入元素 {i}: 位置({x1},{y1}), 尺寸({element_width}x{element_height})")
             else:
                 print(f"元素 {i} 尺寸无效: {element_width}x{element_height}")
                 
         except Exception as e:
+            if strict:
+                raise
             print(f"处理元素 {i} 时出错: {e}")
             continue
     
-    # 5. 保存结果
-    output_path = "output/merged_final_better.png"
-    
-    # 确保输出目录存在
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # 6. 保存结果，确保输出目录存在
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
     
     # 保存为PNG格式（保持透明度）
-    background.save(output_path, 'PNG')
+    Image.fromarray(canvas, 'RGBA').save(output_path, 'PNG')
     print(f"合并图片已保存到: {output_path}")
     
+    if preview:
+        rows, cols = preview
+        save_tiled_preview(canvas, rows, cols,
+                           os.path.join(os.path.dirname(output_path), f"merged_preview_{rows}x{cols}.png"))
+    
+    if tiles_dir:
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        write_tile_pyramid(canvas, tiles_dir, name, tile_size, tile_layout, repeat=preview or (1, 1), workers=workers)
+    
     return output_path
 
 
+def create_merged_image_streaming(width=1536, height=1536, workers=None, strip_height=512,
+                                  colors_file=DEFAULT_COLORS_FILE, elements_file=DEFAULT_ELEMENTS_FILE,
+                                  output_path=DEFAULT_OUTPUT_FILE, strict=False):
+    """按水平条带流式合并超大画布
+    
+    元素按顶部y坐标排序，每次只合成一个条带并逐行写入PNG，元素在进入条带时才解码、
+    离开后释放，峰值内存与条带大小成正比，而不是与整个画布成正比；
+    去重格式中同一图案（相同变换和尺寸）只解码一次，解码结果在整个合并过程中复用。
+    strict与create_merged_image相同。
+    """
+    print("开始流式创建合并图片...")
+    
+    bg_color = load_colors_from_json(colors_file, strict)
+    r, g, b, a = bg_color
+    alpha = int(a * 255) if isinstance(a, float) else a
+    print(f"背景颜色: RGBA({r},{g},{b},{alpha})，画布: {width}x{height}，条带高度: {strip_height}")
+    
+    elements = load_elements_from_json(elements_file, strict)
+    if strict:
+        require_elements(elements, elements_file)
+    print(f"加载到 {len(elements)} 个元素")
+    
+    # 过滤无效元素，按顶部y坐标排序（同一y按原顺序，保证叠放顺序与整图合并一致）
+    placed = []
+    for i, element_info in enumerate(elements):
+        if not element_info.get('mask') or not element_info.get('bbox'):
+            print(f"元素 {i} 缺少必要信息，跳过")
+            continue
+        x1, y1, x2, y2 = get_element_bbox(element_info)
+        if x1 < 0 or y1 < 0 or x2 > width or y2 > height:
+            print(f"元素 {i} 坐标超出范围，跳过: ({x1},{y1})-({x2},{y2})")
+            continue
+        if x2 <= x1 or y2 <= y1:
+            print(f"元素 {i} 尺寸无效: {x2 - x1}x{y2 - y1}")
+            continue
+        placed.append((y1, i, (x1, y1, x2, y2)))
+    placed.sort()
+    
+    motif_decodes = {}
+    
+    def decode(item):
+        _, i, (x1, y1, x2, y2) = item
+        element_info = elements[i]
+        element_array = decode_element_array(element_info['mask'], element_info.get('channel_order', 'BGRA'),
+                                             element_info.get('transform', 'identity'))
+        if element_array is not None and element_array.shape[:2] != (y2 - y1, x2 - x1):
+            element_array = np.asarray(Image.fromarray(element_array, 'RGBA').resize(
+                (x2 - x1, y2 - y1), Image.Resampling.LANCZOS))
+        return element_array
+    
+    def strip_rows(executor):
+        active = []  # [(原序号, bbox, future)]
+        next_idx = 0
+        pasted = 0
+        for strip_y in range(0, height, strip_height):
+            strip_end = min(strip_y + strip_height, height)
+            
+            # 顶部进入当前条带的元素提交解码，底部已离开的元素释放
+            while next_idx < len(placed) and placed[next_idx][0] < strip_end:
+                item = placed[next_idx]
+                element_info = elements[item[1]]
+                if 'motif' in element_info:
+                    x1, y1, x2, y2 = item[2]
+                    key = (element_info['motif'], element_info.get('transform', 'identity'), x2 - x1, y2 - y1)
+                    if key not in motif_decodes:
+                        motif_decodes[key] = executor.submit(decode, item)
+                    future = motif_decodes[key]
+                else:
+                    future = executor.submit(decode, item)
+                active.append((item[1], item[2], future))
+                next_idx += 1
+            active = [entry for entry in active if entry[1][3] > strip_y]
+            active.sort(key=lambda entry: entry[0])
+            
+            strip = np.empty((strip_end - strip_y, width, 4), dtype=np.uint8)
+            strip[:] = (r, g, b, alpha)
+            for i, (x1, y1, x2, y2), future in active:
+                element_array = future.result()
+                if element_array is None:
+                    if strict:
+                        raise ValueError(f"元素 {i} 解码失败")
+                    continue
+                alpha_blend_clipped(strip, element_array, x1, y1 - strip_y)
+                if y2 <= strip_end:
+                    pasted += 1
+            
+            for row in strip:
+                yield row
+        print(f"共贴入 {pasted} 个元素")
+    
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        write_png_rows(output_path, width, height, strip_rows(executor))
+    print(f"合并图片已保存到: {output_path}")
+    
+    return output_path
+
+
+def collect_batch_jobs(sources, output_dir=None):
+    """收集批量合并任务
+    
+    sources中的每一项可以是目录（递归查找elements_output.json，同目录下需有colors_output.json），
+    也可以是列表文件（每行为 "元素JSON 颜色JSON [输出PNG]"，#开头为注释）。
+    未指定输出路径时，结果保存在元素JSON同目录；指定output_dir时按相对目录保存到output_dir下。
+    输出路径与之前的任务相同时跳过该任务并打印警告。
+    """
+    jobs = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                if os.path.basename(DEFAULT_ELEMENTS_FILE) not in files:
+                    continue
+                colors_file = os.path.join(root, os.path.basename(DEFAULT_COLORS_FILE))
+                if not os.path.exists(colors_file):
+                    print(f"警告：{root} 中缺少颜色文件，跳过")
+                    continue
+                if output_dir:
+                    output_path = os.path.join(output_dir, os.path.relpath(root, source),
+                                               os.path.basename(DEFAULT_OUTPUT_FILE))
+                else:
+                    output_path = os.path.join(root, os.path.basename(DEFAULT_OUTPUT_FILE))
+                # 同目录有不早于JSON的元素打包文件时优先读取打包文件
+                elements_file = os.path.join(root, os.path.basename(DEFAULT_ELEMENTS_FILE))
+                archive_file = os.path.join(root, DEFAULT_ARCHIVE_NAME)
+                if os.path.exists(archive_file) and os.path.getmtime(archive_file) >= os.path.getmtime(elements_file):
+                    elements_file = archive_file
+                jobs.append({
+                    "elements": elements_file,
+                    "colors": colors_file,
+                    "output": os.path.normpath(output_path)
+                })
+        elif os.path.isfile(source):
+            with open(source, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    parts = line.split()
+                    if not parts or parts[0].startswith('#'):
+                        continue
+                    if len(parts) < 2:
+                        print(f"警告：{source} 第{line_no}行格式错误，跳过")
+                        continue
+                    elements_file, colors_file = parts[0], parts[1]
+                    if len(parts) > 2:
+                        output_path = parts[2]
+                    elif output_dir:
+                        output_path = os.path.join(output_dir, f"merged_{len(jobs):04d}.png")
+                    else:
+                        output_path = os.path.join(os.path.dirname(elements_file),
+                                                   os.path.basename(DEFAULT_OUTPUT_FILE))
+                    if not os.path.exists(elements_file) or not os.path.exists(colors_file):
+                        print(f"警告：{source} 第{line_no}行的输入文件不存在，跳过")
+                        continue
+                    jobs.append({"elements": elements_file, "colors": colors_file, "output": output_path})
+        else:
+            print(f"警告：批量输入不存在: {source}")
+    
+    # 输出路径相同的任务会互相覆盖，只保留第一个
+    unique_jobs = []
+    outputs = {}
+    for job in jobs:
+        key = os.path.normcase(os.path.abspath(job["output"]))
+        if key in outputs:
+            print(f"警告：{job['elements']} 的输出路径与 {outputs[key]} 相同（{job['output']}），跳过；"
+                  f"请在列表文件中为其指定输出PNG")
+            continue
+        outputs[key] = job["elements"]
+        unique_jobs.append(job)
+    return unique_jobs
+
+
+def is_job_up_to_date(job):
+    """输出文件比元素JSON和颜色JSON都新时视为已是最新"""
+    if not os.path.exists(job["output"]):
+        return False
+    output_mtime = os.path.getmtime(job["output"])
+    return all(output_mtime > os.path.getmtime(job[key]) for key in ("elements", "colors"))
+
+
+def run_merge_job(job, width=1536, height=1536, workers=1, seamless=False,
+                  streaming=False, strip_height=512):
+    """在子进程中执行单个合并任务，返回 (是否成功, 耗时秒数, 错误信息)
+    
+    先写入临时文件再原子替换，中途失败不会留下看似最新的半成品；逐元素的日志不输出，避免多进程日志交错，
+    因此以严格模式合并：输入读取失败、没有元素或元素解码失败都作为任务失败返回。
+    """
+    start = time.perf_counter()
+    output_path = job["output"]
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        if streaming and seamless:
+            raise ValueError("流式模式不支持四方连续合并")
+        with contextlib.redirect_stdout(io.StringIO()):
+            if streaming:
+                result = create_merged_image_streaming(width, height, workers, strip_height=strip_height,
+                                                       colors_file=job["colors"], elements_file=job["elements"],
+                                                       output_path=tmp_path, strict=True)
+            else:
+                result = create_merged_image(width, height, workers, seamless=seamless,
+                                             colors_file=job["colors"], elements_file=job["elements"],
+                                             output_path=tmp_path, strict=True)
+        os.replace(result, output_path)
+        return True, time.perf_counter() - start, None
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False, time.perf_counter() - start, str(e)
+
+
+def run_batch_merge(jobs, processes=None, force=False, **options):
+    """
+    多进程批量合并
+    
+    Args:
+        jobs: collect_batch_jobs返回的任务列表
+        processes: 进程数，默认为CPU核数
+        force: 为True时忽略输出文件时间，全部重新合并
+        options: 传给run_merge_job的合并参数
+        
+    Returns:
+        (成功数, 跳过数, 失败数)
+    """
+    pending = [job for job in jobs if force or not is_job_up_to_date(job)]
+    skipped = len(jobs) - len(pending)
+    print(f"共 {len(jobs)} 个任务，已是最新跳过 {skipped} 个，需要合并 {len(pending)} 个，"
+          f"进程数: {processes or os.cpu_count()}")
+    
+    succeeded = failed = 0
+    job_seconds = 0.0
+    start = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(run_merge_job, job, **options): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                ok, elapsed, error = future.result()
+                job_seconds += elapsed
+                if ok:
+                    succeeded += 1
+                    print(f"  ✓ {job['output']}  {elapsed:.2f}s")
+                else:
+                    failed += 1
+                    print(f"  ✗ {job['elements']}  {elapsed:.2f}s  错误: {error}")
+    
+    wall = time.perf_counter() - start
+    print(f"批量合并完成：成功 {succeeded}，跳过 {skipped}，失败 {failed}；"
+          f"总耗时 {wall:.2f}s，任务累计 {job_seconds:.2f}s")
+    return succeeded, skipped, failed
+
+
+def parse_grid(value):
+    """解析 "行x列" 格式的平铺参数，如 3x3"""
+    try:
+        rows, cols = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"平铺参数格式应为 行x列，如 3x3: {value}")
+    if rows <= 0 or cols <= 0:
+        raise argparse.ArgumentTypeError(f"平铺行列数必须为正数: {value}")
+    return rows, cols
+
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="将颜色分析和元素提取结果合并为一张图片")
+    parser.add_argument("--width", type=int, default=1536, help="画布宽度")
+    parser.add_argument("--height", type=int, default=1536, help="画布高度")
+    parser.add_argument("--workers", type=int, default=None, help="解码元素的线程数")
+    parser.add_argument("--seamless", action="store_true",
+                        help="四方连续模式：画布尺寸取原图尺寸，越过边缘的元素从对边绕回")
+    parser.add_argument("--streaming", action="store_true",
+                        help="流式模式：按水平条带合成并逐行写入PNG，适合超大画布")
+    parser.add_argument("--strip-height", type=int, default=512, help="流式模式的条带高度（像素）")
+    parser.add_argument("--preview", type=parse_grid, default=None, help="额外输出平铺预览，格式为 行x列，如 3x3")
+    parser.add_argument("--batch", nargs='+', metavar="SOURCE",
+                        help="批量模式：包含elements_output.json/colors_output.json的目录，或每行为 元素JSON 颜色JSON [输出PNG] 的列表文件")
+    parser.add_argument("--batch-output", default=None, help="批量模式的输出目录，默认保存在元素JSON同目录")
+    parser.add_argument("--processes", type=int, default=None, help="批量模式的进程数，默认为CPU核数")
+    parser.add_argument("--force", action="store_true", help="批量模式下忽略输出文件时间，全部重新合并")
+    parser.add_argument("--tiles", default=None, metavar="DIR",
+                        help="额外输出多分辨率瓦片金字塔到该目录，浏览器查看器只加载需要的瓦片（与 --preview 同用时对平铺结果生成）")
+    parser.add_argument("--tile-layout", default="dzi", choices=TILE_LAYOUTS,
+                        help="瓦片布局：dzi（Deep Zoom，OpenSeadragon）或 xyz（{z}/{x}/{y}.png，Leaflet等）")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE, help="瓦片边长（像素）")
+    parser.add_argument("--colors", default=None, help=f"颜色文件，默认为 {DEFAULT_COLORS_FILE}")
+    parser.add_argument("--elements", default=None,
+                        help=f"元素文件：elements_output.json 或元素打包文件（.elpk），默认为 {DEFAULT_ELEMENTS_FILE}，"
+                             f"同目录有更新的 {DEFAULT_ARCHIVE_NAME} 时使用打包文件")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FILE, help=f"输出图片路径，默认为 {DEFAULT_OUTPUT_FILE}")
+    args = parser.parse_args()
+    if args.streaming:
+        # 流式合成按条带裁剪元素，不支持越过边缘绕回，也没有整幅画布可用于平铺预览和瓦片
+        unsupported = [flag for flag, value in (("--seamless", args.seamless), ("--preview", args.preview),
+                                                ("--tiles", args.tiles)) if value]
+        if unsupported:
+            hint = "；瓦片可对输出图片运行 tile_pyramid.py 生成" if args.tiles else ""
+            parser.error(f"--streaming 不支持与 {'、'.join(unsupported)} 同时使用{hint}")
+    
     print("=" * 60)
     print("更好的图片结果合并脚本")
-    print("强制修复BGR到RGB通道问题")
     print("=" * 60)
     
+    if args.batch:
+        jobs = collect_batch_jobs(args.batch, args.batch_output)
+        # 多进程并行时每个进程只用一个解码线程，避免线程数超过CPU核数
+        _, _, failed = run_batch_merge(jobs, processes=args.processes, force=args.force,
+                                       width=args.width, height=args.height, workers=args.workers or 1,
+                                       seamless=args.seamless, streaming=args.streaming,
+                                       strip_height=args.strip_height)
+        sys.exit(1 if failed else 0)
+    
     try:
         # 检查输入文件是否存在
-        colors_file = "output/merged_output/colors_output.json"
-        elements_file = "output/merged_output/elements_output.json"
+        colors_file = args.colors or DEFAULT_COLORS_FILE
+        elements_file = args.elements or DEFAULT_ELEMENTS_FILE
+        if not args.elements:
+            archive_file = os.path.join(os.path.dirname(DEFAULT_ELEMENTS_FILE), DEFAULT_ARCHIVE_NAME)
+            if os.path.exists(archive_file) and (not os.path.exists(elements_file) or
+                                                 os.path.getmtime(archive_file) >= os.path.getmtime(elements_file)):
+                elements_file = archive_file
         
         if not os.path.exists(colors_file):
             print(f"错误: 颜色文件不存在: {colors_file}")
-            return
+            sys.exit(1)
         
         if not os.path.exists(elements_file):
             print(f"错误: 元素文件不存在: {elements_file}")
-            return
+            sys.exit(1)
         
         print(f"✓ 颜色文件: {colors_file}")
         print(f"✓ 元素文件: {elements_file}")
         
         # 创建合并图片
-        output_path = create_merged_image()
+        if args.streaming:
+            output_path = create_merged_image_streaming(args.width, args.height, args.workers,
+                                                        strip_height=args.strip_height, colors_file=colors_file,
+                                                        elements_file=elements_file, output_path=args.output)
+        else:
+            output_path = create_merged_image(args.width, args.height, args.workers,
+                                              seamless=args.seamless, preview=args.preview,
+                                              colors_file=colors_file, elements_file=elements_file,
+                                              output_path=args.output, tiles_dir=args.tiles,
+                                              tile_layout=args.tile_layout, tile_size=args.tile_size)
         
         if output_path and os.path.exists(output_path):
             print("\n" + "=" * 60)
@@ -197,9 +714,11 @@ def main():
             print("=" * 60)
         else:
             print("\n合并失败！")
+            sys.exit(1)
             
     except Exception as e:
         print(f"脚本执行失败: {e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重复周期检测
+很多输入本身已经是同一图案块重复2x2、3x3次的四方连续图。用FFT计算图片水平和垂直方向的自相关，
+在能整除图片尺寸的周期中找出自相关接近1、且按周期平铺后与原图几乎一致的最小周期；
+rmbg.py 和 grid_split_elements.py 的 --detect-period 只处理一个周期，再平铺回原尺寸。
+"""
+
+import argparse
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_MAX_REPEATS = 8
+# 周期的最小边长，更短的"周期"通常只是沿该方向变化很小的图片
+MIN_PERIOD = 32
+# 自相关阈值：完全重复的图片在周期处的循环自相关为1
+DEFAULT_MIN_SCORE = 0.9
+# 平铺误差阈值：按周期平铺后与原图的平均绝对差（灰度0-255），允许JPEG等有损压缩带来的小差异
+DEFAULT_MAX_ERROR = 3.0
+# 平铺误差还不能超过图片整体反差（与均值的平均绝对差）的这个比例，避免把几乎纯色的图片当成重复
+MAX_RELATIVE_ERROR = 0.25
+# 计算自相关时每次处理的行数，限制FFT中间数组的大小
+_FFT_CHUNK_ROWS = 256
+# 每个方向最多取这么多行（列）计算自相关：重复图片的每一行都有相同的周期，均匀抽取不影响结果
+_ACF_SAMPLE_LINES = 1024
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """转为float32灰度（各通道均值，与通道顺序无关，忽略alpha）"""
+    if image.ndim == 2:
+        return image.astype(np.float32)
+    gray = image[..., 0].astype(np.float32)
+    gray += image[..., 1]
+    gray += image[..., 2]
+    gray /= 3
+    return gray
+
+
+def _row_autocorrelation(gray: np.ndarray) -> np.ndarray:
+    """各行循环自相关之和：按行做实数FFT，功率谱累加后一次逆变换"""
+    width = gray.shape[1]
+    power = np.zeros(width // 2 + 1)
+    for start in range(0, gray.shape[0], _FFT_CHUNK_ROWS):
+        spectrum = np.fft.rfft(gray[start:start + _FFT_CHUNK_ROWS], axis=1)
+        power += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=0)
+    return np.fft.irfft(power, n=width)
+
+
+def autocorrelation_profiles(gray: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    水平和垂直方向的归一化循环自相关，每个方向均匀抽取最多 _ACF_SAMPLE_LINES 行（列）
+
+    Returns:
+        (acf_x, acf_y)，acf_x[L] 为图片与水平平移L像素后的相关系数，acf_x[0] 为1
+    """
+    height, width = gray.shape
+    mean = gray.mean()
+    rows = gray[::max(1, height // _ACF_SAMPLE_LINES)] - mean
+    columns = np.ascontiguousarray(gray[:, ::max(1, width // _ACF_SAMPLE_LINES)].T) - mean
+    acf_x = _row_autocorrelation(rows)
+    acf_y = _row_autocorrelation(columns)
+    if acf_x[0] <= 0 or acf_y[0] <= 0:
+        # 纯色图片（或抽取的行列没有变化）没有可比较的结构
+        return np.zeros_like(acf_x), np.zeros_like(acf_y)
+    return acf_x / acf_x[0], acf_y / acf_y[0]
+
+
+def _axis_error(gray: np.ndarray, period: int, axis: int) -> float:
+    """沿一个方向平移一个周期后与自身的平均绝对差"""
+    if axis == 1:
+        return float(np.abs(gray[:, period:] - gray[:, :-period]).mean())
+    return float(np.abs(gray[period:] - gray[:-period]).mean())
+
+
+def _best_period(acf: np.ndarray, gray: np.ndarray, axis: int, max_repeats: int,
+                 min_score: float, max_error: float) -> Tuple[int, float, float]:
+    """从重复次数最多（周期最短）的候选开始，返回第一个满足阈值的 (周期, 自相关, 误差)"""
+    size = gray.shape[axis]
+    best_score = 0.0
+    for repeats in range(min(max_repeats, size // MIN_PERIOD), 1, -1):
+        if size % repeats:
+            continue
+        period = size // repeats
+        score = float(acf[period])
+        best_score = max(best_score, score)
+        if score < min_score:
+            continue
+        error = _axis_error(gray, period, axis)
+        if error <= max_error:
+            return period, score, error
+    return size, best_score, 0.0
+
+
+def detect_period(image: np.ndarray, max_repeats: int = DEFAULT_MAX_REPEATS, min_score: float = DEFAULT_MIN_SCORE,
+                  max_error: float = DEFAULT_MAX_ERROR) -> Dict:
+    """
+    检测图片的水平和垂直重复周期
+
+    Args:
+        image: (H, W) 或 (H, W, C) 数组
+        max_repeats: 每个方向最多检测的重复次数
+        min_score: 周期处自相关的最低值
+        max_error: 沿该方向平移一个周期后与自身的最大平均绝对差（0-255）
+
+    Returns:
+        字典: period (宽, 高)、repeats (水平次数, 垂直次数)、score (水平, 垂直自相关)、
+        error（按周期平铺后与原图的平均绝对差）、confidence（0-1）；
+        没有检测到重复的方向周期为图片尺寸，重复次数为1，score 为该方向候选周期中的最高自相关
+    """
+    gray = to_gray(image)
+    height, width = gray.shape
+    contrast = float(np.abs(gray - gray.mean()).mean())
+    error_limit = min(max_error, MAX_RELATIVE_ERROR * contrast)
+    acf_x, acf_y = autocorrelation_profiles(gray)
+    period_x, score_x, _ = _best_period(acf_x, gray, 1, max_repeats, min_score, error_limit)
+    period_y, score_y, _ = _best_period(acf_y, gray, 0, max_repeats, min_score, error_limit)
+
+    repeats = (width // period_x, height // period_y)
+    error = 0.0
+    confidence = 0.0
+    if repeats != (1, 1):
+        block = gray[:period_y, :period_x]
+        error = float(np.abs(gray.reshape(repeats[1], period_y, repeats[0], period_x)
+                             - block[None, :, None, :]).mean())
+        # 置信度：重复方向的自相关中较低的一个，再按平铺误差相对图片整体反差的比例打折
+        scores = [score for score, count in zip((score_x, score_y), repeats) if count > 1]
+        confidence = max(0.0, min(scores)) * max(0.0, 1.0 - error / max(contrast, 1e-6))
+    return {
+        "period": (period_x, period_y),
+        "repeats": repeats,
+        "score": (round(score_x, 4), round(score_y, 4)),
+        "error": round(error, 3),
+        "confidence": round(confidence, 4),
+    }
+
+
+def format_period(result: Dict) -> str:
+    """检测结果的一行说明"""
+    (px, py), (kx, ky) = result["period"], result["repeats"]
+    if kx * ky == 1:
+        return f"未检测到重复（自相关最高 {max(result['score']):.3f}）"
+    return (f"周期 {px}x{py}，重复 {kx}x{ky}，置信度 {result['confidence']:.3f}"
+            f"（自相关 {result['score'][0]:.3f}/{result['score'][1]:.3f}，平铺误差 {result['error']:.2f}）")
+
+
+def single_period(image: np.ndarray, result: Optional[Dict]) -> np.ndarray:
+    """取出左上角的一个周期（未检测到重复时返回原图）"""
+    if not result or result["repeats"] == (1, 1):
+        return image
+    px, py = result["period"]
+    return image[:py, :px]
+
+
+def tile_to_size(block: np.ndarray, repeats: Tuple[int, int]) -> np.ndarray:
+    """把一个周期的结果按 (水平, 垂直) 次数平铺回原尺寸"""
+    kx, ky = repeats
+    if kx * ky == 1:
+        return block
+    return np.tile(block, (ky, kx) + (1,) * (block.ndim - 2))
+
+
+def main():
+    """检测图片的重复周期"""
+    parser = argparse.ArgumentParser(description="用FFT自相关检测四方连续图片的重复周期")
+    parser.add_argument("images", nargs='+', help="图片路径")
+    parser.add_argument("--max-repeats", type=int, default=DEFAULT_MAX_REPEATS, help="每个方向最多检测的重复次数")
+    parser.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE, help="周期处自相关的最低值")
+    parser.add_argument("--max-error", type=float, default=DEFAULT_MAX_ERROR,
+                        help="平移一个周期后与自身的最大平均绝对差（0-255）")
+    args = parser.parse_args()
+
+    for path in args.images:
+        image = np.asarray(Image.open(path).convert('RGB'))
+        result = detect_period(image, args.max_repeats, args.min_score, args.max_error)
+        print(f"{path}: {format_period(result)}")
+
+
+if __name__ == "__main__":
+    main()
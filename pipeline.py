@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+带依赖跟踪的流水线执行脚本
+按 去背景 -> 元素提取 / 颜色分析 -> 合并 的依赖关系执行各脚本，
+每个阶段记录 输入文件内容 + config.json相关配置节 + 脚本代码 的哈希，
+哈希未变化且输出文件存在时跳过该阶段（类似make），互不依赖的阶段并行执行
+"""
+
+import ast
+import json
+import os
+import sys
+import shlex
+import hashlib
+import argparse
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional
+
+
+DEFAULT_STATE_FILE = "output/.pipeline_state.json"
+DEFAULT_MERGE_OUTPUT = "output/merged_final_better.png"
+
+# 阶段定义：执行的脚本、默认参数、依赖的阶段、参与哈希的配置项
+# 参与哈希的代码为脚本本身及其（递归）导入的项目内模块，见 stage_code_files
+# sections中配置节对应None表示整个配置节参与哈希，否则只有列出的配置项参与
+PIPELINE_STAGES = {
+    "rmbg": {
+        "script": "rmbg.py",
+        "args": [],
+        "depends": [],
+        "sections": {"图片去背景": None},
+    },
+    "extract": {
+        "script": "grid_split_elements.py",
+        "args": [],
+        "depends": ["rmbg"],
+        "sections": {"4图合并提取元素": None},
+    },
+    "colors": {
+        "script": "color_analyzer.py",
+        "args": [],
+        "depends": ["rmbg"],
+        "sections": {"图片去背景": ["INPUT_PATH", "OUTPUT_PATH"], "4图合并提取元素": ["MASK_PATH", "OUTPUT_DIR"]},
+    },
+    "merge": {
+        "script": "merge_results_better.py",
+        "args": [],
+        "depends": ["extract", "colors"],
+        "sections": {"4图合并提取元素": ["OUTPUT_DIR"]},
+    },
+}
+
+STAGE_NAMES = {
+    "rmbg": "图片去背景",
+    "extract": "元素提取",
+    "colors": "颜色分析",
+    "merge": "合并结果",
+}
+
+
+def load_config(config_file="config.json"):
+    """从config.json文件加载配置"""
+    if not os.path.exists(config_file):
+        print(f"警告：配置文件 {config_file} 不存在，将使用默认配置")
+        return {}
+
+    with open(config_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def get_config_value(config, section, key, default_value):
+    """从配置中获取值，如果不存在则返回默认值"""
+    if config and section in config and key in config[section]:
+        return config[section][key]
+    return default_value
+
+
+def stage_code_files(script: str) -> List[str]:
+    """
+    脚本及其递归导入的项目内模块（与脚本同目录的 .py 文件），按AST解析import语句，
+    修改任何一个被导入的模块都会使阶段哈希变化
+
+    Returns:
+        排序后的文件路径列表
+    """
+    root = os.path.dirname(os.path.abspath(script))
+    found = set()
+    pending_files = [os.path.abspath(script)]
+    while pending_files:
+        path = pending_files.pop()
+        if path in found or not os.path.isfile(path):
+            continue
+        found.add(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_file = os.path.join(root, name.split('.')[0] + ".py")
+                if os.path.isfile(module_file):
+                    pending_files.append(module_file)
+    return sorted(os.path.relpath(path) for path in found)
+
+
+def stage_data_files(config: Dict):
+    """元素提取和颜色分析的输出（合并阶段的输入），都位于 OUTPUT_DIR 下
+
+    Returns:
+        (元素JSON, 颜色JSON)
+    """
+    output_dir = get_config_value(config, "4图合并提取元素", "OUTPUT_DIR", "output/merged_output")
+    return os.path.join(output_dir, "elements_output.json"), os.path.join(output_dir, "colors_output.json")
+
+
+def config_stage_args(stage: str, config: Dict) -> List[str]:
+    """由配置决定的阶段参数：颜色分析写入、合并读取 OUTPUT_DIR 下的文件，合并结果写入默认输出路径"""
+    elements_file, colors_file = stage_data_files(config)
+    if stage == "colors":
+        return ["--json", colors_file]
+    if stage == "merge":
+        return ["--elements", elements_file, "--colors", colors_file, "--output", DEFAULT_MERGE_OUTPUT]
+    return []
+
+
+def arg_value(args: List[str], flags: List[str], default: Optional[str] = None) -> Optional[str]:
+    """取参数列表中某个选项的值，与argparse一致以最后一次出现为准，支持 --flag value 和 --flag=value"""
+    value = default
+    for i, arg in enumerate(args):
+        for flag in flags:
+            if arg == flag and i + 1 < len(args):
+                value = args[i + 1]
+            elif arg.startswith(flag + "="):
+                value = arg[len(flag) + 1:]
+    return value
+
+
+def resolve_stage_files(stage: str, config: Dict, args: List[str]):
+    """
+    根据配置和阶段参数确定阶段的输入和输出文件（参数中指定的路径优先于配置）
+
+    Returns:
+        (输入路径列表, 输出文件列表)
+    """
+    rmbg_output = get_config_value(config, "图片去背景", "OUTPUT_PATH", "output/rmbg_output")
+    mask_path = get_config_value(config, "4图合并提取元素", "MASK_PATH", "output/rmbg_output/mask.png")
+    rgba_path = get_config_value(config, "4图合并提取元素", "RGBA_PATH", "output/rmbg_output/rgba.png")
+    elements_file, colors_file = stage_data_files(config)
+
+    if stage == "rmbg":
+        inputs = [get_config_value(config, "图片去背景", "INPUT_PATH", "input/test.png")]
+        ext = "." + get_config_value(config, "图片去背景", "OUTPUT_CODEC", "png")
+        outputs = [os.path.join(rmbg_output, "mask" + ext), os.path.join(rmbg_output, "rgba" + ext)]
+    elif stage == "extract":
+        inputs = [arg_value(args, ["--rgba-path"], rgba_path), arg_value(args, ["--mask-path"], mask_path)]
+        output_dir = arg_value(args, ["--output"])
+        outputs = [os.path.join(output_dir, "elements_output.json") if output_dir else elements_file]
+    elif stage == "colors":
+        # 颜色分析读取原图；只统计背景时还依赖去背景生成的蒙版
+        inputs = [get_config_value(config, "图片去背景", "INPUT_PATH", "input/test.png")]
+        if "--background-only" in args or "-b" in args:
+            inputs.append(mask_path)
+        mask_arg = arg_value(args, ["--mask"])
+        if mask_arg:
+            inputs.append(mask_arg)
+        outputs = [arg_value(args, ["--json", "-j"], colors_file)]
+    else:
+        inputs = [arg_value(args, ["--elements"], elements_file), arg_value(args, ["--colors"], colors_file)]
+        outputs = [arg_value(args, ["--output"], DEFAULT_MERGE_OUTPUT)]
+    return inputs, outputs
+
+
+def hash_path(hasher, path: str) -> None:
+    """把文件（或目录下所有文件）的相对路径和内容写入哈希，路径不存在时写入标记"""
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path) for name in names
+        )
+    elif os.path.isfile(path):
+        files = [path]
+    else:
+        hasher.update(f"missing:{path}\n".encode('utf-8'))
+        return
+
+    for file_path in files:
+        hasher.update(f"file:{os.path.relpath(file_path, path)}\n".encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+
+
+def file_signature(path: str) -> Optional[List[int]]:
+    """输出文件的 [修改时间(ns), 大小]，文件不存在时为None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def compute_stage_hash(stage: str, config: Dict, args: List[str]) -> str:
+    """计算阶段哈希：代码文件 + 相关配置节 + 命令行参数 + 输入文件内容"""
+    spec = PIPELINE_STAGES[stage]
+    hasher = hashlib.blake2b(digest_size=16)
+
+    for code_file in stage_code_files(spec["script"]):
+        hasher.update(f"code:{code_file}\n".encode('utf-8'))
+        hash_path(hasher, code_file)
+
+    sections = {}
+    for section, keys in spec["sections"].items():
+        values = config.get(section) or {}
+        sections[section] = values if keys is None else {key: values.get(key) for key in keys}
+    hasher.update(json.dumps(sections, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    hasher.update(json.dumps(args).encode('utf-8'))
+
+    inputs, _ = resolve_stage_files(stage, config, args)
+    for input_path in inputs:
+        hasher.update(f"input:{input_path}\n".encode('utf-8'))
+        hash_path(hasher, input_path)
+
+    return hasher.hexdigest()
+
+
+class PipelineRunner:
+    """按依赖关系调度各阶段，记录并比较阶段哈希"""
+
+    def __init__(self, config_file: str = "config.json", state_file: str = DEFAULT_STATE_FILE,
+                 stage_args: Optional[Dict[str, List[str]]] = None, force: bool = False):
+        """
+        初始化流水线
+
+        Args:
+            config_file: 配置文件路径
+            state_file: 阶段哈希记录文件
+            stage_args: 各阶段额外的命令行参数，如 {"rmbg": ["--model", "demo"]}
+            force: 为True时忽略记录的哈希，全部重新执行
+        """
+        self.config_file = config_file
+        self.config = load_config(config_file)
+        self.state_file = state_file
+        self.force = force
+        self.stage_args = {
+            stage: spec["args"] + config_stage_args(stage, self.config) + list((stage_args or {}).get(stage, []))
+            for stage, spec in PIPELINE_STAGES.items()
+        }
+        if config_file != "config.json":
+            for stage in ("rmbg", "extract", "colors"):
+                self.stage_args[stage] += ["--config", config_file]
+        self.state = self._load_state()
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"警告：阶段记录文件损坏，将重新执行所有阶段: {self.state_file}")
+            return {}
+
+    def _save_state(self) -> None:
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def is_up_to_date(self, stage: str, stage_hash: str) -> bool:
+        """
+        记录的哈希一致，且所有输出文件仍是该阶段上次写入的版本（修改时间和大小未变）时，阶段无需重新执行；
+        输出被其他阶段或手动删除、覆盖时重新执行。在上游阶段结束后调用，看到的是上游执行后的输出
+        """
+        record = self.state.get(stage)
+        if self.force or not isinstance(record, dict) or record.get("hash") != stage_hash:
+            return False
+        _, outputs = resolve_stage_files(stage, self.config, self.stage_args[stage])
+        recorded = record.get("outputs", {})
+        return all(path in recorded and file_signature(path) == recorded[path] for path in outputs)
+
+    def run_stage(self, stage: str) -> Dict:
+        """执行单个阶段（上游阶段完成后才计算哈希，上游输出未变化时下游同样跳过）"""
+        args = self.stage_args[stage]
+        stage_hash = compute_stage_hash(stage, self.config, args)
+        if self.is_up_to_date(stage, stage_hash):
+            return {"stage": stage, "status": "skipped", "elapsed": 0.0, "output": ""}
+
+        _, outputs = resolve_stage_files(stage, self.config, args)
+        before = {path: file_signature(path) for path in outputs}
+        command = [sys.executable, PIPELINE_STAGES[stage]["script"]] + args
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='replace')
+        elapsed = time.perf_counter() - start
+
+        if result.returncode != 0:
+            return {"stage": stage, "status": "failed", "elapsed": elapsed,
+                    "output": result.stdout + result.stderr}
+
+        # 脚本正常退出但没有写出输出时，不能把上一次遗留的输出记录为本次结果
+        stale = [path for path in outputs if file_signature(path) is None or file_signature(path) == before[path]]
+        if stale:
+            return {"stage": stage, "status": "failed", "elapsed": elapsed,
+                    "output": result.stdout + result.stderr + f"\n错误：输出文件未生成或未更新: {', '.join(stale)}"}
+
+        # 以执行前计算的输入哈希作为记录，执行期间输入被修改时下次会重新执行
+        with self._lock:
+            self.state[stage] = {"hash": stage_hash, "outputs": {path: file_signature(path) for path in outputs}}
+            self._save_state()
+        return {"stage": stage, "status": "done", "elapsed": elapsed, "output": result.stdout}
+
+    def select_stages(self, stages: List[str]) -> List[str]:
+        """补全依赖的阶段，按定义顺序返回"""
+        selected = set()
+        pending_stack = list(stages)
+        while pending_stack:
+            stage = pending_stack.pop()
+            if stage not in selected:
+                selected.add(stage)
+                pending_stack.extend(PIPELINE_STAGES[stage]["depends"])
+        return [stage for stage in PIPELINE_STAGES if stage in selected]
+
+    def run(self, stages: List[str], jobs: int = 2, verbose: bool = False) -> bool:
+        """
+        按依赖关系执行阶段，依赖都已完成的阶段并行执行
+
+        Args:
+            stages: 需要执行的阶段（依赖的阶段会自动加入）
+            jobs: 同时执行的阶段数
+            verbose: 是否输出各脚本的完整日志
+
+        Returns:
+            所有阶段是否成功
+        """
+        order = self.select_stages(stages)
+
+        finished = {}
+        running = {}
+        pipeline_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while len(finished) < len(order):
+                for stage in order:
+                    if stage in finished or stage in running.values():
+                        continue
+                    depends = PIPELINE_STAGES[stage]["depends"]
+                    if any(finished.get(dep) in ("failed", "blocked") for dep in depends):
+                        finished[stage] = "blocked"
+                        print(f"[跳过] {STAGE_NAMES[stage]}：上游阶段失败")
+                        continue
+                    if all(dep in finished for dep in depends):
+                        print(f"[开始] {STAGE_NAMES[stage]}")
+                        running[executor.submit(self.run_stage, stage)] = stage
+
+                if not running:
+                    if len(finished) < len(order):
+                        # 依赖关系有误（如循环依赖）时没有可执行的阶段，不能空转等待
+                        pending = [STAGE_NAMES[stage] for stage in order if stage not in finished]
+                        raise RuntimeError(f"以下阶段的依赖无法满足: {'、'.join(pending)}")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    result = future.result()
+                    finished[stage] = result["status"]
+                    if result["status"] == "skipped":
+                        print(f"[最新] {STAGE_NAMES[stage]}：输入、配置和代码均未变化，跳过")
+                    elif result["status"] == "done":
+                        print(f"[完成] {STAGE_NAMES[stage]}  {result['elapsed']:.2f}s")
+                    else:
+                        print(f"[失败] {STAGE_NAMES[stage]}  {result['elapsed']:.2f}s")
+                    if result["output"] and (verbose or result["status"] == "failed"):
+                        print(result["output"].rstrip())
+
+        print(f"流水线结束，总耗时 {time.perf_counter() - pipeline_start:.2f}s")
+        return all(status in ("done", "skipped") for status in finished.values())
+
+    def explain(self, stages: List[str]) -> None:
+        """打印各阶段当前是否为最新（上游需要执行时，下游的结果以实际执行时为准）"""
+        for stage in self.select_stages(stages):
+            stage_hash = compute_stage_hash(stage, self.config, self.stage_args[stage])
+            status = "最新" if self.is_up_to_date(stage, stage_hash) else "需要执行"
+            print(f"{STAGE_NAMES[stage]:<8} {status}  {stage_hash}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='按依赖关系执行图片处理流水线，跳过输入未变化的阶段')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('--stages', nargs='+', choices=list(PIPELINE_STAGES), default=["extract", "colors"],
+                        help='需要执行的阶段（依赖的阶段自动加入），默认执行到元素提取和颜色分析')
+    parser.add_argument('--merge', action='store_true', help='同时执行合并阶段')
+    parser.add_argument('--force', action='store_true', help='忽略阶段记录，全部重新执行')
+    parser.add_argument('--jobs', type=int, default=2, help='同时执行的阶段数')
+    parser.add_argument('--state', default=DEFAULT_STATE_FILE, help='阶段哈希记录文件')
+    parser.add_argument('--dry-run', action='store_true', help='只显示各阶段是否需要执行')
+    parser.add_argument('--verbose', '-v', action='store_true', help='输出各脚本的完整日志')
+    for stage in PIPELINE_STAGES:
+        parser.add_argument(f'--{stage}-args', default='', help=f'{STAGE_NAMES[stage]}阶段的额外参数，如 "--model demo"')
+
+    args = parser.parse_args()
+
+    stages = list(args.stages) + (["merge"] if args.merge else [])
+    stage_args = {stage: shlex.split(getattr(args, f"{stage}_args")) for stage in PIPELINE_STAGES}
+    runner = PipelineRunner(args.config, args.state, stage_args=stage_args, force=args.force)
+
+    if args.dry_run:
+        runner.explain(stages)
+        return
+
+    success = runner.run(stages, jobs=args.jobs, verbose=args.verbose)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐行写入PNG
+rmbg.py 的条带写出和 merge_results_better.py 的流式合并、平铺预览共用，内存占用只与行宽有关
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+def filter_row(raw, prev, bpp=4):
+    """
+    按PNG自适应过滤规则为一行选择过滤类型，返回 过滤类型字节 + 过滤后的数据
+
+    依次计算 None/Sub/Up/Average/Paeth 五种过滤结果，取按有符号字节求绝对值和最小的一种（与 libpng 的启发式相同）。
+    raw 和 prev 为一维 uint8 数组，prev 为上一行的原始数据，第一行时为 None。
+    """
+    raw16 = raw.astype(np.int16)
+    left = np.zeros_like(raw16)
+    left[bpp:] = raw16[:-bpp]
+    up = prev.astype(np.int16) if prev is not None else np.zeros_like(raw16)
+    up_left = np.zeros_like(raw16)
+    up_left[bpp:] = up[:-bpp]
+    
+    # Paeth 预测：取 left、up、up_left 中最接近 left + up - up_left 的一个
+    pa = np.abs(up - up_left)
+    pb = np.abs(left - up_left)
+    pc = np.abs(left + up - 2 * up_left)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+    
+    candidates = [raw16, raw16 - left, raw16 - up, raw16 - (left + up) // 2, raw16 - paeth]
+    filtered = [(c & 0xFF).astype(np.uint8) for c in candidates]
+    costs = [int(np.abs(f.view(np.int8).astype(np.int32)).sum()) for f in filtered]
+    filter_type = costs.index(min(costs))
+    return bytes((filter_type,)) + filtered[filter_type].tobytes()
+
+
+def write_png_rows(output_path, width, height, rows, compress_level=6):
+    """
+    逐行写入RGBA PNG，rows依次产出每一行 (width, 4) 的uint8数组，内存占用只与行宽有关
+
+    每行按 filter_row 自适应选择过滤类型，只需保留上一行，输出大小与 PIL 保存的PNG相当。
+    """
+    def chunk(f, chunk_type, data):
+        f.write(struct.pack('>I', len(data)))
+        f.write(chunk_type)
+        f.write(data)
+        f.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+    
+    compressor = zlib.compressobj(compress_level)
+    pending = []
+    pending_size = 0
+    prev = None
+    with open(output_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        for row in rows:
+            raw = np.ascontiguousarray(row, dtype=np.uint8).reshape(-1)
+            data = compressor.compress(filter_row(raw, prev))
+            # 调用方可能复用行缓冲区，保留上一行的副本
+            prev = raw.copy()
+            if data:
+                pending.append(data)
+                pending_size += len(data)
+            if pending_size >= (1 << 20):
+                chunk(f, b'IDAT', b''.join(pending))
+                pending, pending_size = [], 0
+        pending.append(compressor.flush())
+        chunk(f, b'IDAT', b''.join(pending))
+        chunk(f, b'IEND', b'')
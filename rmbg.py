@@ -1,6 +1,13 @@
 import argparse
+import io
 import os
 import json
+import tempfile
+import threading
+import time
+import warnings
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 from typing import Tuple, Optional, List
 
@@ -11,6 +18,15 @@ import torch.nn.functional as F
 import torchvision.transforms as transforms
 from PIL import Image
 
+from autotune import (PREFETCH_CANDIDATES, TUNED_KEYS, choose_fastest, load_profile, median_seconds,
+					  profile_key, save_profile, thread_candidates, write_synthetic_images)
+from intermediate import save_intermediate
+from memory_budget import MemoryGovernor, parse_memory_size, format_bytes
+from period_detect import detect_period, format_period, single_period, tile_to_size
+from png_stream import write_png_rows
+from storage import (AsyncPrefetcher, AsyncUploader, LocalStorage, open_storage, is_remote, is_archive,
+					 DEFAULT_PREFETCH)
+
 try:
     from transformers import AutoModelForImageSegmentation
     TRANSFORMERS_AVAILABLE = True
@@ -53,9 +69,9 @@ def resize_mask_to_original(pred: torch.Tensor, original_size: Tuple[int, int])
 		uint8 掩码，形状 (H, W)，范围 [0, 255]。
 	"""
 	resized = F.interpolate(pred, size=original_size, mode='bilinear', align_corners=False)
-	mask = resized.squeeze().detach().cpu().numpy()
-	mask = np.clip(mask * 255.0, 0, 255).astype(np.uint8)
-	return mask
+	# 原地缩放和截断，原图大小的 float32 数组只保留一份
+	resized = resized.squeeze().detach().cpu().mul_(255.0).clamp_(0, 255)
+	return resized.to(torch.uint8).numpy()
 
 
 class BriaRMBG(nn.Module):
@@ -106,6 +122,93 @@ class BriaRMBG(nn.Module):
 		return x
 
 
+class DepthwiseSeparableBlock(nn.Module):
+	"""深度可分离卷积块：3x3 逐通道卷积 + 1x1 逐点卷积，输入输出形状一致时带残差连接"""
+
+	def __init__(self, in_channels: int, out_channels: int, stride: int = 1):
+		super(DepthwiseSeparableBlock, self).__init__()
+		self.depthwise = nn.Conv2d(in_channels, in_channels, 3, stride=stride, padding=1, groups=in_channels, bias=False)
+		self.bn1 = nn.BatchNorm2d(in_channels)
+		self.pointwise = nn.Conv2d(in_channels, out_channels, 1, bias=False)
+		self.bn2 = nn.BatchNorm2d(out_channels)
+		self.residual = stride == 1 and in_channels == out_channels
+
+	def forward(self, x: torch.Tensor) -> torch.Tensor:
+		out = F.relu(self.bn1(self.depthwise(x)))
+		out = self.bn2(self.pointwise(out))
+		if self.residual:
+			out = out + x
+		return F.relu(out)
+
+
+class StudentRMBG(nn.Module):
+	"""轻量学生模型：深度可分离卷积的 U-Net，编码器特征通过跳跃连接拼接到解码器
+
+	第一层即下采样到 1/2 分辨率，最后再双线性放大回输入尺寸，CPU 上的计算量约为 BriaRMBG 的几十分之一。
+	由 distill_student.py 用教师模型（官方 RMBG-2.0 或其他模型）生成的掩码蒸馏训练。
+	"""
+
+	def __init__(self, base_width: int = 16):
+		super(StudentRMBG, self).__init__()
+		w = base_width
+		self.base_width = base_width
+
+		# 编码器：1/2, 1/4, 1/8, 1/16
+		self.stem = nn.Sequential(
+			nn.Conv2d(3, w, 3, stride=2, padding=1, bias=False),
+			nn.BatchNorm2d(w),
+			nn.ReLU(inplace=True),
+		)
+		self.enc1 = DepthwiseSeparableBlock(w, w)
+		self.enc2 = DepthwiseSeparableBlock(w, 2 * w, stride=2)
+		self.enc3 = DepthwiseSeparableBlock(2 * w, 4 * w, stride=2)
+		self.enc4 = nn.Sequential(
+			DepthwiseSeparableBlock(4 * w, 8 * w, stride=2),
+			DepthwiseSeparableBlock(8 * w, 8 * w),
+		)
+
+		# 解码器：上采样后与同尺度编码器特征拼接
+		self.dec3 = DepthwiseSeparableBlock(8 * w + 4 * w, 4 * w)
+		self.dec2 = DepthwiseSeparableBlock(4 * w + 2 * w, 2 * w)
+		self.dec1 = DepthwiseSeparableBlock(2 * w + w, w)
+		self.head = nn.Conv2d(w, 1, 1)
+
+	@staticmethod
+	def _up_cat(x: torch.Tensor, skip: torch.Tensor) -> torch.Tensor:
+		x = F.interpolate(x, size=skip.shape[-2:], mode='bilinear', align_corners=False)
+		return torch.cat([x, skip], dim=1)
+
+	def forward(self, x: torch.Tensor) -> torch.Tensor:
+		size = x.shape[-2:]
+
+		s1 = self.enc1(self.stem(x))
+		s2 = self.enc2(s1)
+		s3 = self.enc3(s2)
+		x = self.enc4(s3)
+
+		x = self.dec3(self._up_cat(x, s3))
+		x = self.dec2(self._up_cat(x, s2))
+		x = self.dec1(self._up_cat(x, s1))
+
+		x = self.head(x)
+		x = F.interpolate(x, size=size, mode='bilinear', align_corners=False)
+		return torch.sigmoid(x)
+
+
+# 演示模型结构，权重文件中的 arch 字段决定使用哪一种
+DEMO_ARCHITECTURES = {
+	"bria": BriaRMBG,
+	"student": StudentRMBG,
+}
+
+
+def build_demo_model(arch: str = "bria", **kwargs) -> nn.Module:
+	"""按结构名创建演示模型"""
+	if arch not in DEMO_ARCHITECTURES:
+		raise ValueError(f"未知的模型结构: {arch}，可选: {', '.join(DEMO_ARCHITECTURES)}")
+	return DEMO_ARCHITECTURES[arch](**kwargs)
+
+
 def load_official_model(device: torch.device) -> nn.Module:
 	"""加载官方 RMBG-2.0 模型（推荐）"""
 	if not TRANSFORMERS_AVAILABLE:
@@ -131,7 +234,10 @@ def load_official_model(device: torch.device) -> nn.Module:
 
 
 def load_demo_model(weights_path: Optional[str], device: torch.device) -> nn.Module:
-	"""加载演示用的简单 U-Net 模型"""
+	"""加载演示用的简单 U-Net 模型
+
+	权重文件为 distill_student.py 保存的检查点（含 arch 字段）时，按其中记录的结构创建学生模型。
+	"""
 	model = BriaRMBG().to(device)
 	if weights_path:
 		# 如果路径不是绝对路径，则相对于项目根目录查找
@@ -144,10 +250,16 @@ def load_demo_model(weights_path: Optional[str], device: torch.device) -> nn.Mod
 		
 		print(f"[信息] 正在加载演示模型权重: {weights_path}")
 		state = torch.load(weights_path, map_location=device)
-		# 兼容 state_dict 或完整对象
+		# 兼容 state_dict 或完整对象；记录了结构的检查点严格匹配参数名
+		strict = False
 		if isinstance(state, dict) and 'state_dict' in state:
+			arch = state.get('arch', 'bria')
+			if arch != 'bria':
+				model = build_demo_model(arch, **state.get('arch_args', {})).to(device)
+				print(f"[信息] 模型结构: {arch} {state.get('arch_args', {})}")
+			strict = 'arch' in state
 			state = state['state_dict']
-		model.load_state_dict(state, strict=False)
+		model.load_state_dict(state, strict=strict)
 		print("[信息] 演示模型权重加载完成")
 	else:
 		print("[警告] 未提供权重文件，将使用随机初始化权重，仅用于流程验证。")
@@ -155,9 +267,16 @@ def load_demo_model(weights_path: Optional[str], device: torch.device) -> nn.Mod
 	return model
 
 
-def infer_single_image_official(model: nn.Module, image_path: str, device: torch.device, input_size: int) -> np.ndarray:
-	"""使用官方模型进行推理"""
-	image = Image.open(image_path)
+def open_image(image_path) -> Image.Image:
+	"""接受图片路径或已打开的 PIL 图像"""
+	if isinstance(image_path, Image.Image):
+		return image_path
+	return Image.open(image_path)
+
+
+def infer_single_image_official(model: nn.Module, image_path, device: torch.device, input_size: int) -> np.ndarray:
+	"""使用官方模型进行推理，image_path 也可以是已解码的 PIL 图像"""
+	image = open_image(image_path)
 	original_size = (image.height, image.width)
 	
 	# 官方模型的预处理
@@ -179,9 +298,9 @@ def infer_single_image_official(model: nn.Module, image_path: str, device: torch
 	return mask
 
 
-def infer_single_image_demo(model: nn.Module, image_path: str, device: torch.device, input_size: int) -> np.ndarray:
-	"""使用演示模型进行推理"""
-	image = Image.open(image_path)
+def infer_single_image_demo(model: nn.Module, image_path, device: torch.device, input_size: int) -> np.ndarray:
+	"""使用演示模型进行推理，image_path 也可以是已解码的 PIL 图像"""
+	image = open_image(image_path)
 	original_size = (image.height, image.width)
 	input_tensor = preprocess_image(image, (input_size, input_size)).to(device)
 	with torch.no_grad():
@@ -190,17 +309,116 @@ def infer_single_image_demo(model: nn.Module, image_path: str, device: torch.dev
 	return mask
 
 
-def save_mask(mask: np.ndarray, out_path: str) -> None:
-	Image.fromarray(mask).save(out_path)
+def load_model(model_kind: str, weights: Optional[str], device: torch.device):
+	"""加载模型，返回 (模型, 推理函数)"""
+	if model_kind == "official":
+		return load_official_model(device), infer_single_image_official
+	return load_demo_model(weights, device), infer_single_image_demo
+
+
+# 推理引擎：eager=逐层执行（默认），channels_last=NHWC内存布局（CPU上卷积通常更快），jit=TorchScript追踪并冻结
+ENGINES = ("eager", "channels_last", "jit")
+
+
+def apply_engine(model: nn.Module, engine: str, device: torch.device, input_size: int) -> nn.Module:
+	"""按推理引擎转换模型；channels_last 原地修改模型，jit 追踪失败时返回原模型"""
+	if engine == "channels_last":
+		return model.to(memory_format=torch.channels_last)
+	if engine == "jit":
+		example = torch.zeros(1, 3, input_size, input_size, device=device)
+		try:
+			# 新版PyTorch对 torch.jit 给出弃用提示，追踪本身仍然可用
+			with torch.no_grad(), warnings.catch_warnings():
+				warnings.simplefilter("ignore", FutureWarning)
+				traced = torch.jit.trace(model, example, strict=False, check_trace=False)
+				return torch.jit.freeze(traced)
+		except Exception as e:
+			print(f"[警告] TorchScript 追踪失败，改用 eager: {e}")
+			return model
+	return model
+
+
+# 输出编码：png=PNG（可选压缩级别），webp=无损WebP，npy=未压缩的numpy数组
+OUTPUT_CODECS = {
+	"png": ".png",
+	"webp": ".webp",
+	"npy": ".npy",
+}
+DEFAULT_PNG_COMPRESS_LEVEL = 6  # 与PIL默认一致
+DEFAULT_WEBP_METHOD = 0  # 0最快，6压缩率最高
+
+
+def codec_from_path(path: str, default: str = "png") -> str:
+	"""按扩展名推断输出编码"""
+	ext = os.path.splitext(path)[1].lower()
+	for codec, codec_ext in OUTPUT_CODECS.items():
+		if ext == codec_ext:
+			return codec
+	return default
+
+
+def write_image_array(array: np.ndarray, out_path: str, codec: Optional[str] = None,
+					  compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL, webp_method: int = DEFAULT_WEBP_METHOD) -> None:
+	"""按指定编码保存 uint8 图像数组（灰度 HxW 或 RGBA HxWx4），不指定编码时按扩展名推断"""
+	codec = codec or codec_from_path(out_path)
+	if codec == "npy":
+		# 中间结果格式，写临时文件后原子改名，下游可用内存映射打开
+		save_intermediate(array, out_path)
+	else:
+		_save_with_pil(array, out_path, codec, compress_level, webp_method)
+
+
+def encode_image_array(array: np.ndarray, codec: str, compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL,
+					   webp_method: int = DEFAULT_WEBP_METHOD) -> bytes:
+	"""按指定编码把图像数组编码为字节，用于写入对象存储"""
+	buffer = io.BytesIO()
+	if codec == "npy":
+		np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+	else:
+		_save_with_pil(array, buffer, codec, compress_level, webp_method)
+	return buffer.getvalue()
+
+
+def _save_with_pil(array: np.ndarray, target, codec: str, compress_level: int, webp_method: int) -> None:
+	"""PNG/WebP编码，target 为路径或文件对象"""
+	if codec == "webp":
+		Image.fromarray(array).save(target, format='WEBP', lossless=True, quality=100, method=webp_method)
+	elif codec == "png":
+		Image.fromarray(array).save(target, format='PNG', compress_level=compress_level)
+	else:
+		raise ValueError(f"不支持的输出编码: {codec}，可选: {', '.join(OUTPUT_CODECS)}")
+
+
+def load_rgb_array(image) -> np.ndarray:
+	"""把图片路径或 PIL 图像解码为 HxWx3 的 uint8 数组"""
+	image = open_image(image)
+	if image.mode != 'RGB':
+		image = image.convert('RGB')
+	return np.asarray(image)
 
 
-def save_rgba_with_alpha(original_path: str, mask: np.ndarray, out_path: str) -> None:
-	img = Image.open(original_path)
-	if img.mode != 'RGBA':
-		img = img.convert('RGBA')
-	alpha = Image.fromarray(mask, mode='L')
-	r, g, b, _ = img.split()
-	Image.merge('RGBA', (r, g, b, alpha)).save(out_path)
+def save_mask(mask: np.ndarray, out_path: str, codec: Optional[str] = None,
+			  compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL) -> None:
+	write_image_array(mask, out_path, codec, compress_level)
+
+
+def save_rgba_with_alpha(original, mask: np.ndarray, out_path: str, codec: Optional[str] = None,
+						 compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL) -> None:
+	"""保存透明图
+
+	original 可以是图片路径、PIL 图像或已解码的 RGB 数组；传入数组时直接拼接 alpha 通道，
+	不再重新打开原图，也没有 split/merge 的中间拷贝。
+	"""
+	rgb = original if isinstance(original, np.ndarray) else load_rgb_array(original)
+	write_image_array(build_rgba(rgb, mask), out_path, codec, compress_level)
+
+
+def build_rgba(rgb: np.ndarray, mask: np.ndarray) -> np.ndarray:
+	"""在预分配的数组中拼接 RGB 和 alpha 通道"""
+	rgba = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+	rgba[..., :3] = rgb
+	rgba[..., 3] = mask
+	return rgba
 
 
 def load_config(config_file="config.json"):
@@ -226,15 +444,105 @@ def get_config_value(config, section, key, default_value):
 
 
 def collect_images(input_path: str) -> List[str]:
-	p = Path(input_path)
-	if p.is_file():
-		return [str(p)]
-	if not p.exists():
-		raise FileNotFoundError(f"输入路径不存在: {input_path}")
-	imgs = []
-	for ext in ["*.png", "*.jpg", "*.jpeg", "*.bmp", "*.webp"]:
-		imgs.extend([str(x) for x in p.rglob(ext)])
-	return imgs
+	if Path(input_path).is_file():
+		return [str(Path(input_path))]
+	storage = LocalStorage(input_path)
+	return [storage.locate(key) for key in storage.list_images()]
+
+
+def decode_rgb_bytes(data: bytes) -> np.ndarray:
+	"""把读取到的图片字节解码为 RGB 数组（在预取线程中执行）"""
+	return load_rgb_array(Image.open(io.BytesIO(data)))
+
+
+def save_rgba_strips(rgb: np.ndarray, mask: np.ndarray, out_path: str,
+					 compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL, strip_height: int = 64) -> None:
+	"""按条带拼接 RGB 和 alpha 并逐行写入PNG，不分配整幅透明图"""
+	height, width = mask.shape[:2]
+
+	def rows():
+		for y in range(0, height, strip_height):
+			strip = build_rgba(rgb[y:y + strip_height], mask[y:y + strip_height])
+			yield from strip
+
+	write_png_rows(out_path, width, height, rows(), compress_level)
+
+
+# --max-memory 的估算参数：模型权重占用、每个模型输入像素的激活占用，以及两个阶段中每个原图像素的数组占用。
+# 推理阶段为 RGB 及其 PIL 副本；输出阶段为 RGB、掩码、透明图及编码副本，条带写出时以掩码缩放的 float32 中间结果为主
+MODEL_WEIGHT_BYTES = {"official": 900 << 20, "demo": 8 << 20}
+MODEL_ACTIVATION_BYTES = {"official": 5000, "demo": 900}
+INFERENCE_BYTES_PER_PIXEL = 6
+OUTPUT_BYTES_PER_PIXEL = 12
+STRIP_OUTPUT_BYTES_PER_PIXEL = 8
+PREFETCH_BYTES_PER_PIXEL = 3  # 每张已预取解码、等待推理的RGB
+MIN_GOVERNED_INPUT_SIZE = 256
+
+
+def plan_inference(governor: MemoryGovernor, name: str, width: int, height: int, model_kind: str,
+				   size: int, prefetch: int, strip_capable: bool, encoded_bytes: int = 0) -> dict:
+	"""估算单张图片的推理工作集，超出预算时依次降低预取张数、改用条带写出、降低模型输入尺寸、缩小图片
+
+	encoded_bytes 为图片文件本身的大小，每张预取中的图片在解码前都以原始字节保存在内存中；
+	模型权重、激活和原始字节本身已超出预算时缩小图片也无济于事，保持原分辨率。
+	在预取线程中调用，调整记录在 notes 中，由主线程在处理该图片时打印，避免多个线程的日志交错
+
+	Returns:
+		{"prefetch", "strip", "size", "scale", "notes"}
+	"""
+	plan = {"prefetch": prefetch, "strip": False, "size": size, "scale": 1.0, "notes": []}
+
+	def adapt(message: str) -> None:
+		plan["notes"].append(governor.adapt(message, echo=False))
+
+	def estimate(scale: Optional[float] = None) -> float:
+		"""推理阶段和输出阶段中较大的一个"""
+		pixels = width * height * (plan["scale"] if scale is None else scale) ** 2
+		prefetched = PREFETCH_BYTES_PER_PIXEL * plan["prefetch"]
+		output = STRIP_OUTPUT_BYTES_PER_PIXEL if plan["strip"] else OUTPUT_BYTES_PER_PIXEL
+		activations = plan["size"] ** 2 * MODEL_ACTIVATION_BYTES[model_kind]
+		fixed = MODEL_WEIGHT_BYTES[model_kind] + encoded_bytes * plan["prefetch"]
+		return fixed + max(activations + pixels * (INFERENCE_BYTES_PER_PIXEL + prefetched),
+						   pixels * (output + prefetched))
+
+	initial = estimate()
+	if governor.fits(initial):
+		return plan
+	plan["notes"].append(f"[内存预算] {name} ({width}x{height}) 估算工作集 {format_bytes(initial)}，"
+						 f"超出预算 {format_bytes(governor.budget)}")
+
+	while not governor.fits(estimate()) and plan["prefetch"] > 1:
+		plan["prefetch"] -= 1
+	if plan["prefetch"] != prefetch:
+		adapt(f"{name}: 预取张数 {prefetch} -> {plan['prefetch']}")
+
+	if not governor.fits(estimate()) and strip_capable:
+		plan["strip"] = True
+		adapt(f"{name}: 透明图改为按条带写出PNG")
+
+	while not governor.fits(estimate()) and plan["size"] > MIN_GOVERNED_INPUT_SIZE:
+		plan["size"] = max(MIN_GOVERNED_INPUT_SIZE, plan["size"] // 2 // 32 * 32)
+	if plan["size"] != size:
+		adapt(f"{name}: 模型输入尺寸 {size} -> {plan['size']}")
+
+	if governor.fits(estimate()):
+		return plan
+	fixed = estimate(0.0)
+	if not governor.fits(fixed):
+		# 与图片尺寸无关的部分已超出预算，缩小图片只会降低输出质量
+		adapt(f"{name}: 模型权重、激活等固定部分估算 {format_bytes(fixed)} 已超出预算，缩小图片无法满足，"
+			  f"保持原分辨率继续处理（估算 {format_bytes(estimate())}）")
+		return plan
+	# 估算随比例单调增加，按0.01的步长找到满足预算的最大比例
+	scale = 0.99
+	while scale > 0.01 and not governor.fits(estimate(scale)):
+		scale = round(scale - 0.01, 2)
+	plan["scale"] = scale
+	adapt(f"{name}: 图片缩小为 {max(1, int(width * scale))}x{max(1, int(height * scale))}"
+		  f"（比例 {scale:.2f}），输出为缩小后的分辨率")
+	if not governor.fits(estimate()):
+		adapt(f"{name}: 已是最小设置，估算 {format_bytes(estimate())} 仍超出预算，继续处理")
+	return plan
 
 
 def ensure_dir(path: str) -> None:
@@ -243,20 +551,55 @@ def ensure_dir(path: str) -> None:
 
 def parse_args() -> argparse.Namespace:
 	parser = argparse.ArgumentParser(description="RMBG2.0 本地推理脚本")
-	parser.add_argument("--input", required=False, help="输入图片路径或文件夹（如果不提供，将从config.json读取）")
-	parser.add_argument("--output", required=False, help="输出目录或文件路径（如果不提供，将从config.json读取）")
+	parser.add_argument("--input", required=False,
+						help="输入图片路径、文件夹、zip/tar压缩包或 http(s):// 对象存储地址（如果不提供，将从config.json读取）")
+	parser.add_argument("--output", required=False,
+						help="输出目录、文件路径或 http(s):// 对象存储地址（如果不提供，将从config.json读取）")
 	parser.add_argument("--config", default="config.json", help="配置文件路径")
 	parser.add_argument("--model", default="official", choices=["official", "demo"], 
 						help="模型类型：official=官方RMBG-2.0（推荐），demo=简单演示模型")
 	parser.add_argument("--weights", required=False, default=None, 
 						help="仅demo模式需要：权重文件路径，如 models/demo.pth。不提供则使用随机权重")
 	parser.add_argument("--size", type=int, default=1024, help="模型输入的方形边长，官方推荐1024，demo可用320/512")
-	parser.add_argument("--device", default="auto", choices=["auto", "cpu", "cuda"], help="推理设备")
+	parser.add_argument("--device", default=None, choices=["auto", "cpu", "cuda"],
+						help="推理设备（默认读取自动调优档案，否则为auto）")
+	parser.add_argument("--threads", type=int, default=None,
+						help="PyTorch CPU线程数（默认读取自动调优档案，否则由PyTorch决定）")
+	parser.add_argument("--engine", default=None, choices=ENGINES,
+						help="推理引擎：eager、channels_last（NHWC布局）、jit（TorchScript），默认读取自动调优档案，否则为eager")
 	parser.add_argument("--save-mask", action="store_true", help="仅保存灰度掩码，不合成透明PNG")
 	parser.add_argument("--both", action="store_true", help="同时保存掩码与透明PNG")
+	parser.add_argument("--codec", default=None, choices=list(OUTPUT_CODECS),
+						help="输出编码：png、webp（无损）、npy（未压缩数组），默认读取config.json的OUTPUT_CODEC")
+	parser.add_argument("--prefetch", type=int, default=None,
+						help=f"后台预取并解码的输入张数（默认{DEFAULT_PREFETCH}，也可在config.json中设置PREFETCH）")
+	parser.add_argument("--max-memory", default=None,
+						help="内存预算（如 2G、512M），超出时自动降低预取张数、按条带写出、降低输入尺寸或缩小图片")
+	parser.add_argument("--png-level", type=int, default=None, choices=range(10), metavar="0-9",
+						help="PNG压缩级别，0不压缩最快，9压缩率最高，默认6")
+	parser.add_argument("--autotune", action="store_true",
+						help="在合成图片上测试设备、线程数、推理引擎和预取张数，把最快的配置保存到本机的自动调优档案后退出")
+	parser.add_argument("--autotune-images", type=int, default=6, help="自动调优使用的合成图片张数")
+	parser.add_argument("--autotune-image-size", type=int, default=1024, help="自动调优合成图片的边长")
+	parser.add_argument("--autotune-runs", type=int, default=3, help="自动调优中每个候选的计时次数（取中位数）")
+	parser.add_argument("--profile", default=None,
+						help="自动调优档案路径（默认 models/autotune_profile.json）")
+	parser.add_argument("--no-profile", action="store_true", help="不读取自动调优档案")
+	parser.add_argument("--detect-period", action="store_true",
+						help="检测四方连续图片的重复周期，只对一个周期推理，掩码平铺回原尺寸")
 	return parser.parse_args()
 
 
+def infer_periodic(infer_fn, model, rgb: np.ndarray, device: torch.device, input_size: int,
+					img_path: str) -> np.ndarray:
+	"""检测重复周期，只对左上角的一个周期推理，掩码平铺回原尺寸；未检测到重复时对整图推理"""
+	result = detect_period(rgb)
+	print(f"[周期检测] {img_path}: {format_period(result)}")
+	block = np.ascontiguousarray(single_period(rgb, result))
+	mask = infer_fn(model, Image.fromarray(block), device, input_size)
+	return tile_to_size(mask, result["repeats"])
+
+
 def select_device(kind: str) -> torch.device:
 	if kind == "cpu":
 		return torch.device("cpu")
@@ -266,10 +609,120 @@ def select_device(kind: str) -> torch.device:
 	return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+def apply_autotune_profile(args: argparse.Namespace) -> None:
+	"""用本机的自动调优结果补全命令行未指定的设备、线程数、推理引擎和预取张数"""
+	if args.no_profile:
+		return
+	profile = load_profile(args.profile, profile_key(args.model, args.weights, args.size))
+	if profile is None:
+		return
+	applied = []
+	for key in TUNED_KEYS:
+		if getattr(args, key) is None and profile.get(key) is not None:
+			setattr(args, key, profile[key])
+			applied.append(f"{key}={profile[key]}")
+	if applied:
+		print(f"[信息] 使用自动调优配置: {', '.join(applied)}")
+
+
+def run_autotune(args: argparse.Namespace, config) -> dict:
+	"""
+	在合成图片上运行简短的基准测试，保存本机最快的配置
+
+	先测单张推理：每个设备上依次测试各推理引擎和线程数；
+	再用最快的组合跑完整流程（预取解码、推理、合成透明图并编码PNG），测试各预取张数。
+	命令行已指定的参数只测试该值。
+	"""
+	if args.device in ("cpu", "cuda"):
+		devices = [args.device]
+	else:
+		devices = ["cpu", "cuda"] if torch.cuda.is_available() else ["cpu"]
+	# channels_last 原地修改模型，放在最后测试
+	engines = [args.engine] if args.engine else list(ENGINES)
+	engines.sort(key=lambda name: 0 if name == "eager" else 1 if name == "jit" else 2)
+	threads_list = [args.threads] if args.threads else thread_candidates()
+	prefetch_list = [args.prefetch] if args.prefetch is not None else list(PREFETCH_CANDIDATES)
+	png_level = args.png_level if args.png_level is not None else int(
+		get_config_value(config, "图片去背景", "PNG_COMPRESS_LEVEL", DEFAULT_PNG_COMPRESS_LEVEL))
+	default_threads = torch.get_num_threads()
+
+	print(f"[信息] 自动调优: 模型 {args.model}，输入尺寸 {args.size}，"
+		  f"{args.autotune_images} 张 {args.autotune_image_size}x{args.autotune_image_size} 合成图片")
+	with tempfile.TemporaryDirectory(prefix="rmbg_autotune_") as tmp_dir:
+		paths = write_synthetic_images(tmp_dir, args.autotune_images, args.autotune_image_size)
+		sample = Image.fromarray(load_rgb_array(paths[0]))
+
+		# 第一步：单张推理
+		results = []
+		for device_kind in devices:
+			device = torch.device(device_kind)
+			model, infer_fn = load_model(args.model, args.weights, device)
+			for engine in engines:
+				engine_model = apply_engine(model, engine, device, args.size)
+				if engine == "jit" and engine_model is model:
+					continue
+				for threads in (threads_list if device_kind == "cpu" else [default_threads]):
+					torch.set_num_threads(threads)
+					seconds = median_seconds(lambda: infer_fn(engine_model, sample, device, args.size),
+											 args.autotune_runs)
+					results.append({"device": device_kind, "engine": engine, "threads": threads, "seconds": seconds})
+					print(f"  {device_kind:<5} {engine:<14} 线程 {threads:<3} 单张推理 {seconds * 1000:8.1f} ms")
+			del model, engine_model
+		best = choose_fastest(results)
+
+		# 第二步：完整流程下的预取张数
+		device = torch.device(best["device"])
+		torch.set_num_threads(best["threads"])
+		model, infer_fn = load_model(args.model, args.weights, device)
+		model = apply_engine(model, best["engine"], device, args.size)
+		source = LocalStorage(tmp_dir)
+		keys = source.list_images()
+
+		def run_pipeline(depth: int) -> None:
+			with AsyncPrefetcher(source, keys, depth, transform=decode_rgb_bytes) as prefetcher:
+				for _, rgb in prefetcher:
+					mask = infer_fn(model, Image.fromarray(rgb), device, args.size)
+					encode_image_array(build_rgba(rgb, mask), "png", png_level)
+
+		# 刚加载的模型前几次推理偏慢，先完整跑一遍预热，避免第一个候选吃亏
+		run_pipeline(prefetch_list[0])
+		pipeline_results = []
+		for depth in prefetch_list:
+			seconds = median_seconds(lambda: run_pipeline(depth), args.autotune_runs, warmup=0) / len(keys)
+			pipeline_results.append({"prefetch": depth, "seconds": seconds})
+			print(f"  预取 {depth:<3} 完整流程 {seconds * 1000:8.1f} ms/张")
+		best_pipeline = choose_fastest(pipeline_results)
+
+	entry = {
+		"device": best["device"],
+		"threads": best["threads"],
+		"engine": best["engine"],
+		"prefetch": best_pipeline["prefetch"],
+		"inference_ms": round(best["seconds"] * 1000, 2),
+		"pipeline_ms_per_image": round(best_pipeline["seconds"] * 1000, 2),
+		"image_size": args.autotune_image_size,
+		"tuned_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+	}
+	path = save_profile(args.profile, profile_key(args.model, args.weights, args.size), entry)
+	print(f"[信息] 最快配置: 设备 {entry['device']}，线程 {entry['threads']}，引擎 {entry['engine']}，"
+		  f"预取 {entry['prefetch']}（{entry['pipeline_ms_per_image']} ms/张）")
+	print(f"[信息] 已保存到自动调优档案: {path}")
+	return entry
+
+
 def main() -> None:
 	args = parse_args()
-	device = select_device(args.device)
+	if args.autotune:
+		run_autotune(args, load_config(args.config))
+		return
+
+	# 命令行未指定的设备、线程数、推理引擎和预取张数使用本机的自动调优结果
+	apply_autotune_profile(args)
+	device = select_device(args.device or "auto")
 	print(f"[信息] 使用设备: {device}")
+	if args.threads:
+		torch.set_num_threads(args.threads)
+		print(f"[信息] CPU线程数: {args.threads}")
 
 	# 加载配置文件
 	config = load_config(args.config)
@@ -299,48 +752,134 @@ def main() -> None:
 		args.both = True
 		print(f"[信息] 从配置文件读取SAVE_BOTH: {save_both}，将同时保存掩码和透明图")
 
+	# 输出编码
+	codec = args.codec or get_config_value(config, "图片去背景", "OUTPUT_CODEC", "png")
+	png_level = args.png_level if args.png_level is not None else int(
+		get_config_value(config, "图片去背景", "PNG_COMPRESS_LEVEL", DEFAULT_PNG_COMPRESS_LEVEL))
+	if codec not in OUTPUT_CODECS:
+		raise RuntimeError(f"不支持的输出编码: {codec}，可选: {', '.join(OUTPUT_CODECS)}")
+	print(f"[信息] 输出编码: {codec}" + (f"（压缩级别 {png_level}）" if codec == "png" else ""))
+	detect_repeats = args.detect_period or bool(get_config_value(config, "图片去背景", "DETECT_PERIOD", False))
+
 	# 加载模型
-	if args.model == "official":
-		model = load_official_model(device)
-		infer_fn = infer_single_image_official
-	else:  # demo
-		model = load_demo_model(args.weights, device)
-		infer_fn = infer_single_image_demo
-
-	image_paths = collect_images(input_path)
-	if len(image_paths) == 0:
+	model, infer_fn = load_model(args.model, args.weights, device)
+	if args.engine and args.engine != "eager":
+		model = apply_engine(model, args.engine, device, args.size)
+		print(f"[信息] 推理引擎: {args.engine}")
+
+	# 输入可以是本地路径、zip/tar压缩包或对象存储，后台预取并解码接下来的若干张
+	source = open_storage(input_path)
+	image_keys = source.list_images()
+	if len(image_keys) == 0:
 		raise RuntimeError("未在输入路径下找到任何图像文件")
+	prefetch = args.prefetch if args.prefetch is not None else int(
+		get_config_value(config, "图片去背景", "PREFETCH", DEFAULT_PREFETCH))
 
-	# 判断输出是目录还是单一文件
-	output_path = Path(output_path)
-	save_as_single_file = Path(input_path).is_file() and (output_path.suffix.lower() in [".png", ".jpg", ".jpeg", ".bmp", ".webp"])
+	if is_archive(output_path):
+		raise RuntimeError(f"压缩包只能作为输入: {output_path}")
+	# 输出为对象存储时，编码和上传都在后台进行，推理不等待网络
+	sink = open_storage(output_path) if is_remote(output_path) else None
 
-	if save_as_single_file:
-		ensure_dir(str(output_path.parent))
+	# 判断输出是目录还是单一文件
+	single_input = getattr(source, "single", None) is not None
+	if sink is not None:
+		save_as_single_file = single_input and sink.single is not None
 	else:
-		ensure_dir(str(output_path))
-
-	for img_path in image_paths:
-		mask = infer_fn(model, img_path, device, args.size)
-
-		if save_as_single_file and len(image_paths) == 1:
-			if args.save_mask and not args.both:
-				save_mask(mask, str(output_path))
+		output_path = Path(output_path)
+		save_as_single_file = single_input and (output_path.suffix.lower() in [".png", ".jpg", ".jpeg", ".bmp", ".webp", ".npy"])
+	if save_as_single_file:
+		# 单文件输出时按扩展名决定编码
+		codec = codec_from_path(sink.single if sink is not None else str(output_path), codec)
+
+	if sink is None:
+		if save_as_single_file:
+			ensure_dir(str(output_path.parent))
+		else:
+			ensure_dir(str(output_path))
+
+	def output_location(kind: str) -> str:
+		"""输出位置：单文件模式为输出路径本身，否则使用固定文件名，覆盖上一次保存的文件"""
+		if sink is not None:
+			return sink.single if save_as_single_file else f"{kind}{OUTPUT_CODECS[codec]}"
+		return str(output_path) if save_as_single_file else (output_path / f"{kind}{OUTPUT_CODECS[codec]}").as_posix()
+
+	def display_location(location: str) -> str:
+		return sink.locate(location) if sink is not None else location
+
+	uploader = AsyncUploader(sink) if sink is not None else None
+
+	# 内存预算：解码前按图片尺寸制定计划，需要时在解码阶段就缩小图片
+	budget = parse_memory_size(args.max_memory)
+	governor = MemoryGovernor(budget, "rmbg") if budget else None
+	if governor:
+		print(f"[信息] 内存预算: {format_bytes(budget)}")
+
+	# 有预算时预取从1张开始，第一张图片的计划确认预算允许后才加深；
+	# 各预取线程在锁内按共享的当前预取张数制定计划，降低后立即作用于之后提交的预取
+	plan_lock = threading.Lock()
+	prefetch_state = {"depth": prefetch}
+
+	def decode_with_plan(key: str, data: bytes):
+		if governor is None:
+			return decode_rgb_bytes(data), None
+		image = Image.open(io.BytesIO(data))
+		with plan_lock:
+			plan = plan_inference(governor, key, image.width, image.height, args.model, args.size,
+								  prefetch_state["depth"], strip_capable=(codec == "png" and sink is None),
+								  encoded_bytes=len(data))
+			prefetch_state["depth"] = plan["prefetch"]
+			prefetcher.depth = plan["prefetch"]
+		if plan["scale"] < 1.0:
+			target = (max(1, int(image.width * plan["scale"])), max(1, int(image.height * plan["scale"])))
+			# JPEG可以直接按缩小的尺寸解码
+			image.draft('RGB', target)
+			image = image.convert('RGB').resize(target, Image.BILINEAR)
+		return load_rgb_array(image), plan
+
+	def save_output(array: np.ndarray, location: str) -> None:
+		if uploader is None:
+			write_image_array(array, location, codec, png_level)
+		else:
+			uploader.submit(location, partial(encode_image_array, array, codec, png_level))
+
+	def save_rgba_output(rgb: np.ndarray, mask: np.ndarray, location: str, plan: Optional[dict]) -> None:
+		if plan is not None and plan["strip"]:
+			save_rgba_strips(rgb, mask, location, png_level)
+		else:
+			save_output(build_rgba(rgb, mask), location)
+
+	with AsyncPrefetcher(source, image_keys, 1 if governor else prefetch, with_key=True,
+						 transform=decode_with_plan) as prefetcher, uploader or nullcontext():
+		# 原图只解码一次，推理和合成透明图共用
+		for key, (rgb, plan) in prefetcher:
+			img_path = source.locate(key)
+			input_size = args.size
+			if plan is not None:
+				for note in plan["notes"]:
+					print(note)
+				input_size = plan["size"]
+			if detect_repeats:
+				mask = infer_periodic(infer_fn, model, rgb, device, input_size, img_path)
 			else:
-				save_rgba_with_alpha(img_path, mask, str(output_path))
-			print(f"完成: {img_path} -> {output_path}")
-			continue
-
-		# 使用固定文件名，覆盖上一次保存的文件
-		if args.save_mask or args.both:
-			mask_out = (output_path / "mask.png").as_posix() if not save_as_single_file else str(output_path)
-			save_mask(mask, mask_out)
-			print(f"保存掩码: {img_path} -> {mask_out}")
-
-		if not args.save_mask or args.both:
-			rgba_out = (output_path / "rgba.png").as_posix() if not save_as_single_file else str(output_path)
-			save_rgba_with_alpha(img_path, mask, rgba_out)
-			print(f"保存透明图: {img_path} -> {rgba_out}")
+				mask = infer_fn(model, Image.fromarray(rgb), device, input_size)
+
+			if save_as_single_file and len(image_keys) == 1:
+				if args.save_mask and not args.both:
+					save_output(mask, output_location("mask"))
+				else:
+					save_rgba_output(rgb, mask, output_location("rgba"), plan)
+				print(f"完成: {img_path} -> {display_location(output_location('rgba'))}")
+				continue
+
+			if args.save_mask or args.both:
+				mask_out = output_location("mask")
+				save_output(mask, mask_out)
+				print(f"保存掩码: {img_path} -> {display_location(mask_out)}")
+
+			if not args.save_mask or args.both:
+				rgba_out = output_location("rgba")
+				save_rgba_output(rgb, mask, rgba_out, plan)
+				print(f"保存透明图: {img_path} -> {display_location(rgba_out)}")
 
 	print("全部完成。")
 
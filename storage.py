@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储后端
+统一本地磁盘、zip/tar压缩包和HTTP对象存储的读写接口，并提供基于asyncio的输入预取和输出异步上传，
+推理循环只和内存中的数据打交道，不会因为等待慢速的网络存储而停顿。
+
+HTTP对象存储协议（本模块的 serve 子命令提供了一个本地替身服务器，可用于测试）:
+    GET  {base}/{key}   读取对象
+    PUT  {base}/{key}   写入对象
+    GET  {base}/?list   返回前缀下所有对象键的JSON数组（相对 base）
+"""
+
+import io
+import os
+import json
+import time
+import asyncio
+import tarfile
+import zipfile
+import argparse
+import threading
+import collections
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".bmp", ".webp"]
+# 地址以这些扩展名结尾时视为单个对象而不是前缀（.npy为去背景的中间结果输出）
+SINGLE_OBJECT_EXTENSIONS = IMAGE_EXTENSIONS + [".npy"]
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+DEFAULT_PREFETCH = 4
+DEFAULT_MAX_PENDING_UPLOADS = 4
+
+
+def is_image_key(key: str) -> bool:
+    """按扩展名判断是否为图片"""
+    return os.path.splitext(key)[1].lower() in IMAGE_EXTENSIONS
+
+
+def is_remote(location: str) -> bool:
+    """是否为HTTP对象存储地址"""
+    return isinstance(location, str) and location.lower().startswith(("http://", "https://"))
+
+
+def is_archive(location: str) -> bool:
+    """是否为zip/tar压缩包"""
+    return isinstance(location, str) and location.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class LocalStorage:
+    """本地目录（或单个文件）"""
+
+    def __init__(self, root: str):
+        self.single = None
+        if os.path.isfile(root):
+            root, self.single = os.path.split(root)
+        self.root = root or '.'
+
+    def list_images(self) -> List[str]:
+        """与 rmbg.collect_images 相同的查找顺序：按扩展名逐个递归查找"""
+        if self.single:
+            return [self.single]
+        if not os.path.exists(self.root):
+            raise FileNotFoundError(f"输入路径不存在: {self.root}")
+        keys = []
+        for ext in IMAGE_EXTENSIONS:
+            keys.extend(p.relative_to(self.root).as_posix() for p in Path(self.root).rglob(f"*{ext}"))
+        return keys
+
+    def locate(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def read_bytes(self, key: str) -> bytes:
+        with open(self.locate(key), 'rb') as f:
+            return f.read()
+
+    def write_bytes(self, key: str, data: bytes) -> None:
+        """先写临时文件再原子改名"""
+        path = self.locate(key)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class ArchiveStorage:
+    """zip/tar压缩包，只读；每个线程各自打开压缩包，预取线程之间互不干扰"""
+
+    def __init__(self, path: str):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"压缩包不存在: {path}")
+        self.path = path
+        self.is_zip = path.lower().endswith(".zip")
+        self._local = threading.local()
+
+    def _handle(self):
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = zipfile.ZipFile(self.path) if self.is_zip else tarfile.open(self.path)
+            self._local.handle = handle
+        return handle
+
+    def list_images(self) -> List[str]:
+        handle = self._handle()
+        if self.is_zip:
+            names = [info.filename for info in handle.infolist() if not info.is_dir()]
+        else:
+            names = [member.name for member in handle.getmembers() if member.isfile()]
+        return sorted(name for name in names if is_image_key(name))
+
+    def locate(self, key: str) -> str:
+        return f"{self.path}!{key}"
+
+    def read_bytes(self, key: str) -> bytes:
+        handle = self._handle()
+        if self.is_zip:
+            return handle.read(key)
+        with handle.extractfile(key) as f:
+            return f.read()
+
+    def write_bytes(self, key: str, data: bytes) -> None:
+        raise io.UnsupportedOperation(f"压缩包仅支持读取: {self.path}")
+
+
+class HTTPStorage:
+    """HTTP对象存储，读写失败时按指数退避重试"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0, retries: int = 3):
+        self.single = None
+        path = urllib.parse.urlsplit(base_url).path
+        if os.path.splitext(path)[1].lower() in SINGLE_OBJECT_EXTENSIONS:
+            base_url, self.single = base_url.rsplit('/', 1)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+
+    def locate(self, key: str) -> str:
+        return f"{self.base_url}/{urllib.parse.quote(key)}"
+
+    def _request(self, url: str, method: str = "GET", data: Optional[bytes] = None) -> bytes:
+        for attempt in range(self.retries + 1):
+            try:
+                request = urllib.request.Request(url, data=data, method=method)
+                if data is not None:
+                    request.add_header("Content-Type", "application/octet-stream")
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                # 4xx为请求本身的问题，重试没有意义
+                if e.code < 500 or attempt == self.retries:
+                    raise
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                if attempt == self.retries:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
+
+    def list_images(self) -> List[str]:
+        if self.single:
+            return [self.single]
+        keys = json.loads(self._request(f"{self.base_url}/?list"))
+        return [key for key in keys if is_image_key(key)]
+
+    def read_bytes(self, key: str) -> bytes:
+        return self._request(self.locate(key))
+
+    def write_bytes(self, key: str, data: bytes) -> None:
+        self._request(self.locate(key), method="PUT", data=data)
+
+
+def open_storage(location: str):
+    """按地址选择存储后端：http(s):// 为对象存储，.zip/.tar 等为压缩包，其余为本地路径"""
+    if is_remote(location):
+        return HTTPStorage(location)
+    if is_archive(location):
+        return ArchiveStorage(location)
+    return LocalStorage(location)
+
+
+class _LoopThread:
+    """在后台线程中运行的asyncio事件循环"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class AsyncPrefetcher:
+    """
+    按顺序迭代输入，同时在后台预取接下来的 depth 个输入
+
+    读取（以及可选的 transform，如解码）在事件循环的线程池中执行，迭代时得到 (key, 结果)；
+    with_key 为True时 transform 的参数为 (key, 字节)。depth 可以在迭代过程中修改
+    """
+
+    def __init__(self, storage, keys: List[str], depth: int = DEFAULT_PREFETCH,
+                 transform: Optional[Callable] = None, with_key: bool = False):
+        self.storage = storage
+        self.keys = list(keys)
+        self.depth = max(1, depth)
+        self.transform = transform
+        self.with_key = with_key
+        self._runner = None
+        self._pending: Deque = collections.deque()
+
+    async def _fetch(self, key: str):
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.storage.read_bytes, key)
+        if self.transform is not None:
+            args = (key, data) if self.with_key else (data,)
+            data = await loop.run_in_executor(None, self.transform, *args)
+        return data
+
+    def __enter__(self):
+        self._runner = _LoopThread()
+        return self
+
+    def __exit__(self, *exc_info):
+        # 提前结束迭代时取消还未完成的预取
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._runner.close()
+        self._runner = None
+
+    def __iter__(self) -> Iterator[Tuple[str, object]]:
+        pending = self._pending
+        next_index = 0
+        while next_index < len(self.keys) or pending:
+            while next_index < len(self.keys) and len(pending) < self.depth:
+                key = self.keys[next_index]
+                pending.append((key, self._runner.submit(self._fetch(key))))
+                next_index += 1
+            key, future = pending.popleft()
+            yield key, future.result()
+
+
+class AsyncUploader:
+    """
+    在后台编码并写入输出
+
+    submit 立即返回；同一个键的写入按提交顺序执行，最后提交的内容最终生效；
+    未完成的上传超过 max_pending 时 submit 会等待最早的一个完成，避免结果在内存中无限堆积
+    """
+
+    def __init__(self, storage, max_pending: int = DEFAULT_MAX_PENDING_UPLOADS):
+        self.storage = storage
+        self.max_pending = max(1, max_pending)
+        self._runner = None
+        self._pending: Deque = collections.deque()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.errors: List[Tuple[str, BaseException]] = []
+
+    async def _upload(self, key: str, encode: Callable[[], bytes]) -> None:
+        loop = asyncio.get_running_loop()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            data = await loop.run_in_executor(None, encode)
+            await loop.run_in_executor(None, self.storage.write_bytes, key, data)
+
+    def _wait_oldest(self) -> None:
+        key, future = self._pending.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"[错误] 上传失败: {key}: {e}")
+            self.errors.append((key, e))
+
+    def submit(self, key: str, encode: Callable[[], bytes]) -> None:
+        """提交一个输出，encode 在后台线程中调用并返回要写入的字节"""
+        while len(self._pending) >= self.max_pending:
+            self._wait_oldest()
+        self._pending.append((key, self._runner.submit(self._upload(key, encode))))
+
+    def __enter__(self):
+        self._runner = _LoopThread()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        while self._pending:
+            self._wait_oldest()
+        self._runner.close()
+        self._runner = None
+        if self.errors and exc_type is None:
+            raise RuntimeError(f"{len(self.errors)} 个输出上传失败，第一个: {self.errors[0][0]}")
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """本地替身对象存储：对象保存在 server.root 目录下"""
+
+    def _path(self) -> str:
+        relative = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip('/')
+        path = os.path.normpath(os.path.join(self.server.root, relative))
+        if os.path.commonpath([path, self.server.root]) != self.server.root:
+            raise PermissionError(relative)
+        return path
+
+    def _reply(self, code: int, body: bytes = b"", content_type: str = "application/octet-stream") -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        try:
+            path = self._path()
+        except PermissionError:
+            return self._reply(403)
+        if urllib.parse.urlsplit(self.path).query == "list":
+            keys = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                keys.extend(os.path.relpath(os.path.join(root, name), path).replace(os.sep, '/')
+                            for name in sorted(files))
+            return self._reply(200, json.dumps(keys).encode('utf-8'), "application/json")
+        if not os.path.isfile(path):
+            return self._reply(404)
+        with open(path, 'rb') as f:
+            self._reply(200, f.read())
+
+    def do_PUT(self):
+        try:
+            path = self._path()
+        except PermissionError:
+            return self._reply(403)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        LocalStorage(self.server.root).write_bytes(os.path.relpath(path, self.server.root), data)
+        self._reply(201)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start_stand_in_server(root: str, host: str = "127.0.0.1", port: int = 0,
+                          verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动替身对象存储服务器
+
+    Returns:
+        服务器对象，server.server_address 为实际监听地址，用完后调用 shutdown()
+    """
+    os.makedirs(root, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), _StandInHandler)
+    server.root = os.path.abspath(root)
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='存储后端工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='启动本地替身对象存储（GET/PUT/?list），用于测试HTTP后端')
+    serve.add_argument('--root', default='output/object_store', help='对象保存目录')
+    serve.add_argument('--host', default='127.0.0.1', help='监听地址')
+    serve.add_argument('--port', type=int, default=8765, help='监听端口')
+
+    listing = subparsers.add_parser('ls', help='列出存储位置中的图片')
+    listing.add_argument('location', help='本地目录、压缩包或 http(s):// 地址')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = start_stand_in_server(args.root, args.host, args.port, verbose=True)
+        host, port = server.server_address[:2]
+        print(f"[信息] 替身对象存储已启动: http://{host}:{port}/ -> {server.root}（Ctrl+C 停止）")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        for key in open_storage(args.location).list_images():
+            print(key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多分辨率瓦片金字塔
+把合并结果切成256像素的瓦片并逐级缩小，浏览器中的查看器（OpenSeadragon、Leaflet等）只加载当前视野需要的瓦片，
+不必打开整张大图。merge_results_better.py --tiles 直接从合成画布生成，也可以对已有图片单独运行。
+
+两种布局：
+    dzi   Deep Zoom: {名称}.dzi 描述文件 + {名称}_files/{层级}/{列}_{行}.png，层级0为1x1，边缘瓦片不补齐
+    xyz   {z}/{x}/{y}.png + tiles.json，z=0时整图缩小到一张瓦片以内，边缘瓦片用透明像素补齐到瓦片尺寸
+
+每一层由上一层做一次2x2均值下采样得到，只计算一次；瓦片编码在线程池中并行。
+"""
+
+import os
+import json
+import math
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_TILE_SIZE = 256
+TILE_LAYOUTS = ("dzi", "xyz")
+TILE_FORMATS = {"png": "PNG", "webp": "WEBP"}
+
+
+def downsample_2x(image: np.ndarray) -> np.ndarray:
+    """2x2均值下采样，奇数边先复制最后一行/列，输出尺寸为 (ceil(H/2), ceil(W/2))"""
+    h, w = image.shape[:2]
+    if h % 2 or w % 2:
+        image = np.pad(image, ((0, h % 2), (0, w % 2), (0, 0)), mode='edge')
+    acc = image[0::2, 0::2].astype(np.uint16)
+    acc += image[1::2, 0::2]
+    acc += image[0::2, 1::2]
+    acc += image[1::2, 1::2]
+    acc += 2
+    acc >>= 2
+    return acc.astype(np.uint8)
+
+
+class _Level:
+    """金字塔的一层：base 重复 rows x cols 次，四方连续平铺预览不必展开成整图"""
+
+    def __init__(self, base: np.ndarray, rows: int = 1, cols: int = 1):
+        self.base = base
+        self.rows = rows
+        self.cols = cols
+        self.height = base.shape[0] * rows
+        self.width = base.shape[1] * cols
+
+    def crop(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        if self.rows == 1 and self.cols == 1:
+            return self.base[y0:y1, x0:x1]
+        h, w = self.base.shape[:2]
+        return self.base[np.ix_(np.arange(y0, y1) % h, np.arange(x0, x1) % w)]
+
+    def downsample(self) -> "_Level":
+        # 重复方向上的边长为偶数时，下采样与重复可以交换顺序；否则先展开再下采样
+        h, w = self.base.shape[:2]
+        if (self.rows == 1 or h % 2 == 0) and (self.cols == 1 or w % 2 == 0):
+            return _Level(downsample_2x(self.base), self.rows, self.cols)
+        return _Level(downsample_2x(np.tile(self.base, (self.rows, self.cols, 1))))
+
+
+def _save_tile(tile: np.ndarray, path: str, image_format: str, tile_size: Optional[int],
+               compress_level: int) -> None:
+    if tile_size and tile.shape[:2] != (tile_size, tile_size):
+        padded = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+        padded[:tile.shape[0], :tile.shape[1]] = tile
+        tile = padded
+    image = Image.fromarray(np.ascontiguousarray(tile), 'RGBA')
+    if image_format == "PNG":
+        image.save(path, image_format, compress_level=compress_level)
+    else:
+        image.save(path, image_format, lossless=True)
+
+
+def write_tile_pyramid(canvas: np.ndarray, output_dir: str, name: str = "merged",
+                       tile_size: int = DEFAULT_TILE_SIZE, layout: str = "dzi", tile_format: str = "png",
+                       repeat: Tuple[int, int] = (1, 1), workers: Optional[int] = None,
+                       compress_level: int = 6) -> Dict:
+    """
+    从RGBA画布生成瓦片金字塔
+
+    Args:
+        canvas: (H, W, 4) RGBA数组
+        output_dir: 输出目录
+        name: DZI的文件名前缀
+        tile_size: 瓦片边长
+        layout: dzi 或 xyz
+        tile_format: png 或 webp（无损）
+        repeat: (行数, 列数)，对四方连续画布的平铺结果生成金字塔，不展开整图
+        workers: 编码瓦片的线程数，默认为CPU核数
+        compress_level: PNG压缩级别
+
+    Returns:
+        金字塔信息（尺寸、层数、瓦片数、描述文件路径）
+    """
+    if layout not in TILE_LAYOUTS:
+        raise ValueError(f"未知的瓦片布局: {layout}，可选: {', '.join(TILE_LAYOUTS)}")
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"未知的瓦片格式: {tile_format}，可选: {', '.join(TILE_FORMATS)}")
+
+    level = _Level(canvas, *repeat)
+    width, height = level.width, level.height
+    if layout == "dzi":
+        # Deep Zoom 从1x1一直缩小到原尺寸
+        max_level = int(math.ceil(math.log2(max(width, height)))) if max(width, height) > 1 else 0
+        tiles_root = os.path.join(output_dir, f"{name}_files")
+    else:
+        max_level = max(0, int(math.ceil(math.log2(max(width, height) / tile_size))))
+        tiles_root = output_dir
+    image_format = TILE_FORMATS[tile_format]
+    pad_size = tile_size if layout == "xyz" else None
+
+    tile_count = 0
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # 限制排队的瓦片数，平铺预览的瓦片是裁剪出的副本，不能一次全部排队
+        pending = collections.deque()
+        for z in range(max_level, -1, -1):
+            cols = (level.width + tile_size - 1) // tile_size
+            rows = (level.height + tile_size - 1) // tile_size
+            for col in range(cols):
+                if layout == "xyz":
+                    tile_dir = os.path.join(tiles_root, str(z), str(col))
+                else:
+                    tile_dir = os.path.join(tiles_root, str(z))
+                os.makedirs(tile_dir, exist_ok=True)
+                for row in range(rows):
+                    x0, y0 = col * tile_size, row * tile_size
+                    tile = level.crop(x0, y0, min(x0 + tile_size, level.width), min(y0 + tile_size, level.height))
+                    filename = f"{row}.{tile_format}" if layout == "xyz" else f"{col}_{row}.{tile_format}"
+                    pending.append(executor.submit(_save_tile, tile, os.path.join(tile_dir, filename),
+                                                   image_format, pad_size, compress_level))
+                    if len(pending) > workers * 4:
+                        pending.popleft().result()
+            tile_count += cols * rows
+            print(f"瓦片层级 {z}: {level.width}x{level.height}，{cols}x{rows} 张")
+            if z > 0:
+                level = level.downsample()
+        while pending:
+            pending.popleft().result()
+
+    if layout == "dzi":
+        descriptor = os.path.join(output_dir, f"{name}.dzi")
+        with open(descriptor, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" '
+                    f'Overlap="0" Format="{tile_format}">\n'
+                    f'  <Size Width="{width}" Height="{height}"/>\n'
+                    '</Image>\n')
+    else:
+        descriptor = os.path.join(output_dir, "tiles.json")
+        with open(descriptor, 'w', encoding='utf-8') as f:
+            json.dump({
+                "width": width,
+                "height": height,
+                "tile_size": tile_size,
+                "min_zoom": 0,
+                "max_zoom": max_level,
+                "format": tile_format,
+                "url": "{z}/{x}/{y}." + tile_format
+            }, f, ensure_ascii=False, indent=2)
+
+    print(f"瓦片金字塔已保存到: {output_dir}（{width}x{height}，{max_level + 1} 层，{tile_count} 张瓦片）")
+    return {
+        "width": width,
+        "height": height,
+        "levels": max_level + 1,
+        "tiles": tile_count,
+        "descriptor": descriptor
+    }
+
+
+def main():
+    """对已有图片生成瓦片金字塔"""
+    parser = argparse.ArgumentParser(description="把大图切成多分辨率瓦片金字塔（DZI或XYZ）")
+    parser.add_argument("image", help="输入图片路径")
+    parser.add_argument("--output", default=None, help="输出目录，默认为图片同目录的 {文件名}_tiles")
+    parser.add_argument("--layout", default="dzi", choices=TILE_LAYOUTS, help="瓦片布局")
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE, help="瓦片边长")
+    parser.add_argument("--format", default="png", choices=list(TILE_FORMATS), help="瓦片编码")
+    parser.add_argument("--workers", type=int, default=None, help="编码瓦片的线程数，默认为CPU核数")
+    args = parser.parse_args()
+
+    stem = os.path.splitext(os.path.basename(args.image))[0]
+    output_dir = args.output or os.path.join(os.path.dirname(args.image), f"{stem}_tiles")
+    Image.MAX_IMAGE_PIXELS = None
+    canvas = np.asarray(Image.open(args.image).convert('RGBA'))
+    write_tile_pyramid(canvas, output_dir, stem, args.tile_size, args.layout, args.format, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+热文件夹监控脚本
+常驻进程只加载一次模型，轮询输入目录，把新增或修改过的图片放入有界优先队列，
+逐个执行 去背景 -> 元素提取 -> 颜色分析，完成后把原图原子移动到完成目录，
+队列深度和处理延迟实时写入状态文件
+"""
+
+import json
+import os
+import time
+import queue
+import shutil
+import signal
+import argparse
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import rmbg
+from grid_split_elements import process_single_image
+from color_analyzer import ColorAnalyzer
+
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp'}
+DEFAULT_INPUT_DIR = "input/incoming"
+DEFAULT_DONE_DIR = "input/done"
+DEFAULT_FAILED_DIR = "input/failed"
+DEFAULT_OUTPUT_DIR = "output/hot_folder"
+STATUS_RECENT_JOBS = 20
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """文件的 (大小, 修改时间)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def unique_destination(directory: str, name: str) -> str:
+    """目标目录中已有同名文件时追加时间戳，避免覆盖之前完成的文件"""
+    destination = os.path.join(directory, name)
+    if not os.path.exists(destination):
+        return destination
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f"{stem}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}{ext}")
+
+
+def publish_directory(tmp_dir: str, target_dir: str) -> None:
+    """把临时目录原子替换为目标目录，旧结果先改名再删除"""
+    old_dir = None
+    if os.path.exists(target_dir):
+        old_dir = f"{target_dir}.old.{os.getpid()}"
+        os.replace(target_dir, old_dir)
+    os.replace(tmp_dir, target_dir)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class HotFolderDaemon:
+    """热文件夹处理进程：扫描线程负责入队，工作线程使用常驻模型处理"""
+
+    def __init__(self, input_dir: str = DEFAULT_INPUT_DIR, output_dir: str = DEFAULT_OUTPUT_DIR,
+                 done_dir: str = DEFAULT_DONE_DIR, failed_dir: str = DEFAULT_FAILED_DIR,
+                 status_file: Optional[str] = None, config_file: str = "config.json",
+                 model_kind: str = "official", weights: Optional[str] = None, size: int = 1024,
+                 device: str = "auto", queue_size: int = 16, workers: int = 1,
+                 poll_interval: float = 2.0, settle_time: float = 2.0, priority: str = "oldest",
+                 min_area: Optional[int] = None, dedup: bool = False, background_only: bool = False):
+        """
+        初始化热文件夹处理进程
+
+        Args:
+            input_dir: 监控的输入目录（递归扫描）
+            output_dir: 结果目录，每张图片的结果保存在以文件名命名的子目录中
+            done_dir: 处理完成的原图移动到该目录
+            failed_dir: 处理失败的原图移动到该目录
+            status_file: 状态文件路径，默认为 output_dir/status.json
+            config_file: 配置文件路径（读取MIN_AREA、DEDUP等参数）
+            model_kind: 模型类型，official或demo
+            weights: demo模型的权重文件
+            size: 模型输入边长
+            device: 推理设备
+            queue_size: 队列容量，队列满时暂停入队，文件留在输入目录等待下次扫描
+            workers: 工作线程数（共享同一个模型）
+            poll_interval: 扫描间隔（秒）
+            settle_time: 文件修改后至少静止多久才入队，避免处理尚未复制完成的文件
+            priority: 出队顺序，oldest=最早修改的先处理，smallest=最小的文件先处理
+            min_area: 元素最小面积，默认读取配置文件
+            dedup: 是否对重复图案去重
+            background_only: 颜色分析是否只统计背景像素（直接使用推理得到的掩码）
+        """
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.done_dir = done_dir
+        self.failed_dir = failed_dir
+        self.status_file = status_file or os.path.join(output_dir, "status.json")
+        self.model_kind = model_kind
+        self.weights = weights
+        self.size = size
+        self.device = rmbg.select_device(device)
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.priority = priority
+        self.background_only = background_only
+
+        config = rmbg.load_config(config_file)
+        self.min_area = min_area or int(rmbg.get_config_value(config, '4图合并提取元素', 'MIN_AREA', 100))
+        self.dedup = dedup or bool(rmbg.get_config_value(config, '4图合并提取元素', 'DEDUP', False))
+        self.analyzer = ColorAnalyzer(config_file, background_only=background_only)
+
+        self.queue = queue.PriorityQueue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = {}  # 已入队或处理中的文件 -> 入队时的文件签名
+        self._in_progress = {}
+        self._sequence = 0
+        self._processed = 0
+        self._failed = 0
+        self._backpressure_events = 0
+        self._latencies = deque(maxlen=200)
+        self._recent = deque(maxlen=STATUS_RECENT_JOBS)
+        self._started = time.time()
+        self.model = None
+        self.infer_fn = None
+
+    def load_model(self) -> None:
+        """加载一次模型，之后所有文件共用"""
+        print(f"[信息] 使用设备: {self.device}")
+        if self.model_kind == "official":
+            self.model = rmbg.load_official_model(self.device)
+            self.infer_fn = rmbg.infer_single_image_official
+        else:
+            self.model = rmbg.load_demo_model(self.weights, self.device)
+            self.infer_fn = rmbg.infer_single_image_demo
+
+    def _priority_key(self, path: str, signature: Tuple[int, int]) -> Tuple:
+        size, mtime_ns = signature
+        self._sequence += 1
+        if self.priority == "smallest":
+            return size, mtime_ns, self._sequence
+        return mtime_ns, size, self._sequence
+
+    def scan_once(self) -> int:
+        """
+        扫描输入目录，把静止超过settle_time的新文件入队
+
+        Returns:
+            本次入队的文件数
+        """
+        candidates = []
+        now = time.time()
+        for root, dirs, files in os.walk(self.input_dir):
+            dirs.sort()
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                path = os.path.join(root, name)
+                signature = file_signature(path)
+                if signature is None or now - signature[1] / 1e9 < self.settle_time:
+                    continue
+                with self._lock:
+                    if self._pending.get(path) == signature:
+                        continue
+                candidates.append((self._priority_key(path, signature), path, signature))
+
+        enqueued = 0
+        for key, path, signature in sorted(candidates):
+            try:
+                self.queue.put_nowait((key, time.time(), path, signature))
+            except queue.Full:
+                # 背压：队列已满时不再入队，剩余文件留在输入目录，下次扫描再处理
+                with self._lock:
+                    self._backpressure_events += 1
+                print(f"[背压] 队列已满（{self.queue.maxsize}），{len(candidates) - enqueued} 个文件等待下次扫描")
+                break
+            with self._lock:
+                self._pending[path] = signature
+            enqueued += 1
+        if enqueued:
+            print(f"[信息] 新入队 {enqueued} 个文件，队列深度 {self.queue.qsize()}")
+        return enqueued
+
+    def process_file(self, path: str) -> str:
+        """
+        对单个文件执行 去背景 -> 元素提取 -> 颜色分析，结果先写入临时目录再原子替换
+
+        Returns:
+            结果目录
+        """
+        stem = os.path.splitext(os.path.relpath(path, self.input_dir))[0].replace(os.sep, "__")
+        target_dir = os.path.join(self.output_dir, stem)
+        tmp_dir = os.path.join(self.output_dir, f".{stem}.tmp.{threading.get_ident()}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        try:
+            mask = self.infer_fn(self.model, path, self.device, self.size)
+            mask_path = os.path.join(tmp_dir, "mask.png")
+            rgba_path = os.path.join(tmp_dir, "rgba.png")
+            rmbg.save_mask(mask, mask_path)
+            rmbg.save_rgba_with_alpha(path, mask, rgba_path)
+
+            merged_dir = os.path.join(tmp_dir, "merged_output")
+            process_single_image(rgba_path, mask_path, merged_dir, self.min_area, self.dedup)
+
+            colors = self.analyzer.analyze_image_colors(path, mask=mask if self.background_only else None)
+            self.analyzer.save_colors_to_json(os.path.join(merged_dir, "colors_output.json"), colors=colors)
+
+            publish_directory(tmp_dir, target_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return target_dir
+
+    def _finish(self, path: str, destination_dir: str) -> str:
+        """把原图原子移动到完成/失败目录（需与输入目录在同一文件系统）"""
+        relative_dir = os.path.dirname(os.path.relpath(path, self.input_dir))
+        directory = os.path.join(destination_dir, relative_dir)
+        os.makedirs(directory, exist_ok=True)
+        destination = unique_destination(directory, os.path.basename(path))
+        os.replace(path, destination)
+        return destination
+
+    def worker_loop(self) -> None:
+        """工作线程：从优先队列取文件处理，直到收到停止信号且队列为空"""
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            try:
+                _, enqueued_at, path, signature = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            # 入队后文件又被修改时放弃本次处理，等文件静止后重新入队
+            if file_signature(path) != signature:
+                with self._lock:
+                    self._pending.pop(path, None)
+                self.queue.task_done()
+                continue
+
+            with self._lock:
+                self._in_progress[path] = time.time()
+            self.write_status()
+
+            start = time.time()
+            try:
+                result_dir = self.process_file(path)
+                destination = self._finish(path, self.done_dir)
+                status = "done"
+                print(f"[完成] {path} -> {result_dir}，原图已移至 {destination}")
+            except Exception as e:
+                status = "failed"
+                print(f"[失败] {path}: {e}")
+                try:
+                    if os.path.exists(path):
+                        self._finish(path, self.failed_dir)
+                except OSError as move_error:
+                    print(f"[失败] 无法移动到失败目录: {move_error}")
+            finished = time.time()
+
+            with self._lock:
+                self._pending.pop(path, None)
+                self._in_progress.pop(path, None)
+                if status == "done":
+                    self._processed += 1
+                    self._latencies.append(finished - enqueued_at)
+                else:
+                    self._failed += 1
+                self._recent.append({
+                    "file": path,
+                    "status": status,
+                    "queue_wait": round(start - enqueued_at, 3),
+                    "processing": round(finished - start, 3),
+                    "latency": round(finished - enqueued_at, 3),
+                    "finished_at": finished,
+                })
+            self.queue.task_done()
+            self.write_status()
+
+    def status(self) -> Dict:
+        """当前状态：队列深度、处理中文件、累计数量和延迟统计"""
+        with self._lock:
+            latencies = np.asarray(self._latencies, dtype=np.float64)
+            now = time.time()
+            return {
+                "updated_at": now,
+                "uptime": round(now - self._started, 1),
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "in_progress": {path: round(now - start, 3) for path, start in self._in_progress.items()},
+                "processed": self._processed,
+                "failed": self._failed,
+                "backpressure_events": self._backpressure_events,
+                "latency": {
+                    "last": round(float(latencies[-1]), 3) if len(latencies) else None,
+                    "mean": round(float(latencies.mean()), 3) if len(latencies) else None,
+                    "p95": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+                },
+                "recent": list(self._recent),
+            }
+
+    def write_status(self) -> None:
+        """原子写入状态文件，读取方不会看到写了一半的JSON"""
+        status = self.status()
+        os.makedirs(os.path.dirname(self.status_file) or '.', exist_ok=True)
+        tmp_file = f"{self.status_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(status, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.status_file)
+
+    def run(self, once: bool = False) -> None:
+        """
+        启动扫描和处理
+
+        Args:
+            once: 为True时只处理当前已有的文件（包括因背压暂缓的文件），处理完后退出
+        """
+        for directory in (self.input_dir, self.output_dir, self.done_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        if self.model is None:
+            self.load_model()
+
+        threads = [threading.Thread(target=self.worker_loop, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        print(f"[信息] 开始监控: {self.input_dir}（队列容量 {self.queue.maxsize}，工作线程 {self.workers}）")
+
+        try:
+            while not self.stop_event.is_set():
+                self.scan_once()
+                self.write_status()
+                if once:
+                    self.queue.join()
+                    if self.scan_once() == 0 and self.queue.empty():
+                        break
+                    continue
+                self.stop_event.wait(self.poll_interval)
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+            self.write_status()
+            print(f"[信息] 已停止：完成 {self._processed} 个，失败 {self._failed} 个")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='监控输入目录，常驻模型逐个处理新图片')
+    parser.add_argument('--input-dir', default=DEFAULT_INPUT_DIR, help='监控的输入目录')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='结果目录')
+    parser.add_argument('--done-dir', default=DEFAULT_DONE_DIR, help='处理完成的原图移动到该目录')
+    parser.add_argument('--failed-dir', default=DEFAULT_FAILED_DIR, help='处理失败的原图移动到该目录')
+    parser.add_argument('--status-file', default=None, help='状态文件路径，默认为 结果目录/status.json')
+    parser.add_argument('--config', default='config.json', help='配置文件路径')
+    parser.add_argument('--model', default='official', choices=['official', 'demo'], help='模型类型')
+    parser.add_argument('--weights', default=None, help='demo模型的权重文件路径')
+    parser.add_argument('--size', type=int, default=1024, help='模型输入的方形边长')
+    parser.add_argument('--device', default='auto', choices=['auto', 'cpu', 'cuda'], help='推理设备')
+    parser.add_argument('--queue-size', type=int, default=16, help='队列容量，队列满时暂停入队')
+    parser.add_argument('--workers', type=int, default=1, help='处理线程数')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='扫描间隔（秒）')
+    parser.add_argument('--settle-time', type=float, default=2.0, help='文件静止多久后才入队（秒）')
+    parser.add_argument('--priority', default='oldest', choices=['oldest', 'smallest'],
+                        help='出队顺序：oldest=最早修改的先处理，smallest=最小的文件先处理')
+    parser.add_argument('--min-area', type=int, default=None, help='最小元素面积阈值')
+    parser.add_argument('--dedup', action='store_true', help='对重复图案去重')
+    parser.add_argument('--background-only', '-b', action='store_true', help='颜色分析只统计背景像素')
+    parser.add_argument('--once', action='store_true', help='处理完当前已有的文件后退出')
+
+    args = parser.parse_args()
+
+    daemon = HotFolderDaemon(args.input_dir, args.output_dir, args.done_dir, args.failed_dir,
+                             status_file=args.status_file, config_file=args.config,
+                             model_kind=args.model, weights=args.weights, size=args.size,
+                             device=args.device, queue_size=args.queue_size, workers=args.workers,
+                             poll_interval=args.poll_interval, settle_time=args.settle_time,
+                             priority=args.priority, min_area=args.min_area, dedup=args.dedup,
+                             background_only=args.background_only)
+
+    def handle_signal(signum, frame):
+        print("\n[信息] 收到停止信号，处理完队列中的文件后退出...")
+        daemon.stop_event.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    daemon.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()